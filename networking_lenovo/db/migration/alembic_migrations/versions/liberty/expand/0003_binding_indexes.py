@@ -0,0 +1,40 @@
+# Copyright (c) 2017, Lenovo. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Indexes of the NOS port bindings
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2017-03-14 10:12:41.503210
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+
+from alembic import op
+
+
+TABLE = 'lenovo_ml2_nosport_bindings'
+
+
+def upgrade():
+    # The bindings are made unique by 0007, on the integer switch and
+    # interface ids: a key on the three strings may exceed the index size
+    # limit of MySQL under utf8mb4.
+    op.create_index('ix_lenovo_nosport_bindings_switch_ip_port_id',
+                    TABLE, ['switch_ip', 'port_id'])
+    op.create_index('ix_lenovo_nosport_bindings_instance_id_vlan_id',
+                    TABLE, ['instance_id', 'vlan_id'])
@@ -0,0 +1,116 @@
+# Copyright (c) 2017, Lenovo. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Normalized switch and switch interface tables
+
+Stop every neutron-server before this upgrade: the bindings written
+meanwhile by a server of the previous release get no switch and
+interface ids, and the upgraded servers, which look the bindings up by
+these ids, never see them.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2017-03-28 16:05:12.871342
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+BINDINGS = 'lenovo_ml2_nosport_bindings'
+SWITCHES = 'lenovo_ml2_nos_switches'
+INTERFACES = 'lenovo_ml2_nos_switch_interfaces'
+
+# Bindings updated per statement by the backfill, to bound the undo log
+# of each statement on large tables.
+BACKFILL_BATCH = 5000
+
+
+def upgrade():
+    op.create_table(
+        SWITCHES,
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('switch_ip', sa.String(length=255), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('switch_ip'),
+    )
+    op.create_table(
+        INTERFACES,
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('switch_id', sa.Integer(), nullable=False),
+        sa.Column('port_id', sa.String(length=255), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.ForeignKeyConstraint(['switch_id'], ['%s.id' % SWITCHES],
+                                ondelete='CASCADE'),
+        sa.UniqueConstraint('switch_id', 'port_id',
+                            name='uniq_lenovo_nos_switch_interfaces0port'),
+    )
+
+    op.add_column(BINDINGS, sa.Column('switch_id', sa.Integer(),
+                                      nullable=True))
+    op.add_column(BINDINGS, sa.Column('interface_id', sa.Integer(),
+                                      nullable=True))
+    op.create_foreign_key('fk_lenovo_nosport_bindings_switch_id',
+                          BINDINGS, SWITCHES, ['switch_id'], ['id'],
+                          ondelete='CASCADE')
+    op.create_foreign_key('fk_lenovo_nosport_bindings_interface_id',
+                          BINDINGS, INTERFACES, ['interface_id'], ['id'],
+                          ondelete='CASCADE')
+    op.create_index('ix_lenovo_nosport_bindings_switch_id_vlan_id',
+                    BINDINGS, ['switch_id', 'vlan_id'])
+    op.create_index('ix_lenovo_nosport_bindings_interface_id_vlan_id',
+                    BINDINGS, ['interface_id', 'vlan_id'])
+
+    backfill()
+
+
+def backfill():
+    """Fill the switch tables and the binding ids from the strings."""
+    op.execute(
+        "INSERT INTO %(switches)s (switch_ip) "
+        "SELECT DISTINCT switch_ip FROM %(bindings)s "
+        "WHERE switch_ip IS NOT NULL" %
+        {'switches': SWITCHES, 'bindings': BINDINGS})
+    op.execute(
+        "INSERT INTO %(interfaces)s (switch_id, port_id) "
+        "SELECT DISTINCT s.id, b.port_id FROM %(bindings)s b "
+        "JOIN %(switches)s s ON s.switch_ip = b.switch_ip "
+        "WHERE b.port_id IS NOT NULL" %
+        {'interfaces': INTERFACES, 'switches': SWITCHES,
+         'bindings': BINDINGS})
+
+    bind = op.get_bind()
+    min_id, max_id = bind.execute(
+        sa.text("SELECT MIN(binding_id), MAX(binding_id) FROM %s" %
+                BINDINGS)).first()
+    if max_id is None:
+        return
+    update = sa.text(
+        "UPDATE %(bindings)s SET "
+        "switch_id = (SELECT s.id FROM %(switches)s s "
+        "WHERE s.switch_ip = %(bindings)s.switch_ip), "
+        "interface_id = (SELECT i.id FROM %(interfaces)s i "
+        "JOIN %(switches)s s ON s.id = i.switch_id "
+        "WHERE s.switch_ip = %(bindings)s.switch_ip "
+        "AND i.port_id = %(bindings)s.port_id) "
+        "WHERE binding_id >= :first AND binding_id < :last" %
+        {'bindings': BINDINGS, 'switches': SWITCHES,
+         'interfaces': INTERFACES})
+    for first in range(min_id, max_id + 1, BACKFILL_BATCH):
+        bind.execute(update, first=first, last=first + BACKFILL_BATCH)
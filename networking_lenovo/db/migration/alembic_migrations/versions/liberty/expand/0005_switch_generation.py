@@ -0,0 +1,36 @@
+# Copyright (c) 2017, Lenovo. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Generation counter of the bindings of a switch
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2017-04-11 09:47:30.118205
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column(
+        'lenovo_ml2_nos_switches',
+        sa.Column('generation', sa.BigInteger(), nullable=False,
+                  server_default='0')
+    )
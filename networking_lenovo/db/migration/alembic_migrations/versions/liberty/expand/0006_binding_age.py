@@ -0,0 +1,48 @@
+# Copyright (c) 2017, Lenovo. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Creation time and configuration attempts of the NOS port bindings
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2017-04-25 14:21:08.660713
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+TABLE = 'lenovo_ml2_nosport_bindings'
+
+
+def upgrade():
+    op.add_column(TABLE, sa.Column('created_at', sa.DateTime(),
+                                   nullable=True))
+    op.add_column(TABLE, sa.Column('attempts', sa.Integer(), nullable=False,
+                                   server_default='0'))
+    op.add_column(TABLE, sa.Column('claimed_until', sa.DateTime(),
+                                   nullable=True))
+    # The age of the existing bindings is unknown, start counting now.
+    op.execute("UPDATE %s SET created_at = CURRENT_TIMESTAMP" % TABLE)
+    op.create_index('ix_lenovo_nosport_bindings_processed_created_at',
+                    TABLE, ['processed', 'created_at'])
+    # The orphaned bindings are looked up by age whatever their processed
+    # flag.
+    op.create_index('ix_lenovo_nosport_bindings_created_at',
+                    TABLE, ['created_at'])
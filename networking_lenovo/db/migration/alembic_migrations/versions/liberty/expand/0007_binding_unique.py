@@ -0,0 +1,78 @@
+# Copyright (c) 2017, Lenovo. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Uniqueness of the NOS port bindings
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2017-05-09 11:32:17.402918
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0007'
+down_revision = '0006'
+
+from alembic import op
+from oslo_log import log as logging
+import sqlalchemy as sa
+
+
+LOG = logging.getLogger(__name__)
+
+TABLE = 'lenovo_ml2_nosport_bindings'
+
+# Key of a binding.  The integer switch and interface ids keep the index
+# at about 1 KB under utf8mb4, where the switch_ip, port_id and
+# instance_id strings would take 3 KB.
+KEY = ['switch_id', 'interface_id', 'vlan_id', 'instance_id']
+
+
+def upgrade():
+    remove_duplicates()
+    # Its (switch_id, interface_id) prefix also serves the per port
+    # lookups.
+    op.create_unique_constraint(
+        'uniq_lenovo_nosport_bindings0binding', TABLE, KEY)
+
+
+def remove_duplicates():
+    """Keep the oldest of duplicate bindings, logging the others.
+
+    A duplicate only repeats the key of the binding kept, so removing it
+    does not change the switch configuration the bindings describe.
+    """
+    bind = op.get_bind()
+    key = ', '.join(KEY)
+    duplicates = bind.execute(sa.text(
+        "SELECT b.binding_id, b.switch_ip, b.port_id, b.vlan_id, "
+        "b.instance_id FROM %(table)s b JOIN "
+        "(SELECT %(key)s, MIN(binding_id) AS keep_id FROM %(table)s "
+        "GROUP BY %(key)s HAVING COUNT(*) > 1) d "
+        "ON %(join)s AND b.binding_id <> d.keep_id" %
+        {'table': TABLE, 'key': key,
+         'join': ' AND '.join('b.%s = d.%s' % (column, column)
+                              for column in KEY)})).fetchall()
+    if not duplicates:
+        return
+    for row in duplicates:
+        LOG.warning("Removing duplicate NOS port binding %(id)s: switch "
+                    "%(switch)s port %(port)s vlan %(vlan)s instance "
+                    "%(instance)s",
+                    {'id': row[0], 'switch': row[1], 'port': row[2],
+                     'vlan': row[3], 'instance': row[4]})
+    delete = sa.text("DELETE FROM %s WHERE binding_id = :binding_id" %
+                     TABLE)
+    for row in duplicates:
+        bind.execute(delete, binding_id=row[0])
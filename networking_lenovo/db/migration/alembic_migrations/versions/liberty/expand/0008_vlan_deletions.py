@@ -0,0 +1,46 @@
+# Copyright (c) 2017, Lenovo. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Deferred VLAN deletions
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2017-05-10 15:04:52.381726
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0008'
+down_revision = '0007'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'lenovo_ml2_nos_vlan_deletions',
+        sa.Column('switch_id', sa.Integer(), nullable=False),
+        sa.Column('vlan_id', sa.Integer(), autoincrement=False,
+                  nullable=False),
+        sa.Column('delete_after', sa.DateTime(), nullable=False),
+        sa.Column('claim_id', sa.String(length=36), nullable=True),
+        sa.Column('claimed_until', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('switch_id', 'vlan_id'),
+        sa.ForeignKeyConstraint(['switch_id'],
+                                ['lenovo_ml2_nos_switches.id'],
+                                ondelete='CASCADE'),
+    )
+    op.create_index('ix_lenovo_nos_vlan_deletions_delete_after',
+                    'lenovo_ml2_nos_vlan_deletions', ['delete_after'])
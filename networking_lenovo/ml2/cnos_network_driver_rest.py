@@ -17,18 +17,25 @@
 Implements CNOS config over REST API Client
 """
 
+import collections
+import contextlib
+
 from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_utils import excutils
 
+from networking_lenovo.ml2 import cnos_state_mirror
 from networking_lenovo.ml2 import config as conf
 from networking_lenovo.ml2 import constants as const
 from networking_lenovo.ml2 import exceptions as cexc
+from networking_lenovo.ml2 import nos_retry
+from networking_lenovo.ml2 import vlan_set
 from networking_lenovo.ml2 import nos_db_v2
 
 from requests.utils import quote
 import requests
 from rest_client import LenovoRestClient
+from rest_client import LenovoRestSessionPool
 
 
 LOG = logging.getLogger(__name__)
@@ -50,6 +57,19 @@ class LenovoCNOSDriverREST(object):
 
     def __init__(self):
         self.switches = conf.ML2MechLenovoConfig.nos_dict
+        # (host, if_name) -> (bridgeport_mode, pvid, VlanSet or None) last
+        # seen or written
+        self._intf_cache = {}
+        self._retry_policy = nos_retry.RetryPolicy.from_config()
+        self._mirror = None
+        if cfg.CONF.ml2_lenovo.cnos_state_mirror:
+            self._mirror = cnos_state_mirror.CNOSStateMirror(
+                cfg.CONF.ml2_lenovo.cnos_state_mirror_ttl)
+        self._pool = None
+        if cfg.CONF.ml2_lenovo.rest_session_pool_size:
+            self._pool = LenovoRestSessionPool(
+                self._connect, cfg.CONF.ml2_lenovo.rest_session_pool_size,
+                cfg.CONF.ml2_lenovo.rest_session_idle_ttl)
 
 ############ Private Methods ############################
     def _dbg_str(self, host, op, vlan_id, 
@@ -73,8 +93,8 @@ class LenovoCNOSDriverREST(object):
         return dbg_str
 
 
-    def _connect(self, host): 
-        """ Connect to the switch """
+    def _connect(self, host, deadline=None):
+        """ Connect to the switch, within 'deadline' if given """
         user = self.switches[host, const.USERNAME]
         password = self.switches[host, const.PASSWORD]
         https_str = self.switches.get((host, self.REST_USE_HTTPS_STR),
@@ -89,7 +109,11 @@ class LenovoCNOSDriverREST(object):
         tcp_port = self.switches.get((host, self.REST_TCP_PORT_STR),
                                      default_port)
 
-        conn = LenovoRestClient(host, user, password, tcp_port, use_https)
+        conn = LenovoRestClient(host, user, password, tcp_port, use_https,
+                                cfg.CONF.ml2_lenovo.switch_connect_timeout,
+                                cfg.CONF.ml2_lenovo.switch_read_timeout,
+                                self._retry_policy)
+        conn.deadline = deadline
         try:
             conn.login()
         except Exception as e:
@@ -97,6 +121,56 @@ class LenovoCNOSDriverREST(object):
         return conn
 
 
+    @contextlib.contextmanager
+    def _session(self, host, deadline=None):
+        """
+        Logged-in connection to the switch for the block's duration,
+        whose requests all complete within 'deadline' if given.
+        The switch state mirror is (re)loaded if stale and dropped if the
+        block fails.
+        """
+        try:
+            if self._pool:
+                with self._pool.connection(host, deadline) as conn:
+                    self._refresh_mirror(conn, host)
+                    yield conn
+                return
+
+            conn = self._connect(host, deadline)
+            try:
+                self._refresh_mirror(conn, host)
+                yield conn
+            finally:
+                conn.close()
+        except Exception:
+            if self._mirror:
+                self._mirror.invalidate(host)
+            raise
+
+    def _read_switch_state(self, conn):
+        """
+        Bulk read of the vlan and vlan_interface tables of a switch
+        Returns:
+            (set of VLAN ids, list of interface configurations)
+        """
+        resp = conn.get(self.VLAN_REST_OBJ)
+        vlan_ids = set(vlan['vlan_id']
+                       for vlan in self._check_process_resp(resp))
+
+        resp = conn.get(self.VLAN_IFACE_REST_OBJ)
+        intf_infos = self._check_process_resp(resp)
+        for intf_info in intf_infos:
+            self._cache_intf(conn.ip, intf_info['if_name'], intf_info)
+        if self._mirror:
+            self._mirror.load(conn.ip, vlan_ids, intf_infos)
+        return vlan_ids, intf_infos
+
+    def _refresh_mirror(self, conn, host):
+        if self._mirror and not self._mirror.is_fresh(host):
+            LOG.debug("host %s: loading the switch state" % host)
+            self._read_switch_state(conn)
+
+
     def _check_process_resp(self, resp, expected_fields=None):
         """
         Check that a HTTP response was OK and in valid JSON format
@@ -150,14 +224,38 @@ class LenovoCNOSDriverREST(object):
             vlan_id - vlan identifier
             vlan_name - vlan name
         """
-
         req_js = {}
         req_js['vlan_id'] = vlan_id
         req_js['vlan_name'] = vlan_name
         req_js['admin_state'] = 'up'
 
         resp = conn.post(self.VLAN_REST_OBJ, req_js)
-        self._check_process_resp(resp)
+        if resp.status_code != LenovoRestClient.RESP_CODE_OK:
+            # Creating a VLAN that exists, e.g. one created by another
+            # neutron-server, is fine.
+            if (conn.get(self.VLAN_REST_OBJ + str(vlan_id)).status_code !=
+                    LenovoRestClient.RESP_CODE_OK):
+                self._check_process_resp(resp)
+            LOG.debug("host %s: vlan %d already exists" % (conn.ip, vlan_id))
+        if self._mirror:
+            self._mirror.add_vlan(conn.ip, vlan_id)
+
+    def _delete_vlan(self, conn, vlan_id):
+        """
+        Internal method to delete the vlan
+        Parameters:
+            conn - connection handler
+            vlan_id - vlan identifier
+        """
+        resp = conn.delete(self.VLAN_REST_OBJ + str(vlan_id))
+        # A VLAN already gone, e.g. after a retried DELETE, is fine.
+        if resp.status_code not in (LenovoRestClient.RESP_CODE_OK,
+                                    LenovoRestClient.RESP_CODE_NOT_FOUND):
+            raise cexc.NOSRestHTTPError(http_code=resp.status_code,
+                      http_reason=resp.reason, http_op=resp.request.method,
+                      url=resp.url, http_response=resp.text)
+        if self._mirror:
+            self._mirror.remove_vlan(conn.ip, vlan_id)
 
 
     def _conf_intf(self, conn, interface, mode, pvid, vlan_list):
@@ -195,36 +293,184 @@ class LenovoCNOSDriverREST(object):
         Parameters:
             vlist - the list of vlans the port 
                     or the special strings all or none
+        Returns:
+            a VlanSet
         """
-        if vlist == "all":
-            return list(range(1, 4095))
-        elif vlist == "none":
-            return []
-        elif type(vlist) is not list:
-            raise Exception("Unexpected vlan list: " + str(vlist))
-        else:
-            return vlist
+        return vlan_set.VlanSet.from_cnos(vlist)
 
-    def _add_intf_to_vlan(self, conn, vlan_id, interface, support_old_release=False):
+    def _vlist_request(self, op, vlans, new_vlans):
         """
-        Internal method to add an interface to a vlan
+        Internal method to build the shortest 'vlans' request adding or
+        removing vlans: ["add"/"remove", vlans...] or the resulting list
+        as ["except", vlans not trunked...]
+        """
+        req_vlist = [self.REST_VLAN_OPERATION[op]] + list(vlans)
+        excluded = new_vlans.complement()
+        if new_vlans and excluded and len(excluded) < len(vlans):
+            req_vlist = [self.REST_VLAN_OPERATION["except"]] + list(excluded)
+        return req_vlist
+
+    def _get_intf_info(self, conn, interface):
+        """
+        Internal method to read the bridgeport configuration of an interface
+        Parameters:
+            conn - connection handler
+            interface - interface identifier (name)
+        """
+        if self._mirror:
+            intf_info = self._mirror.get_intf(conn.ip, interface)
+            if intf_info is not None:
+                intf_info['from_mirror'] = True
+                return intf_info
+        return self._read_intf_info(conn, interface)
+
+    def _read_intf_info(self, conn, interface):
+        """
+        Internal method to read the bridgeport configuration of an
+        interface from the switch, bypassing the mirror
         Parameters:
             conn - connection handler
-            vlan_id - vlan identifier
             interface - interface identifier (name)
         """
-
         obj = self.VLAN_IFACE_REST_OBJ + quote(interface, safe='')
 
         resp = conn.get(obj)
         intf_info = self._check_process_resp(resp, expected_fields=['vlans', 'pvid'])
+        self._cache_intf(conn.ip, interface, intf_info)
+        if self._mirror:
+            self._mirror.set_intf(conn.ip, interface, intf_info)
+        return intf_info
 
-        crt_vlist = self._get_vlist(intf_info['vlans'])
-        if vlan_id in crt_vlist:
+    def _cache_intf(self, host, interface, intf_info):
+        """
+        Internal method to remember the mode, pvid and vlans of an
+        interface for _fast_trunk_update
+        """
+        try:
+            vlans = self._get_vlist(intf_info.get('vlans'))
+        except ValueError:
+            vlans = None
+        self._intf_cache[host, interface] = (
+            intf_info.get('bridgeport_mode'), intf_info.get('pvid'), vlans)
+
+    def _fast_trunk_update(self, conn, interface, op, vlan_ids,
+                           support_old_release=False):
+        """
+        Internal method sending the delta PUT of a trunk change without
+        reading the interface first. The mode, pvid and vlans come from
+        the cache; the delta itself is idempotent on the switch. A remove
+        is only sent this way if at least two vlans remain trunked.
+        Parameters:
+            conn - connection handler
+            interface - interface identifier (name)
+            op - "add" or "remove"
+            vlan_ids - vlan identifiers
+        Returns:
+            True if the switch accepted the change, False if the caller
+            has to read the interface and take the regular path
+        """
+        if support_old_release or not cfg.CONF.ml2_lenovo.cnos_write_only_trunk_updates:
+            return False
+
+        # A mirrored interface is changed without a GET anyway.
+        if self._mirror and self._mirror.get_intf(conn.ip, interface):
+            return False
+
+        cached = self._intf_cache.get((conn.ip, interface))
+        if cached is None:
+            return False
+        mode, pvid, vlans = cached
+        if mode != 'trunk':
+            return False
+        if op == "remove":
+            # Moving the pvid, or leaving a single VLAN, which the full
+            # update turns into an access port, needs the VLAN list.
+            if (pvid in vlan_ids or vlans is None or
+                    len(vlans - vlan_ids) < 2):
+                return False
+
+        req_vlist = [self.REST_VLAN_OPERATION[op]] + list(vlan_ids)
+        resp = self._conf_intf(conn, interface, mode, pvid, req_vlist)
+        if resp.status_code != LenovoRestClient.RESP_CODE_OK:
+            LOG.debug("host %s %s: write-only %s of vlans %s rejected, "
+                      "reading the interface" %
+                      (conn.ip, interface, op, vlan_ids))
+            del self._intf_cache[conn.ip, interface]
+            return False
+        if vlans is not None:
+            if op == "add":
+                vlans = vlans | vlan_ids
+            else:
+                vlans = vlans - vlan_ids
+        self._intf_cache[conn.ip, interface] = (mode, pvid, vlans)
+        return True
+
+    def _resend_delta(self, conn, intf_info, op, vlan_ids, interface,
+                      support_old_release=False):
+        """
+        Internal method sending a trunk delta that the mirrored
+        configuration of the interface makes a no-op. The mirror only
+        sees the writes of this process, and the delta is idempotent, so
+        a change is never skipped on its word alone.
+        Parameters:
+            conn - connection handler
+            intf_info - current interface configuration (_get_intf_info)
+            op - "add" or "remove"
+            vlan_ids - vlan identifiers
+            interface - interface identifier (name)
+        """
+        if (not vlan_ids or support_old_release or
+                not intf_info.get('from_mirror') or
+                intf_info.get('bridgeport_mode') != 'trunk'):
             return
+        req_vlist = [self.REST_VLAN_OPERATION[op]] + list(vlan_ids)
+        resp = self._conf_intf(conn, interface, 'trunk', intf_info['pvid'],
+                               req_vlist)
+        self._check_process_resp(resp)
+
+    def _is_delta(self, op, req_vlist, support_old_release):
+        """
+        Internal method telling whether a 'vlans' request only adds or
+        removes the given vlans, leaving the other vlans of the interface
+        as they are on the switch
+        """
+        return (not support_old_release and
+                req_vlist[:1] == [self.REST_VLAN_OPERATION[op]])
+
+    def _written_intf_info(self, conn, interface, intf_info, new_intf_info):
+        """
+        Internal method to remember the configuration of an interface
+        after a write. A configuration derived from the mirror stays
+        marked as such.
+        """
+        if intf_info.get('from_mirror'):
+            new_intf_info['from_mirror'] = True
+        self._cache_intf(conn.ip, interface, new_intf_info)
+        if self._mirror:
+            self._mirror.set_intf(conn.ip, interface, new_intf_info)
+        return new_intf_info
+
+    def _add_intf_to_vlans(self, conn, intf_info, vlan_ids, interface,
+                           support_old_release=False):
+        """
+        Internal method to add an interface to several vlans with one PUT
+        Parameters:
+            conn - connection handler
+            intf_info - current interface configuration (_get_intf_info)
+            vlan_ids - vlan identifiers
+            interface - interface identifier (name)
+        Returns:
+            the interface configuration after the change
+        """
+        crt_vlist = self._get_vlist(intf_info['vlans'])
+        add_vlist = vlan_set.VlanSet(vlan_ids) - crt_vlist
+        if not add_vlist:
+            self._resend_delta(conn, intf_info, "add", vlan_ids, interface,
+                               support_old_release)
+            return intf_info
 
-        new_vlist = crt_vlist[ : ]
-        new_vlist.append(vlan_id)
+        new_vlist = crt_vlist | add_vlist
+        req_vlist = list(new_vlist)
 
         pvid = intf_info['pvid']
         mode = 'trunk'
@@ -235,59 +481,118 @@ class LenovoCNOSDriverREST(object):
             crt_mode = intf_info['bridgeport_mode']
             # If current mode is access mode, call with "{trunk, ["add", vlan_id]}" will configure the port as trunk all.
             if crt_mode == "access":
-                new_vlist = [pvid, vlan_id]
+                req_vlist = [pvid] + list(add_vlist)
             else:
-                new_vlist = [self.REST_VLAN_OPERATION["add"]]
-                new_vlist.append(vlan_id)
-
-        resp = self._conf_intf(conn, interface, mode, pvid, new_vlist)
+                req_vlist = self._vlist_request("add", add_vlist, new_vlist)
+
+        if (intf_info.get('from_mirror') and
+                not self._is_delta("add", req_vlist, support_old_release)):
+            # The request replaces the vlans or mode of the interface:
+            # build it from the switch, where another process may have
+            # trunked vlans the mirror does not know of.
+            return self._add_intf_to_vlans(
+                conn, self._read_intf_info(conn, interface), vlan_ids,
+                interface, support_old_release)
+
+        resp = self._conf_intf(conn, interface, mode, pvid, req_vlist)
         self._check_process_resp(resp)
+        return self._written_intf_info(
+            conn, interface, intf_info,
+            {'vlans': new_vlist, 'pvid': pvid, 'bridgeport_mode': mode})
 
-
-
-    def _rem_intf_from_vlan(self, conn, vlan_id, interface, support_old_release=False):
+    def _rem_intf_from_vlans(self, conn, intf_info, vlan_ids, interface,
+                             support_old_release=False):
         """
-        Internal method to remove an interface from a vlan
+        Internal method to remove an interface from several vlans with one PUT
         Parameters:
             conn - connection handler
-            vlan_id - vlan identifier
+            intf_info - current interface configuration (_get_intf_info)
+            vlan_ids - vlan identifiers
             interface - interface identifier (name)
+        Returns:
+            the interface configuration after the change
         """
-
-        obj = self.VLAN_IFACE_REST_OBJ + quote(interface, safe='')
-
-        resp = conn.get(obj)
-        intf_info = self._check_process_resp(resp, expected_fields=['vlans', 'pvid'])
-
         crt_vlist = self._get_vlist(intf_info['vlans'])
-        if vlan_id not in crt_vlist:
-            return
+        rem_vlist = crt_vlist & vlan_ids
+        if not rem_vlist:
+            self._resend_delta(conn, intf_info, "remove", vlan_ids,
+                               interface, support_old_release)
+            return intf_info
 
-        new_vlist = crt_vlist[ : ]
-        new_vlist.remove(vlan_id)
+        new_vlist = crt_vlist - rem_vlist
 
         pvid = intf_info['pvid']
 
+        if intf_info.get('from_mirror') and (
+                support_old_release or pvid in rem_vlist or
+                len(new_vlist) < 2):
+            # The request would replace the vlans, pvid or mode of the
+            # interface: build it from the switch, where another process
+            # may have trunked vlans the mirror does not know of.
+            return self._rem_intf_from_vlans(
+                conn, self._read_intf_info(conn, interface), vlan_ids,
+                interface, support_old_release)
+
         if not new_vlist:
-            raise Exception('Port ' + str(interface) + ' was only in vlan ' + str(vlan_id))
+            raise Exception('Port ' + str(interface) + ' was only in vlan(s) ' + rem_vlist.to_ranges())
 
-        if pvid == vlan_id:
-            pvid = new_vlist[0]
+        if pvid in rem_vlist:
+            pvid = new_vlist.first()
 
         if len(new_vlist) > 1:
             mode = 'trunk'
         else:
             mode = 'access'
 
+        req_vlist = list(new_vlist)
         if not support_old_release:
             if mode == 'access':
-                new_vlist = [pvid]
+                req_vlist = [pvid]
             else:
-                new_vlist = [self.REST_VLAN_OPERATION["remove"]]
-                new_vlist.append(vlan_id)
-
-        resp = self._conf_intf(conn, interface, mode, pvid, new_vlist)
+                req_vlist = self._vlist_request("remove", rem_vlist,
+                                                new_vlist)
+                if (intf_info.get('from_mirror') and
+                        not self._is_delta("remove", req_vlist,
+                                           support_old_release)):
+                    return self._rem_intf_from_vlans(
+                        conn, self._read_intf_info(conn, interface),
+                        vlan_ids, interface, support_old_release)
+
+        resp = self._conf_intf(conn, interface, mode, pvid, req_vlist)
         self._check_process_resp(resp)
+        return self._written_intf_info(
+            conn, interface, intf_info,
+            {'vlans': new_vlist, 'pvid': pvid, 'bridgeport_mode': mode})
+
+    def _add_intf_to_vlan(self, conn, vlan_id, interface, support_old_release=False):
+        """
+        Internal method to add an interface to a vlan
+        Parameters:
+            conn - connection handler
+            vlan_id - vlan identifier
+            interface - interface identifier (name)
+        """
+        if self._fast_trunk_update(conn, interface, "add", [vlan_id],
+                                   support_old_release):
+            return
+        intf_info = self._get_intf_info(conn, interface)
+        self._add_intf_to_vlans(conn, intf_info, [vlan_id], interface,
+                                support_old_release)
+
+    def _rem_intf_from_vlan(self, conn, vlan_id, interface, support_old_release=False):
+        """
+        Internal method to remove an interface from a vlan
+        Parameters:
+            conn - connection handler
+            vlan_id - vlan identifier
+            interface - interface identifier (name)
+        """
+        if self._fast_trunk_update(conn, interface, "remove", [vlan_id],
+                                   support_old_release):
+            return
+        intf_info = self._get_intf_info(conn, interface)
+        self._rem_intf_from_vlans(conn, intf_info, [vlan_id], interface,
+                                  support_old_release)
 
 
     def _get_ifname(self, intf_type, interface):
@@ -308,64 +613,162 @@ class LenovoCNOSDriverREST(object):
 
 
 ############# Public Methods ############################
-    def delete_vlan(self, host, vlan_id):
+    def probe(self, host, deadline=None):
+        """Check that the switch accepts a REST login."""
+        conn = self._connect(host, deadline)
+        conn.close()
+
+
+    def delete_vlan(self, host, vlan_id, deadline=None):
         """Delete a VLAN on CNOS Switch given the VLAN ID."""
 
         dbg_str = self._dbg_str(host, "delete", vlan_id)
         LOG.debug(dbg_str)
 
-        conn = self._connect(host)
-        obj = self.VLAN_REST_OBJ + str(vlan_id)
-        resp = conn.delete(obj)
-        conn.close()
+        with self._session(host, deadline) as conn:
+            self._delete_vlan(conn, vlan_id)
 
 
-    def enable_vlan_on_trunk_int(self, host, vlan_id, intf_type, interface):
+    def enable_vlan_on_trunk_int(self, host, vlan_id, intf_type, interface,
+                                 deadline=None):
         """Enable a VLAN on a trunk interface."""
 
         dbg_str = self._dbg_str(host, "enable", vlan_id, 
                                 interface=interface, intf_type=intf_type)
         LOG.debug(dbg_str)
 
-        conn = self._connect(host)
-        try:
-            if_name = self._get_ifname(intf_type, interface)
-            self._add_intf_to_vlan(conn, vlan_id, if_name, self._support_old_release(host))
-        except Exception as e:
-            raise cexc.NOSConfigFailed(config=dbg_str, exc=e)
-        conn.close()
+        with self._session(host, deadline) as conn:
+            try:
+                if_name = self._get_ifname(intf_type, interface)
+                self._add_intf_to_vlan(conn, vlan_id, if_name, self._support_old_release(host))
+            except Exception as e:
+                raise cexc.NOSConfigFailed(config=dbg_str, exc=e)
 
 
 
-    def disable_vlan_on_trunk_int(self, host, vlan_id, intf_type, interface):
+    def disable_vlan_on_trunk_int(self, host, vlan_id, intf_type, interface,
+                                  deadline=None):
         """Disable a VLAN on a trunk interface."""
 
         dbg_str = self._dbg_str(host, "disable", vlan_id,
                                 interface=interface, intf_type=intf_type)
         LOG.debug(dbg_str)
 
-        conn = self._connect(host)
-        try:
-            if_name = self._get_ifname(intf_type, interface)
-            self._rem_intf_from_vlan(conn, vlan_id, if_name, self._support_old_release(host))
-        except Exception as e:
-            raise cexc.NOSConfigFailed(config=dbg_str, exc=e)
-        conn.close()
+        with self._session(host, deadline) as conn:
+            try:
+                if_name = self._get_ifname(intf_type, interface)
+                self._rem_intf_from_vlan(conn, vlan_id, if_name, self._support_old_release(host))
+            except Exception as e:
+                raise cexc.NOSConfigFailed(config=dbg_str, exc=e)
 
 
-    def create_and_trunk_vlan(self, host, vlan_id, vlan_name, intf_type, interface):
+    def create_and_trunk_vlan(self, host, vlan_id, vlan_name, intf_type, interface,
+                              deadline=None):
         """Create VLAN and trunk it on the specified ports."""
 
         dbg_str = self._dbg_str(host, "create and enable", vlan_id,
                                 vlan_name=vlan_name, interface=interface, intf_type=intf_type)
         LOG.debug(dbg_str)
 
-        conn = self._connect(host)
-        try:
-            if_name = self._get_ifname(intf_type, interface)
-            self._create_vlan(conn, vlan_id, vlan_name)
-            self._add_intf_to_vlan(conn, vlan_id, if_name, self._support_old_release(host))
-        except Exception as e:
-            raise cexc.NOSConfigFailed(config=dbg_str, exc=e)
-        conn.close()
+        with self._session(host, deadline) as conn:
+            try:
+                if_name = self._get_ifname(intf_type, interface)
+                self._create_vlan(conn, vlan_id, vlan_name)
+                self._add_intf_to_vlan(conn, vlan_id, if_name, self._support_old_release(host))
+            except Exception as e:
+                raise cexc.NOSConfigFailed(config=dbg_str, exc=e)
+
+
+    def apply_batch(self, host, operations, deadline=None):
+        """
+        Apply a list of operations over a single REST session.
+
+        VLANs are created first, then the VLAN changes of each interface
+        are merged into one GET and at most one PUT per direction, and the
+        VLANs to delete are removed last.  For a VLAN that is both enabled
+        and disabled on the same interface the last operation wins.
+        """
+
+        dbg_str = "host %s batch of %d operations" % (host, len(operations))
+        LOG.debug(dbg_str)
+
+        created = []
+        deleted = []
+        intf_changes = collections.OrderedDict()
 
+        with self._session(host, deadline) as conn:
+            try:
+                for operation in operations:
+                    if operation.op == const.OP_CREATE_VLAN:
+                        created.append(operation)
+                    elif operation.op == const.OP_DELETE_VLAN:
+                        deleted.append(operation)
+                    elif operation.op in (const.OP_ENABLE_VLAN,
+                                          const.OP_DISABLE_VLAN):
+                        if_name = self._get_ifname(operation.intf_type,
+                                                   operation.interface)
+                        changes = intf_changes.setdefault(
+                            if_name, collections.OrderedDict())
+                        changes[operation.vlan_id] = operation.op
+                    else:
+                        raise Exception("Unknown operation: " + str(operation.op))
+
+                support_old_release = self._support_old_release(host)
+
+                for operation in created:
+                    self._create_vlan(conn, operation.vlan_id, operation.vlan_name)
+
+                for if_name, changes in intf_changes.items():
+                    add_vlist = [vlan_id for vlan_id, op in changes.items()
+                                 if op == const.OP_ENABLE_VLAN]
+                    rem_vlist = [vlan_id for vlan_id, op in changes.items()
+                                 if op == const.OP_DISABLE_VLAN]
+                    if add_vlist and self._fast_trunk_update(
+                            conn, if_name, "add", add_vlist, support_old_release):
+                        add_vlist = []
+                    if rem_vlist and self._fast_trunk_update(
+                            conn, if_name, "remove", rem_vlist, support_old_release):
+                        rem_vlist = []
+                    if not add_vlist and not rem_vlist:
+                        continue
+                    intf_info = self._get_intf_info(conn, if_name)
+                    intf_info = self._add_intf_to_vlans(conn, intf_info, add_vlist,
+                                                        if_name, support_old_release)
+                    self._rem_intf_from_vlans(conn, intf_info, rem_vlist,
+                                              if_name, support_old_release)
+
+                for operation in deleted:
+                    self._delete_vlan(conn, operation.vlan_id)
+            except Exception as e:
+                raise cexc.NOSConfigFailed(config=dbg_str, exc=e)
+
+
+    def get_vlan_state(self, host, interfaces, deadline=None):
+        """
+        Read the VLANs of the switch and the VLAN membership of the given
+        interfaces, with one bulk GET of the vlan and vlan_interface tables.
+        Parameters:
+            interfaces - list of (intf_type, interface)
+        Returns:
+            (set of VLAN ids, {(intf_type, interface): set of VLAN ids})
+        """
+
+        dbg_str = "host %s read vlan state" % host
+        LOG.debug(dbg_str)
+
+        with self._session(host, deadline) as conn:
+            try:
+                vlan_ids, intf_infos = self._read_switch_state(conn)
+                intf_infos = dict((intf_info['if_name'], intf_info)
+                                  for intf_info in intf_infos)
+
+                intf_vlans = {}
+                for intf_type, interface in interfaces:
+                    if_name = self._get_ifname(intf_type, interface)
+                    intf_info = intf_infos.get(if_name)
+                    vlist = self._get_vlist(intf_info['vlans'] if intf_info else "none")
+                    intf_vlans[intf_type, interface] = set(vlist)
+            except Exception as e:
+                raise cexc.NOSConfigFailed(config=dbg_str, exc=e)
+
+        return vlan_ids, intf_vlans
@@ -0,0 +1,98 @@
+# Copyright (c) 2017, Lenovo.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+In-memory mirror of the VLAN configuration of the CNOS switches
+"""
+
+import copy
+import time
+
+from networking_lenovo.ml2 import vlan_set
+
+
+class CNOSStateMirror(object):
+    """
+    Per switch copy of the vlan and vlan_interface REST tables.
+
+    A switch is loaded with one bulk GET of each table and then kept up
+    to date by the driver's own writes.  The copy is dropped when it is
+    older than ttl seconds or when an operation on the switch fails, so
+    changes made behind the driver's back are picked up again.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        # host -> {'loaded_at': time, 'vlans': VlanSet,
+        #          'intfs': {if_name: info}}
+        self._switches = {}
+
+    def is_fresh(self, host):
+        state = self._switches.get(host)
+        return (state is not None and
+                time.time() - state['loaded_at'] <= self.ttl)
+
+    def load(self, host, vlan_ids, intf_infos):
+        """ Replace the state of a switch with the bulk read one """
+        self._switches[host] = {
+            'loaded_at': time.time(),
+            'vlans': vlan_set.VlanSet(vlan_ids),
+            'intfs': dict((info['if_name'], info) for info in intf_infos)}
+
+    def invalidate(self, host=None):
+        if host is None:
+            self._switches.clear()
+        else:
+            self._switches.pop(host, None)
+
+    def _state(self, host):
+        return self._switches.get(host) if self.is_fresh(host) else None
+
+    def has_vlan(self, host, vlan_id):
+        """ True or False if the switch state is known, else None """
+        state = self._state(host)
+        if state is None:
+            return None
+        return vlan_id in state['vlans']
+
+    def add_vlan(self, host, vlan_id):
+        state = self._state(host)
+        if state is not None:
+            state['vlans'].add(vlan_id)
+
+    def remove_vlan(self, host, vlan_id):
+        """ Forget a deleted VLAN, which also leaves every interface """
+        state = self._state(host)
+        if state is None:
+            return
+        state['vlans'].discard(vlan_id)
+        for info in state['intfs'].values():
+            # "all" still means all VLANs, created or not
+            vlans = info.get('vlans')
+            if isinstance(vlans, (list, vlan_set.VlanSet)) and vlan_id in vlans:
+                info['vlans'] = vlan_set.VlanSet.from_cnos(vlans)
+                info['vlans'].discard(vlan_id)
+
+    def get_intf(self, host, if_name):
+        """ Copy of the configuration of an interface, None if unknown """
+        state = self._state(host)
+        if state is None or if_name not in state['intfs']:
+            return None
+        return copy.deepcopy(state['intfs'][if_name])
+
+    def set_intf(self, host, if_name, info):
+        state = self._state(host)
+        if state is not None:
+            state['intfs'][if_name] = dict(info, if_name=if_name)
@@ -26,6 +26,188 @@ ml2_lenovo_opts = [
                 help=_("Distribute SVI interfaces over all switches")),
     cfg.StrOpt('managed_physical_network',
                help=_("The physical network managed by the switches.")),
+    cfg.BoolOpt('async_postcommit', default=False,
+                help=_("Configure the switches from background workers "
+                       "instead of inside the port postcommit call")),
+    cfg.IntOpt('async_workers', default=16, min=1,
+               help=_("Number of background workers configuring switches "
+                      "when async_postcommit is enabled")),
+    cfg.IntOpt('async_queue_size', default=1000, min=1,
+               help=_("Maximum number of pending operations per switch "
+                      "when async_postcommit is enabled")),
+    cfg.IntOpt('switch_fanout_concurrency', default=8, min=1,
+               help=_("Maximum number of switches configured in parallel "
+                      "for a host connected to several switches")),
+    cfg.FloatOpt('trunk_coalesce_window', default=0.0, min=0.0,
+                 help=_("Seconds during which VLAN add/remove requests for "
+                        "the same switch interface are merged into one "
+                        "change. 0 disables coalescing")),
+    cfg.IntOpt('reconcile_interval', default=0, min=0,
+               help=_("Seconds between runs of the reconciliation of the "
+                      "switch VLAN configuration against the database. "
+                      "A single neutron-server runs it at a time, elected "
+                      "through a database lease. Only the CNOS REST driver "
+                      "reads the switch state back; on SNMP and NETCONF "
+                      "switches the reconciliation only replays the "
+                      "bindings left unprocessed. 0 disables "
+                      "reconciliation")),
+    cfg.IntOpt('reconcile_max_ops_per_switch', default=50, min=1,
+               help=_("Maximum number of corrections applied to one switch "
+                      "per reconciliation run")),
+    cfg.BoolOpt('reconcile_dry_run', default=False,
+                help=_("Only report the differences found by the "
+                       "reconciliation and the VLAN usage of each switch, "
+                       "do not correct them")),
+    cfg.BoolOpt('binding_refcount_cache', default=False,
+                help=_("Keep in-memory reference counts of the bindings to "
+                       "decide VLAN creation without querying the "
+                       "database. The counts only see the writes of their "
+                       "own process, so a VLAN they report unused is "
+                       "checked against the database before it is "
+                       "removed")),
+    cfg.IntOpt('binding_refcount_resync_interval', default=60, min=0,
+               help=_("Seconds between rebuilds of the binding reference "
+                      "counts from the database, which bound how long "
+                      "writes of other processes or rolled back writes "
+                      "are missed. The counts may still lag between two "
+                      "rebuilds. 0 disables the rebuild")),
+    cfg.IntOpt('vlan_delete_grace', default=0, min=0,
+               help=_("Seconds an unused VLAN is kept on a switch before it "
+                      "is deleted, so that a new binding can reuse it. "
+                      "0 deletes the VLAN as soon as it is unused")),
+    cfg.IntOpt('vlan_gc_interval', default=10, min=1,
+               help=_("Seconds between sweeps of the VLANs scheduled for "
+                      "deletion when vlan_delete_grace is set")),
+    cfg.IntOpt('vlan_gc_batch_size', default=100, min=1,
+               help=_("Maximum number of VLANs deleted from a switch in "
+                      "one batch")),
+    cfg.IntOpt('vlan_gc_lease', default=300, min=1,
+               help=_("Seconds a sweep may take to delete a batch of VLANs "
+                      "from a switch. A port binding that reuses a VLAN of "
+                      "the batch waits for the sweep meanwhile; a batch not "
+                      "completed in time is taken over by another sweep.")),
+    cfg.BoolOpt('pre_provision_vlans', default=False,
+                help=_("Create the VLAN of a network on every configured "
+                       "switch when the network is created. Port binding "
+                       "still creates a VLAN missing from a switch, e.g. "
+                       "one unreachable when the network was created. The "
+                       "VLAN is deleted when the network is deleted")),
+    cfg.IntOpt('binding_read_cache_size', default=0, min=0,
+               help=_("Maximum number of per switch VLAN and per switch "
+                      "interface binding sets cached by each neutron-server "
+                      "process. The cache is invalidated through a "
+                      "generation counter of each switch bumped after "
+                      "every write commits, so it must be set alike in "
+                      "every neutron-server. 0 disables the cache")),
+    cfg.IntOpt('stale_binding_sweep_interval', default=0, min=0,
+               help=_("Seconds between sweeps of the bindings left "
+                      "unprocessed by a failed postcommit or whose port "
+                      "was deleted. 0 disables the sweeper")),
+    cfg.IntOpt('stale_binding_age', default=600, min=1,
+               help=_("Seconds after its creation an unprocessed binding "
+                      "is considered stale")),
+    cfg.IntOpt('stale_binding_max_attempts', default=3, min=0,
+               help=_("Number of times the switch configuration of a stale "
+                      "binding is retried before the binding is purged")),
+    cfg.IntOpt('stale_binding_batch_size', default=100, min=1,
+               help=_("Maximum number of stale and of orphaned bindings "
+                      "handled per sweep")),
+    cfg.IntOpt('stale_binding_lease', default=300, min=1,
+               help=_("Seconds a sweep may take to retry or purge a "
+                      "binding. No other sweep handles the binding "
+                      "meanwhile; a failed retry is tried again once the "
+                      "lease expires.")),
+    cfg.BoolOpt('use_reader_db', default=False,
+                help=_("Send the binding queries of reports (VLAN usage, "
+                       "dry-run reconciliation) to the reader (slave) "
+                       "database engine of neutron. The queries deciding "
+                       "switch changes always use the writer")),
+    cfg.FloatOpt('reader_freshness_window', default=5.0, min=0.0,
+                 help=_("Seconds after a binding write during which the "
+                        "reports of the same thread still go to the writer "
+                        "database, to read back their own writes")),
+    cfg.IntOpt('rest_session_pool_size', default=4, min=0,
+               help=_("Maximum number of idle logged-in REST sessions kept "
+                      "per CNOS switch for reuse. 0 logs in for every "
+                      "operation")),
+    cfg.IntOpt('rest_session_idle_ttl', default=60, min=1,
+               help=_("Seconds an idle REST session to a CNOS switch is "
+                      "kept before it is closed")),
+    cfg.BoolOpt('cnos_write_only_trunk_updates', default=False,
+                help=_("On CNOS switches not in 'compatible' plugin_mode, "
+                       "send VLAN add/remove deltas of known trunk "
+                       "interfaces without reading the interface first")),
+    cfg.BoolOpt('cnos_state_mirror', default=False,
+                help=_("Keep an in-memory mirror of the VLAN and "
+                       "vlan_interface tables of each CNOS switch, loaded "
+                       "with one bulk read per table and kept current from "
+                       "the driver's own writes. Trunk changes are then "
+                       "computed without reading the interface first. "
+                       "Since the mirror misses the writes of other "
+                       "processes, it never causes a write to be skipped, "
+                       "and only add/remove deltas are built from it: a "
+                       "change of the mode, pvid or whole VLAN list of an "
+                       "interface reads the interface from the switch "
+                       "first.")),
+    cfg.IntOpt('cnos_state_mirror_ttl', default=300, min=1,
+               help=_("Seconds after which the CNOS switch state mirror is "
+                      "reloaded from the switch. The mirror of a switch is "
+                      "also dropped after any failed operation.")),
+    cfg.FloatOpt('switch_connect_timeout', default=5.0, min=0.1,
+                 help=_("Seconds to wait for a connection to a switch "
+                        "(REST and NETCONF).")),
+    cfg.FloatOpt('switch_read_timeout', default=30.0, min=0.1,
+                 help=_("Seconds to wait for the answer to one switch "
+                        "request (REST, NETCONF RPC, or SNMP request "
+                        "including its retries).")),
+    cfg.FloatOpt('switch_io_deadline', default=120.0, min=0,
+                 help=_("Upper bound, in seconds, on the switch I/O done by "
+                        "one port or network postcommit hook. Each request "
+                        "waits at most the time left and no request is "
+                        "started once it is spent. 0 disables the bound.")),
+    cfg.IntOpt('switch_retry_max_attempts', default=3, min=1,
+               help=_("Attempts made for an idempotent switch request "
+                      "(REST GET/PUT/DELETE, NETCONF edit-config, SNMP "
+                      "GET/SET) that failed with a transient error. REST "
+                      "POSTs are never retried.")),
+    cfg.FloatOpt('switch_retry_base_delay', default=0.5, min=0,
+                 help=_("Seconds before the first retry of a switch "
+                        "request; the delay doubles with every attempt.")),
+    cfg.FloatOpt('switch_retry_max_delay', default=8.0, min=0,
+                 help=_("Upper bound of the delay between two attempts of "
+                        "a switch request.")),
+    cfg.FloatOpt('switch_retry_jitter', default=0.5, min=0, max=1,
+                 help=_("Random fraction, up to this value, taken off each "
+                        "retry delay so that retries spread out.")),
+    cfg.IntOpt('switch_breaker_threshold', default=3, min=0,
+               help=_("Consecutive failures to reach a switch after which "
+                      "it is marked down and operations on it are not "
+                      "attempted. 0 disables the circuit breaker.")),
+    cfg.IntOpt('switch_breaker_reset_timeout', default=60, min=1,
+               help=_("Seconds after which a single trial operation, or "
+                      "the replay of the deferred operations, is let "
+                      "through to a switch marked down, if no health probe "
+                      "found it up before.")),
+    cfg.StrOpt('switch_down_action', default='fail_fast',
+               choices=['fail_fast', 'defer'],
+               help=_("What an operation on a switch marked down does: "
+                      "'fail_fast' raises at once, 'defer' queues it and "
+                      "replays the queue in order when the switch is back. "
+                      "The queue is kept in the memory of the process and "
+                      "lost on restart. The bindings of deferred operations "
+                      "stay unprocessed until the reconciler or the stale "
+                      "binding sweeper confirms them.")),
+    cfg.IntOpt('switch_deferred_ops_max', default=1000, min=0,
+               help=_("Maximum number of operations queued per switch "
+                      "marked down; further operations fail fast.")),
+    cfg.IntOpt('switch_health_interval', default=0, min=0,
+               help=_("Seconds between two background health probes of "
+                      "every switch (REST login, NETCONF hello, SNMP "
+                      "sysUpTime GET). Every neutron-server process runs "
+                      "its own probes, so set it with care when there are "
+                      "many workers or switches. 0 disables the probes.")),
+    cfg.FloatOpt('switch_health_timeout', default=5.0, min=0.1,
+                 help=_("Seconds a switch health probe may take.")),
 ]
 
 
@@ -26,3 +26,9 @@ PASSWORD = 'password'
 NETWORK_ADMIN = 'network_admin'
 
 PLUGIN_MODE = 'plugin_mode'
+
+# Operations accepted by the apply_batch() method of the drivers
+OP_CREATE_VLAN = 'create_vlan'
+OP_DELETE_VLAN = 'delete_vlan'
+OP_ENABLE_VLAN = 'enable_vlan'
+OP_DISABLE_VLAN = 'disable_vlan'
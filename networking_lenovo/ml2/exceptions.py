@@ -51,6 +51,10 @@ class NOSConfigFailed(exceptions.NeutronException):
     """Failed to configure NOS switch."""
     message = _("Failed to configure NOS: %(config)s. Reason: %(exc)s.")
 
+    def __init__(self, **kwargs):
+        self.exc = kwargs.get('exc')
+        super(NOSConfigFailed, self).__init__(**kwargs)
+
 
 class NOSSNMPFailure(exceptions.NeutronException):
     """Failed to configure NOS switch via SNMP."""
@@ -66,6 +70,29 @@ class NOSPortBindingNotFound(exceptions.NeutronException):
         super(NOSPortBindingNotFound, self).__init__(filters=filters)
 
 
+class NOSDeadlineExceeded(exceptions.NeutronException):
+    """The switch I/O budget of the request is spent."""
+    message = _("Switch I/O deadline of %(budget)s seconds exceeded before "
+                "%(operation)s")
+
+
+class NOSSwitchUnavailable(exceptions.NeutronException):
+    """The NOS switch is marked down by its circuit breaker."""
+    message = _("NOS switch %(nos_host)s is down, %(operation)s not "
+                "attempted")
+
+
+class NOSMultiSwitchFailure(exceptions.NeutronException):
+    """Failed to configure several NOS switches."""
+    message = _("Failed to configure %(count)d NOS switches: %(errors)s")
+
+    def __init__(self, errors):
+        self.errors = errors
+        super(NOSMultiSwitchFailure, self).__init__(
+            count=len(errors),
+            errors='; '.join('%s: %s' % error for error in errors))
+
+
 class NOSMissingRequiredFields(exceptions.NeutronException):
     """Missing required fields to configure nos switch."""
     message = _("Missing required field(s) to configure nos switch: "
@@ -96,6 +123,10 @@ class NOSRestHTTPError(exceptions.NeutronException):
     message = _("REST HTTP error %(http_code)d (%(http_reason)s)"
                 " when %(http_op)s %(url)s: %(http_response)s")
 
+    def __init__(self, **kwargs):
+        self.http_code = kwargs.get('http_code')
+        super(NOSRestHTTPError, self).__init__(**kwargs)
+
 class NOSJsonFieldNotFound(exceptions.NeutronException):
     """Expected JSON field not found in the REST response"""
     message = _("Expected JSON field '%(field)s' not found"
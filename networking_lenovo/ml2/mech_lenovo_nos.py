@@ -16,8 +16,13 @@
 """
 ML2 Mechanism Driver for Lenovo NOS platforms.
 """
+import collections
+import functools
+
+import eventlet
 from oslo_config import cfg
 from oslo_log import log as logging
+from oslo_service import loopingcall
 
 from neutron.common import constants as n_const
 from neutron.extensions import portbindings
@@ -25,9 +30,16 @@ from neutron.plugins.common import constants as p_const
 from neutron.plugins.ml2 import driver_api as api
 
 from networking_lenovo.ml2 import config as conf
+from networking_lenovo.ml2 import constants as const
 from networking_lenovo.ml2 import exceptions as excep
+from networking_lenovo.ml2 import nos_binding_sweeper
 from networking_lenovo.ml2 import nos_db_v2 as nxos_db
+from networking_lenovo.ml2 import nos_deadline
+from networking_lenovo.ml2 import nos_health
 from networking_lenovo.ml2 import nos_network_driver
+from networking_lenovo.ml2 import nos_reconciler
+from networking_lenovo.ml2 import nos_vlan_gc
+from networking_lenovo.ml2 import nos_work_queue
 
 LOG = logging.getLogger(__name__)
 
@@ -43,9 +55,115 @@ class LenovoNOSMechanismDriver(api.MechanismDriver):
         # Extract configuration parameters from the configuration file.
         self._nos_switches = conf.ML2MechLenovoConfig.nos_dict
         LOG.debug(_("nos_switches found = %s"), self._nos_switches)
+        self._host_connections = self._build_host_connections(
+            self._nos_switches)
+        self._switch_ips = self._get_switch_ips(self._nos_switches)
+        # oslo.config runs the mutate hooks when a SIGHUP re-reads the
+        # configuration files of a service restarted with 'mutate'.
+        if hasattr(cfg.CONF, 'register_mutate_hook'):
+            cfg.CONF.register_mutate_hook(self._config_mutated)
 
         self.driver = nos_network_driver.LenovoNOSDriver()
 
+        self._work_queues = None
+        if cfg.CONF.ml2_lenovo.async_postcommit:
+            self._work_queues = nos_work_queue.SwitchWorkQueues(
+                cfg.CONF.ml2_lenovo.async_workers,
+                cfg.CONF.ml2_lenovo.async_queue_size)
+
+        self._health_monitor = None
+        if cfg.CONF.ml2_lenovo.switch_health_interval:
+            self._health_monitor = nos_health.SwitchHealthMonitor(
+                self.driver, lambda: self._switch_ips)
+            self._health_monitor.start(
+                cfg.CONF.ml2_lenovo.switch_health_interval)
+
+        self._reconciler = None
+        if cfg.CONF.ml2_lenovo.reconcile_interval:
+            self._reconciler = nos_reconciler.LenovoNOSReconciler(self.driver)
+            self._reconciler.start(cfg.CONF.ml2_lenovo.reconcile_interval)
+
+        self._vlan_gc = None
+        if cfg.CONF.ml2_lenovo.vlan_delete_grace:
+            self._vlan_gc = nos_vlan_gc.DeferredVlanDeleter(
+                self.driver, cfg.CONF.ml2_lenovo.vlan_delete_grace,
+                cfg.CONF.ml2_lenovo.vlan_gc_batch_size,
+                cfg.CONF.ml2_lenovo.vlan_gc_lease)
+            self._vlan_gc.start(cfg.CONF.ml2_lenovo.vlan_gc_interval)
+
+        self._sweeper = None
+        if cfg.CONF.ml2_lenovo.stale_binding_sweep_interval:
+            self._sweeper = nos_binding_sweeper.StaleBindingSweeper(
+                self._retry_binding, self._purge_binding)
+            self._sweeper.start(
+                cfg.CONF.ml2_lenovo.stale_binding_sweep_interval)
+
+        if cfg.CONF.ml2_lenovo.binding_read_cache_size:
+            nxos_db.enable_read_cache(
+                cfg.CONF.ml2_lenovo.binding_read_cache_size)
+
+        self._refcount_timer = None
+        if cfg.CONF.ml2_lenovo.binding_refcount_cache:
+            nxos_db.enable_binding_refcounts()
+            interval = cfg.CONF.ml2_lenovo.binding_refcount_resync_interval
+            if interval:
+                self._refcount_timer = loopingcall.FixedIntervalLoopingCall(
+                    self._resync_refcounts)
+                self._refcount_timer.start(interval=interval,
+                                           initial_delay=interval)
+
+    def _resync_refcounts(self):
+        try:
+            nxos_db.resync_binding_refcounts()
+        except Exception:
+            LOG.exception(_("NOS binding reference counts resync failed"))
+
+    def _retry_binding(self, binding):
+        """Configure the switch for a binding a postcommit left behind."""
+        self._configure_switch(binding.vlan_id, binding.instance_id,
+                               binding.switch_ip,
+                               [self._parse_port_id(binding.port_id)])
+
+    def _purge_binding(self, binding):
+        """Remove a binding and, if unused, its VLAN from the switch."""
+        nxos_db.remove_nosport_bindings(vlan_id=binding.vlan_id,
+                                        switch_ip=binding.switch_ip,
+                                        instance_ids=[binding.instance_id],
+                                        port_ids=[binding.port_id])
+        self._delete_switch(binding.vlan_id, binding.switch_ip,
+                            [self._parse_port_id(binding.port_id)])
+
+    def _config_mutated(self, conf, mutations):
+        try:
+            self.reload_config()
+        except Exception:
+            LOG.exception(_("Reload of the NOS switch configuration failed, "
+                            "the previous one is kept"))
+
+    def reload_config(self):
+        """Re-read the switch configuration and rebuild the host index.
+
+        Called on SIGHUP through the oslo.config mutate hook.  The new
+        index is built aside and swapped in with a single assignment so
+        that concurrent port events see either the old or the new
+        mapping, never a partially built one.
+        """
+        conf.ML2MechLenovoConfig.nos_dict = {}
+        try:
+            conf.ML2MechLenovoConfig()
+            nos_switches = conf.ML2MechLenovoConfig.nos_dict
+        finally:
+            # The switch drivers hold a reference to the original
+            # dictionary, so refresh it in place rather than replacing it.
+            conf.ML2MechLenovoConfig.nos_dict = self._nos_switches
+        host_connections = self._build_host_connections(nos_switches)
+        switch_ips = self._get_switch_ips(nos_switches)
+
+        self._nos_switches.clear()
+        self._nos_switches.update(nos_switches)
+        self._host_connections = host_connections
+        self._switch_ips = switch_ips
+
     def _valid_network_segment(self, segment):
         return (cfg.CONF.ml2_lenovo.managed_physical_network is None or
                 cfg.CONF.ml2_lenovo.managed_physical_network ==
@@ -62,34 +180,158 @@ class LenovoNOSMechanismDriver(api.MechanismDriver):
     def _is_status_active(self, port):
         return port['status'] == n_const.PORT_STATUS_ACTIVE
 
+    @staticmethod
+    def _parse_port_id(port_id):
+        """Split a configured port into (intf_type, port).
+
+        'portchannel:64' gives ('portchannel', '64') and a bare '11'
+        gives ('port', '11').
+        """
+        if ':' in port_id:
+            intf_type, port = port_id.split(':')
+        else:
+#            intf_type, port = 'ethernet', port_id
+            intf_type, port = 'port', port_id
+        return intf_type, port
+
+    def _build_host_connections(self, nos_switches):
+        """Build the host -> ((switch_ip, intf_type, port), ...) index.
+
+        Every (switch_ip, key) entry of the configuration is a candidate
+        host entry; switch attributes such as 'username' are indexed too
+        but are never looked up as a host.  Values that cannot be parsed
+        as a port list only matter for a host of that name, so they are
+        skipped.
+        """
+        index = {}
+        for (switch_ip, attr), value in nos_switches.items():
+            try:
+                connections = [(switch_ip,) + self._parse_port_id(port_id)
+                               for port_id in str(value).split(',')]
+            except ValueError:
+                continue
+            index.setdefault(str(attr), []).extend(connections)
+
+        return dict((host, tuple(connections))
+                    for host, connections in index.items())
+
+    @staticmethod
+    def _get_switch_ips(nos_switches):
+        """Distinct switches of the configuration, in a stable order."""
+        return tuple(sorted(set(switch_ip
+                                for switch_ip, attr in nos_switches)))
+
     def _get_switch_info(self, host_id):
-        host_connections = []
-        for switch_ip, attr in self._nos_switches:
-            if str(attr) == str(host_id):
-                for port_id in (
-                    self._nos_switches[switch_ip, attr].split(',')):
-                    if ':' in port_id:
-                        intf_type, port = port_id.split(':')
-                    else:
-#                        intf_type, port = 'ethernet', port_id
-                        intf_type, port = 'port', port_id
-                    host_connections.append((switch_ip, intf_type, port))
+        host_connections = self._host_connections.get(str(host_id), ())
 
         if not host_connections:
             LOG.warning("No switch entry found for host %s" % host_id)
 
         return host_connections
 
-    def _configure_nxos_db(self, vlan_id, device_id, host_id):
+    def _configure_nxos_db(self, vlan_id, device_id, host_id, session=None):
         """Create the nos database entry.
 
         Called during update precommit port event.
         """
         host_connections = self._get_switch_info(host_id)
+        self._add_nxos_db(vlan_id, device_id, host_connections, session)
+
+    def _add_nxos_db(self, vlan_id, device_id, host_connections,
+                     session=None):
+        """Add the bindings of device_id that are not in the database."""
+        nxos_db.add_nosport_bindings(
+            [('%s:%s' % (intf_type, nos_port), vlan_id, switch_ip, device_id)
+             for switch_ip, intf_type, nos_port in host_connections],
+            session=session)
+
+    def _group_by_switch(self, host_connections):
+        """Group host connections per switch, keeping their order."""
+        switches = collections.OrderedDict()
         for switch_ip, intf_type, nos_port in host_connections:
-            port_id = '%s:%s' % (intf_type, nos_port)
-            nxos_db.add_nosport_binding(port_id, str(vlan_id), switch_ip,
-                                          device_id)
+            switches.setdefault(switch_ip, []).append((intf_type, nos_port))
+        return switches
+
+    def _run_on_switches(self, tasks):
+        """Run the per-switch (switch_ip, func, args) tasks.
+
+        When postcommit is async the tasks are queued per switch.
+        Otherwise distinct switches are configured in parallel, at most
+        switch_fanout_concurrency at a time, and every failure is
+        collected before being reported.
+        """
+        if self._work_queues:
+            for switch_ip, func, args in tasks:
+                self._work_queues.enqueue(switch_ip, func, *args)
+            return
+
+        if len(tasks) == 1:
+            switch_ip, func, args = tasks[0]
+            func(*args)
+            return
+
+        pool = eventlet.GreenPool(
+            cfg.CONF.ml2_lenovo.switch_fanout_concurrency)
+        threads = [(switch_ip, pool.spawn(func, *args))
+                   for switch_ip, func, args in tasks]
+
+        errors = []
+        for switch_ip, thread in threads:
+            try:
+                thread.wait()
+            except Exception as e:
+                LOG.error(_("Configuration of switch %(switch_ip)s "
+                            "failed: %(exc)s"),
+                          {'switch_ip': switch_ip, 'exc': e})
+                errors.append((switch_ip, e))
+
+        if len(errors) == 1:
+            raise errors[0][1]
+        elif errors:
+            raise excep.NOSMultiSwitchFailure(errors=errors)
+
+    def _run_on_switches_then(self, tasks, then):
+        """Run the tasks, then the 'then' tasks.
+
+        When postcommit is async the 'then' tasks are queued once every
+        task has run, whatever its outcome, since the queues of distinct
+        switches are drained independently.  Otherwise they run once the
+        tasks have returned, and a failure of the tasks is raised after
+        them.
+        """
+        if not self._work_queues or not tasks:
+            try:
+                self._run_on_switches(tasks)
+            finally:
+                self._run_on_switches(then)
+            return
+
+        remaining = [len(tasks)]
+
+        def chained(func):
+            def run(*args):
+                try:
+                    func(*args)
+                finally:
+                    remaining[0] -= 1
+                    if not remaining[0]:
+                        # Not from the worker: enqueue may block on a
+                        # full queue.
+                        eventlet.spawn_n(self._run_on_switches, then)
+            return run
+
+        self._run_on_switches([(switch_ip, chained(func), args)
+                               for switch_ip, func, args in tasks])
+
+    def _hook_deadline(self):
+        """Deadline of the switch I/O of a postcommit hook.
+
+        Queued work runs after the hook has returned and is bounded by
+        the per-request timeouts only.
+        """
+        if self._work_queues:
+            return None
+        return nos_deadline.Deadline.for_hook()
 
     def _configure_switch_entry(self, vlan_id, device_id, host_id):
         """Create a nos switch entry.
@@ -99,49 +341,82 @@ class LenovoNOSMechanismDriver(api.MechanismDriver):
 
         Called during update postcommit port event.
         """
-        vlan_name = cfg.CONF.ml2_lenovo.vlan_name_prefix + str(vlan_id)
         host_connections = self._get_switch_info(host_id)
+        deadline = self._hook_deadline()
+        self._run_on_switches(
+            [(switch_ip, self._configure_switch,
+              (vlan_id, device_id, switch_ip, connections, deadline))
+             for switch_ip, connections in
+             self._group_by_switch(host_connections).items()])
+
+    def _configure_switch(self, vlan_id, device_id, switch_ip, connections,
+                          deadline=None):
+        """Configure the VLAN on the host connections of one switch."""
+        vlan_name = cfg.CONF.ml2_lenovo.vlan_name_prefix + str(vlan_id)
 
-        # (nos_port,switch_ip) will be unique in each iteration.
-        # But switch_ip will repeat if host has >1 connection to same switch.
-        # So track which switch_ips already have vlan created in this loop.
-        vlan_already_created = []
-        for switch_ip, intf_type, nos_port in host_connections:
+        # A host may have >1 connection to the same switch, so track
+        # whether the vlan was already created on it in this loop.  A VLAN
+        # whose deferred deletion we cancel is still on the switch.
+        # A pre-provisioned VLAN is not assumed to exist: its network may
+        # have been created while the switch was unreachable, and creating
+        # an existing VLAN again is harmless.
+        vlan_already_created = bool(
+            self._vlan_gc and self._vlan_gc.cancel(switch_ip, vlan_id))
+        refcounts = nxos_db.get_binding_refcounts()
+        for intf_type, nos_port in connections:
+            port_id = '%s:%s' % (intf_type, nos_port)
 
             # The VLAN needs to be created on the switch if no other
             # instance has been placed in this VLAN on a different host
-            # attached to this switch.  Search the existing bindings in the
-            # database.  If all the instance_id in the database match the
-            # current device_id, then create the VLAN, but only once per
-            # switch_ip.  Otherwise, just trunk.
-            all_bindings = nxos_db.get_nosvlan_binding(vlan_id, switch_ip)
-            previous_bindings = [row for row in all_bindings
-                    if row.processed and (row.instance_id != device_id)]
-            if previous_bindings or (switch_ip in vlan_already_created):
-                LOG.debug("NOS: trunk vlan %s" % vlan_name)
-                self.driver.enable_vlan_on_trunk_int(switch_ip, vlan_id,
-                                                     intf_type, nos_port)
+            # attached to this switch.  If all the bindings of this VLAN
+            # belong to the current device_id, then create the VLAN, but
+            # only once per switch_ip.  Otherwise, just trunk.  A processed
+            # binding of this same device on another port (e.g. the source
+            # host of a migration) also means the VLAN exists.
+            if refcounts is not None:
+                total, processed = refcounts.own_counts(
+                    switch_ip, port_id, vlan_id, device_id)
+                already_configured = total and processed == total
+                vlan_exists = refcounts.vlan_configured_by_others(
+                    switch_ip, port_id, vlan_id, device_id)
             else:
-                vlan_already_created.append(switch_ip)
-                LOG.debug("NOS: create & trunk vlan %s" % vlan_name)
-                self.driver.create_and_trunk_vlan(
-                    switch_ip, vlan_id, vlan_name, intf_type, nos_port)
+                total, processed, others = nxos_db.get_vlan_binding_summary(
+                    vlan_id, switch_ip, port_id, device_id)
+                already_configured = total and processed == total
+                vlan_exists = others > 0
 
-            port_id = '%s:%s' % (intf_type, nos_port)
-            nxos_db.process_binding(port_id, vlan_id, switch_ip, device_id)
+            if already_configured:
+                LOG.debug("NOS: vlan %s already configured on %s %s" %
+                          (vlan_name, switch_ip, port_id))
+                continue
 
-    def _delete_nxos_db(self, vlan_id, device_id, host_id):
+            if vlan_exists or vlan_already_created:
+                LOG.debug("NOS: trunk vlan %s" % vlan_name)
+                result = self.driver.enable_vlan_on_trunk_int(
+                    switch_ip, vlan_id, intf_type, nos_port,
+                    deadline=deadline)
+            else:
+                vlan_already_created = True
+                LOG.debug("NOS: create & trunk vlan %s" % vlan_name)
+                result = self.driver.create_and_trunk_vlan(
+                    switch_ip, vlan_id, vlan_name, intf_type, nos_port,
+                    deadline=deadline)
+
+            # Only mark the binding once the switch accepted the change,
+            # not when it was queued until the switch is back.
+            if result is nos_network_driver.DEFERRED:
+                continue
+            nxos_db.process_bindings(vlan_id, switch_ip, device_id,
+                                     [port_id])
+
+    def _delete_nxos_db(self, vlan_id, device_id, host_id, session=None):
         """Delete the nos database entry.
 
         Called during delete precommit port event.
         """
-        try:
-            rows = nxos_db.get_nosvm_bindings(vlan_id, device_id)
-            for row in rows:
-                nxos_db.remove_nosport_binding(
-                    row.port_id, row.vlan_id, row.switch_ip, row.instance_id)
-        except excep.NOSPortBindingNotFound:
-            return
+        nxos_db.remove_nosport_bindings(vlan_id=vlan_id,
+                                        instance_ids=[device_id],
+                                        session=session)
 
     def _delete_switch_entry(self, vlan_id, device_id, host_id):
         """Delete the nos switch entry.
@@ -152,33 +427,173 @@ class LenovoNOSMechanismDriver(api.MechanismDriver):
         Called during update postcommit port event.
         """
         host_connections = self._get_switch_info(host_id)
-
-        # (nos_port,switch_ip) will be unique in each iteration.
-        # But switch_ip will repeat if host has >1 connection to same switch.
-        # So track which switch_ips already have vlan removed in this loop.
-        vlan_already_removed = []
-        for switch_ip, intf_type, nos_port in host_connections:
+        deadline = self._hook_deadline()
+        self._run_on_switches(
+            [(switch_ip, self._delete_switch,
+              (vlan_id, switch_ip, connections, deadline))
+             for switch_ip, connections in
+             self._group_by_switch(host_connections).items()])
+
+    def _delete_switch(self, vlan_id, switch_ip, connections, deadline=None):
+        """Remove the VLAN from the host connections of one switch."""
+
+        # A host may have >1 connection to the same switch, so track
+        # whether the vlan was already removed from it in this loop.  A
+        # pre-provisioned VLAN is only removed with its network.
+        vlan_already_removed = cfg.CONF.ml2_lenovo.pre_provision_vlans
+        for intf_type, nos_port in connections:
 
             # if there are no remaining db entries using this vlan on this
             # nos switch port then remove vlan from the switchport trunk.
             port_id = '%s:%s' % (intf_type, nos_port)
-            try:
-                nxos_db.get_port_vlan_switch_binding(port_id, vlan_id,
-                                                     switch_ip)
-            except excep.NOSPortBindingNotFound:
-                self.driver.disable_vlan_on_trunk_int(switch_ip, vlan_id,
-                                                      intf_type, nos_port)
-
-                # if there are no remaining db entries using this vlan on this
-                # nos switch then remove the vlan.
-                try:
-                    nxos_db.get_nosvlan_binding(vlan_id, switch_ip)
-                except excep.NOSPortBindingNotFound:
+            if self._port_vlan_in_use(port_id, vlan_id, switch_ip):
+                continue
+            self.driver.disable_vlan_on_trunk_int(switch_ip, vlan_id,
+                                                  intf_type, nos_port,
+                                                  deadline=deadline)
+
+            # if there are no remaining db entries using this vlan on this
+            # nos switch then remove the vlan.  Do not perform a second
+            # time on same switch.
+            if (not vlan_already_removed and
+                    not self._vlan_in_use(vlan_id, switch_ip)):
+                if self._vlan_gc:
+                    self._vlan_gc.schedule(switch_ip, vlan_id)
+                else:
+                    self.driver.delete_vlan(switch_ip, vlan_id,
+                                            deadline=deadline)
+                vlan_already_removed = True
+
+    @staticmethod
+    def _port_vlan_in_use(port_id, vlan_id, switch_ip):
+        """Whether any binding uses the VLAN on the switch port.
+
+        The reference counts only see the writes of this process, so an
+        "in use" answer from them is final but a "not in use" one is
+        confirmed against the database before anything is removed.
+        """
+        refcounts = nxos_db.get_binding_refcounts()
+        if refcounts is None:
+            return nxos_db.port_vlan_switch_binding_exists(port_id, vlan_id,
+                                                           switch_ip)
+        if refcounts.port_vlan_in_use(switch_ip, port_id, vlan_id):
+            return True
+        return nxos_db.nosport_binding_exists(port_id=port_id,
+                                              vlan_id=vlan_id,
+                                              switch_ip=switch_ip)
+
+    @staticmethod
+    def _vlan_in_use(vlan_id, switch_ip):
+        """Whether any binding uses the VLAN on the switch.
+
+        As in _port_vlan_in_use(), only "in use" is taken from the
+        reference counts.
+        """
+        refcounts = nxos_db.get_binding_refcounts()
+        if refcounts is None:
+            return nxos_db.nosvlan_binding_exists(vlan_id, switch_ip)
+        if refcounts.vlan_in_use(switch_ip, vlan_id):
+            return True
+        return nxos_db.nosport_binding_exists(vlan_id=vlan_id,
+                                              switch_ip=switch_ip)
+
+    def _split_migration(self, host_id, dest_host_id):
+        """Compare the switch connections of a migration's two hosts.
+
+        Returns the connections only the destination has and those only
+        the source has.  Connections shared by both hosts (e.g. the same
+        port-channel) appear in neither list.
+        """
+        src = self._get_switch_info(host_id)
+        dest = self._get_switch_info(dest_host_id) if dest_host_id else ()
+        dest_only = [conn for conn in dest if conn not in src]
+        src_only = [conn for conn in src if conn not in dest]
+        return dest_only, src_only
+
+    def _migrate_nxos_db(self, vlan_id, device_id, host_id, dest_host_id=None,
+                         session=None):
+        """Move the nos database entries of a migrating port.
+
+        Called during update precommit port event.
+        """
+        dest_only, src_only = self._split_migration(host_id, dest_host_id)
+        self._add_nxos_db(vlan_id, device_id, dest_only, session)
+        for switch_ip, connections in self._group_by_switch(
+                src_only).items():
+            nxos_db.remove_nosport_bindings(
+                vlan_id=vlan_id, switch_ip=switch_ip, instance_ids=[device_id],
+                port_ids=['%s:%s' % conn for conn in connections],
+                session=session)
+
+    def _migrate_switch_entry(self, vlan_id, device_id, host_id,
+                              dest_host_id=None):
+        """Make before break: move the VLAN to the destination host.
+
+        The connections only the destination has are configured first,
+        then the VLAN is removed from the connections only the source
+        had, also when postcommit is async.  The VM has left the source
+        host, so its connections are released even if the destination
+        could not be configured.  Connections shared by both hosts are
+        left alone.
 
-                    # Do not perform a second time on same switch
-                    if switch_ip not in vlan_already_removed:
-                        self.driver.delete_vlan(switch_ip, vlan_id)
-                        vlan_already_removed.append(switch_ip)
+        Called during update postcommit port event.
+        """
+        dest_only, src_only = self._split_migration(host_id, dest_host_id)
+        deadline = self._hook_deadline()
+        self._run_on_switches_then(
+            [(switch_ip, self._configure_switch,
+              (vlan_id, device_id, switch_ip, connections, deadline))
+             for switch_ip, connections in
+             self._group_by_switch(dest_only).items()],
+            [(switch_ip, self._delete_switch,
+              (vlan_id, switch_ip, connections, deadline))
+             for switch_ip, connections in
+             self._group_by_switch(src_only).items()])
+
+    def _get_network_vlanids(self, context):
+        vlan_ids = [self._get_vlanid(segment)
+                    for segment in context.network_segments or ()]
+        return sorted(set(vlan_id for vlan_id in vlan_ids if vlan_id))
+
+    def _provision_switch(self, switch_ip, op, vlan_ids, deadline=None):
+        """Create or delete the network VLANs on one switch in a batch.
+
+        A failure is only logged: the network exists whether or not a
+        switch could be provisioned, and a VLAN missing on a switch is
+        created by the first port bound to it.
+        """
+        vlan_name_prefix = cfg.CONF.ml2_lenovo.vlan_name_prefix
+        operations = [nos_network_driver.SwitchOperation(
+            op, vlan_id, vlan_name_prefix + str(vlan_id))
+            for vlan_id in vlan_ids]
+        try:
+            self.driver.apply_batch(switch_ip, operations, deadline=deadline)
+        except Exception as e:
+            LOG.error(_("NOS: %(op)s of vlans %(vlans)s on switch "
+                        "%(switch_ip)s failed: %(exc)s"),
+                      {'op': op, 'vlans': vlan_ids, 'switch_ip': switch_ip,
+                       'exc': e})
+
+    def _provision_network(self, context, op):
+        """Apply op to the VLANs of the network on every switch."""
+        vlan_ids = self._get_network_vlanids(context)
+        if not vlan_ids:
+            return
+        deadline = self._hook_deadline()
+        self._run_on_switches(
+            [(switch_ip, self._provision_switch,
+              (switch_ip, op, vlan_ids, deadline))
+             for switch_ip in self._switch_ips])
+
+    def create_network_postcommit(self, context):
+        """Create network non-database commit event."""
+        if cfg.CONF.ml2_lenovo.pre_provision_vlans:
+            self._provision_network(context, const.OP_CREATE_VLAN)
+
+    def delete_network_postcommit(self, context):
+        """Delete network non-database commit event."""
+        if cfg.CONF.ml2_lenovo.pre_provision_vlans:
+            self._provision_network(context, const.OP_DELETE_VLAN)
 
     def _is_vm_migration(self, context):
         if not context.top_bound_segment and context.original_top_bound_segment:
@@ -199,30 +614,39 @@ class LenovoNOSMechanismDriver(api.MechanismDriver):
             raise excep.NOSMissingRequiredFields(fields=fields)
 
     def update_port_precommit(self, context):
-        """Update port pre-database transaction commit event."""
+        """Update port pre-database transaction commit event.
+
+        The bindings are written in the transaction of the port update.
+        """
 
-        # if VM migration is occurring then remove previous database entry
-        # else process update event.
+        # if VM migration is occurring then move the database entries to
+        # the destination host else process update event.
         if self._is_vm_migration(context):
             self._port_action(context.original,
                               context.original_top_bound_segment,
-                              self._delete_nxos_db)
+                              functools.partial(
+                                  self._migrate_nxos_db,
+                                  dest_host_id=context.host,
+                                  session=context._plugin_context.session))
         else:
             if (self._is_deviceowner_compute(context.current) and
                 self._is_status_active(context.current)):
                 self._port_action(context.current,
                                   context.top_bound_segment,
-                                  self._configure_nxos_db)
+                                  functools.partial(
+                                      self._configure_nxos_db,
+                                      session=context._plugin_context.session))
 
     def update_port_postcommit(self, context):
         """Update port non-database commit event."""
 
-        # if VM migration is occurring then remove previous nos switch entry
-        # else process update event.
+        # if VM migration is occurring then move the nos switch entries to
+        # the destination host else process update event.
         if self._is_vm_migration(context):
             self._port_action(context.original,
                               context.original_top_bound_segment,
-                              self._delete_switch_entry)
+                              functools.partial(self._migrate_switch_entry,
+                                                dest_host_id=context.host))
         else:
             if (self._is_deviceowner_compute(context.current) and
                 self._is_status_active(context.current)):
@@ -235,7 +659,9 @@ class LenovoNOSMechanismDriver(api.MechanismDriver):
         if self._is_deviceowner_compute(context.current):
             self._port_action(context.current,
                               context.top_bound_segment,
-                              self._delete_nxos_db)
+                              functools.partial(
+                                  self._delete_nxos_db,
+                                  session=context._plugin_context.session))
 
     def delete_port_postcommit(self, context):
         """Delete port non-database commit event."""
@@ -0,0 +1,77 @@
+# Copyright (c) 2017, Lenovo.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Per-process read cache of the NOS port bindings
+"""
+
+import collections
+
+
+class BindingRow(collections.namedtuple(
+        'BindingRow', 'port_id vlan_id switch_ip instance_id processed')):
+    """ Immutable copy of a NOSPortBinding, safe to share between calls """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_model(cls, binding):
+        return cls(binding.port_id, int(binding.vlan_id), binding.switch_ip,
+                   binding.instance_id, bool(binding.processed))
+
+
+class BindingReadCache(object):
+    """
+    LRU cache of binding sets validated by a per-switch generation.
+
+    Every write to the bindings of a switch bumps the generation of the
+    switch in the database.  An entry is only returned while the
+    generation it was read at is still the current one, so a write from
+    any neutron-server process invalidates the entries of that switch in
+    all of them.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        # key -> (generation, rows)
+        self._entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, generation):
+        """ Rows cached for key at generation, None on a miss """
+        entry = self._entries.pop(key, None)
+        if entry is None or entry[0] != generation:
+            self.misses += 1
+            return None
+        # Re-insert as most recently used.
+        self._entries[key] = entry
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, generation, rows):
+        self._entries.pop(key, None)
+        self._entries[key] = (generation, tuple(rows))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        """ Hit/miss counters and size of the cache """
+        return {'hits': self.hits, 'misses': self.misses,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries}
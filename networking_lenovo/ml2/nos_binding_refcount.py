@@ -0,0 +1,125 @@
+# Copyright (c) 2017, Lenovo.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+In-memory reference counts of the NOS port bindings
+"""
+
+import collections
+
+
+class BindingRefCounts(object):
+    """
+    Counts the bindings per (switch_ip, vlan_id) and per
+    (switch_ip, port_id, vlan_id).
+
+    The counts answer the questions the mechanism driver asks on every
+    port event (is the VLAN still used on this switch or port, does
+    another binding already have it configured) without a database
+    round trip.  They are maintained by the nos_db_v2 write functions of
+    this process and periodically rebuilt from the database, which also
+    corrects writes made by other processes or rolled back.
+    """
+
+    def __init__(self):
+        # (switch_ip, port_id, vlan_id, instance_id) -> [total, processed]
+        self._rows = {}
+        self._vlan_refs = collections.Counter()
+        self._port_refs = collections.Counter()
+        self._processed_vlan_refs = collections.Counter()
+
+    @staticmethod
+    def _key(switch_ip, port_id, vlan_id, instance_id):
+        return (str(switch_ip), str(port_id), int(vlan_id), str(instance_id))
+
+    def _update(self, key, total, processed):
+        switch_ip, port_id, vlan_id, instance_id = key
+        counts = self._rows.setdefault(key, [0, 0])
+        counts[0] += total
+        counts[1] += processed
+        if counts[0] <= 0:
+            del self._rows[key]
+        self._vlan_refs[switch_ip, vlan_id] += total
+        self._port_refs[switch_ip, port_id, vlan_id] += total
+        self._processed_vlan_refs[switch_ip, vlan_id] += processed
+
+    def add(self, switch_ip, port_id, vlan_id, instance_id, processed=False):
+        """ Account for a new binding """
+        key = self._key(switch_ip, port_id, vlan_id, instance_id)
+        self._update(key, 1, 1 if processed else 0)
+
+    def remove(self, switch_ip, port_id, vlan_id, instance_id):
+        """ Account for the removal of all bindings matching the key """
+        key = self._key(switch_ip, port_id, vlan_id, instance_id)
+        counts = self._rows.get(key)
+        if counts:
+            self._update(key, -counts[0], -counts[1])
+
+    def remove_one(self, switch_ip, port_id, vlan_id, instance_id,
+                   processed=False):
+        """ Account for the removal of a single binding """
+        key = self._key(switch_ip, port_id, vlan_id, instance_id)
+        if key in self._rows:
+            self._update(key, -1, -1 if processed else 0)
+
+    def process(self, switch_ip, port_id, vlan_id, instance_id):
+        """ Account for a binding marked as processed """
+        key = self._key(switch_ip, port_id, vlan_id, instance_id)
+        counts = self._rows.get(key)
+        if counts and counts[1] < counts[0]:
+            self._update(key, 0, 1)
+
+    def vlan_in_use(self, switch_ip, vlan_id):
+        """ True if any binding uses the VLAN on the switch """
+        return self._vlan_refs[str(switch_ip), int(vlan_id)] > 0
+
+    def port_vlan_in_use(self, switch_ip, port_id, vlan_id):
+        """ True if any binding uses the VLAN on the switch port """
+        return self._port_refs[str(switch_ip), str(port_id),
+                               int(vlan_id)] > 0
+
+    def own_counts(self, switch_ip, port_id, vlan_id, instance_id):
+        """ (total, processed) bindings of an instance on a port """
+        key = self._key(switch_ip, port_id, vlan_id, instance_id)
+        return tuple(self._rows.get(key, (0, 0)))
+
+    def vlan_configured_by_others(self, switch_ip, port_id, vlan_id,
+                                  instance_id):
+        """
+        True if a processed binding other than those of instance_id on
+        port_id has the VLAN configured on the switch.
+        """
+        own_processed = self.own_counts(switch_ip, port_id, vlan_id,
+                                        instance_id)[1]
+        return (self._processed_vlan_refs[str(switch_ip), int(vlan_id)] >
+                own_processed)
+
+    def __eq__(self, other):
+        return self._rows == other._rows
+
+    def __ne__(self, other):
+        return not self == other
+
+    @classmethod
+    def from_counts(cls, rows):
+        """
+        Build the counts from (switch_ip, port_id, vlan_id, instance_id,
+        total, processed) tuples.
+        """
+        refcounts = cls()
+        for switch_ip, port_id, vlan_id, instance_id, total, processed in rows:
+            key = cls._key(switch_ip, port_id, vlan_id, instance_id)
+            refcounts._update(key, int(total), int(processed or 0))
+        return refcounts
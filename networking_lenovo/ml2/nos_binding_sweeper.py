@@ -0,0 +1,130 @@
+# Copyright (c) 2017, Lenovo.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Periodic clean up of the bindings left behind by failed postcommits
+"""
+
+import datetime
+
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_service import loopingcall
+from oslo_utils import timeutils
+
+from networking_lenovo.ml2 import nos_db_v2
+
+LOG = logging.getLogger(__name__)
+
+
+class StaleBindingSweeper(object):
+    """
+    Retry or purge the stale bindings.
+
+    A binding is stale when it is still unprocessed stale_binding_age
+    seconds after its creation, i.e. the postcommit that should have
+    configured the switch failed.  It is retried up to
+    stale_binding_max_attempts times and then purged.  A binding whose
+    instance has no Neutron port anymore is orphaned and purged.
+    """
+
+    def __init__(self, retry, purge):
+        """
+        :param retry: callable(binding) configuring the switch for the
+                      binding and marking it processed
+        :param purge: callable(binding) removing the binding and its
+                      configuration from the switch
+        """
+        self._retry = retry
+        self._purge = purge
+        self._timer = None
+
+    def start(self, interval):
+        """ Sweep the stale bindings every 'interval' seconds """
+        self._timer = loopingcall.FixedIntervalLoopingCall(self._run)
+        self._timer.start(interval=interval, initial_delay=interval)
+
+    def stop(self):
+        if self._timer:
+            self._timer.stop()
+            self._timer = None
+
+    def _run(self):
+        try:
+            self.sweep()
+        except Exception:
+            LOG.exception(_("NOS stale binding sweep failed"))
+
+    def sweep(self, now=None):
+        """
+        Run one pass over a batch of stale and orphaned bindings.
+
+        Each binding is claimed for stale_binding_lease seconds before it
+        is retried or purged, so that concurrent sweeps of several
+        neutron-servers never handle the same binding at once.  Returns
+        the counts of retried, failed and purged bindings.
+        """
+        conf = cfg.CONF.ml2_lenovo
+        if now is None:
+            now = timeutils.utcnow()
+        older_than = now - datetime.timedelta(
+            seconds=conf.stale_binding_age)
+        counts = {'retried': 0, 'failed': 0, 'purged': 0, 'orphaned': 0}
+
+        for binding in nos_db_v2.get_orphaned_bindings(
+                older_than, conf.stale_binding_batch_size, now):
+            if (self._claim(binding, now) and
+                    self._purge_binding(binding)):
+                counts['orphaned'] += 1
+
+        for binding in nos_db_v2.get_stale_bindings(
+                older_than, conf.stale_binding_batch_size, now):
+            if not self._claim(binding, now):
+                continue
+            if binding.attempts >= conf.stale_binding_max_attempts:
+                LOG.warning(_("NOS: giving up on binding %(binding)s after "
+                              "%(attempts)d attempts"),
+                            {'binding': binding,
+                             'attempts': binding.attempts})
+                if self._purge_binding(binding):
+                    counts['purged'] += 1
+                continue
+            try:
+                self._retry(binding)
+                counts['retried'] += 1
+            except Exception as e:
+                counts['failed'] += 1
+                LOG.error(_("NOS: retry of binding %(binding)s failed: "
+                            "%(exc)s"), {'binding': binding, 'exc': e})
+
+        if any(counts.values()):
+            LOG.info(_("NOS stale binding sweep: %s"), counts)
+        return counts
+
+    def _claim(self, binding, now):
+        if nos_db_v2.claim_binding(binding, now,
+                                   cfg.CONF.ml2_lenovo.stale_binding_lease):
+            return True
+        LOG.debug("NOS: binding %s is swept by another server", binding)
+        return False
+
+    def _purge_binding(self, binding):
+        try:
+            self._purge(binding)
+        except Exception as e:
+            LOG.error(_("NOS: purge of binding %(binding)s failed: "
+                        "%(exc)s"), {'binding': binding, 'exc': e})
+            return False
+        return True
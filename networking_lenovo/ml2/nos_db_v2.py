@@ -14,50 +14,447 @@
 # limitations under the License.
 
 
+import datetime
+import threading
+import time
+
+from oslo_config import cfg
+from oslo_db import exception as db_exc
 from oslo_log import log as logging
+from oslo_utils import timeutils
+from oslo_utils import uuidutils
+import sqlalchemy as sa
 import sqlalchemy.orm.exc as sa_exc
 
 import neutron.db.api as db
+from neutron.db import models_v2
+from networking_lenovo.ml2 import config  # noqa
 from networking_lenovo.ml2 import exceptions as c_exc
+from networking_lenovo.ml2 import nos_binding_cache
+from networking_lenovo.ml2 import nos_binding_refcount
 from networking_lenovo.ml2 import nos_models_v2
 
 
 LOG = logging.getLogger(__name__)
 
+# Reference counts of the bindings, None unless enabled
+_refcounts = None
+
+# Read cache of the bindings, None unless enabled
+_read_cache = None
+
+# Time of the last binding write of the current thread
+_local = threading.local()
+
+# switch_ip -> switch id and (switch id, port_id) -> interface id.  The
+# rows are never renamed, so the committed ids are cached for the process
+# lifetime.  Switch rows are never deleted either; an interface row is
+# deleted once no binding refers to it, and an insert failing on the id
+# cached by another process reads the id again.
+_switch_ids = {}
+_interface_ids = {}
+
+# Seconds between two looks at a VLAN deletion claimed by a sweep
+_CLAIM_POLL_INTERVAL = 0.5
+
+
+def _outermost(session):
+    """Whether a commit event is that of the database transaction.
+
+    Releasing a savepoint fires after_commit too.
+    """
+    return session.transaction is None or not session.transaction.nested
+
+
+def _cache_id(session, cache, key, row_id):
+    """Cache an id once the transaction that read or created it commits.
+
+    An id seen inside a transaction may be of a row this transaction
+    inserted, which is gone if it rolls back.
+    """
+    if session.transaction is None:
+        cache[key] = row_id
+        return
+    if not session.info.get('lenovo_id_listeners'):
+        session.info['lenovo_id_listeners'] = True
+        sa.event.listen(session, 'after_commit', _commit_ids)
+        sa.event.listen(session, 'after_rollback', _drop_ids)
+    session.info.setdefault('lenovo_ids', []).append((cache, key, row_id))
+
+
+def _commit_ids(session):
+    if not _outermost(session):
+        return
+    for cache, key, row_id in session.info.pop('lenovo_ids', ()):
+        cache[key] = row_id
+
+
+def _drop_ids(session):
+    session.info.pop('lenovo_ids', None)
+
+
+def _evict_ids(switch_ip):
+    """Forget the cached ids of a switch and its interfaces."""
+    switch_id = _switch_ids.pop(switch_ip, None)
+    if switch_id is None:
+        return
+    for key in [key for key in _interface_ids if key[0] == switch_id]:
+        _interface_ids.pop(key, None)
+
+
+def _savepoint(session):
+    """A savepoint of the open transaction, else a transaction of its own.
+
+    Either way a failed insert in it leaves the session usable.
+    """
+    if session.transaction is None:
+        return session.begin()
+    return session.begin_nested()
+
+
+def _get_or_create(session, cache, key, model, create, lock=False,
+                   **values):
+    row_id = cache.get(key)
+    if row_id is not None:
+        return row_id
+    query = session.query(model.id).filter_by(**values)
+    if lock:
+        # A locking read sees the latest committed row, not the snapshot
+        # of the transaction.
+        query = query.with_for_update(read=True)
+    row = query.first()
+    if row is None:
+        if not create:
+            return None
+        try:
+            with _savepoint(session):
+                new = model(**values)
+                session.add(new)
+            row = new
+        except db_exc.DBDuplicateEntry:
+            row = session.query(model.id).filter_by(**values).one()
+    _cache_id(session, cache, key, row.id)
+    return row.id
+
+
+def _get_switch_id(session, switch_ip, create=False):
+    """Id of a switch, None if unknown and not created."""
+    return _get_or_create(session, _switch_ids, switch_ip,
+                          nos_models_v2.NOSSwitch, create,
+                          switch_ip=switch_ip)
+
+
+def _get_interface_id(session, switch_id, port_id, create=False,
+                      lock=False):
+    """Id of a switch interface, None if unknown and not created."""
+    return _get_or_create(session, _interface_ids, (switch_id, port_id),
+                          nos_models_v2.NOSSwitchInterface, create, lock,
+                          switch_id=switch_id, port_id=port_id)
+
+
+def _binding_ids(session, switch_ip, port_id, lock=False):
+    """switch_id and interface_id of a new binding.
+
+    :param lock: read the interface row with a lock, after an insert
+                 failed on the id of an interface pruned meanwhile
+    """
+    switch_id = _get_switch_id(session, switch_ip, create=True)
+    return switch_id, _get_interface_id(session, switch_id, port_id,
+                                        create=True, lock=lock)
+
+
+def _prune_interfaces(session, interface_ids):
+    """Delete the interface rows left without bindings by a removal."""
+    interface_ids = set(int(interface_id) for interface_id in interface_ids
+                        if interface_id is not None)
+    if interface_ids:
+        _after_commit(session, _commit_pruned_interfaces, interface_ids)
+
+
+def _commit_pruned_interfaces(interface_ids):
+    try:
+        _delete_unused_interfaces(db.get_session(), interface_ids)
+    except Exception:
+        # The rows stay until a later removal on their interfaces.
+        LOG.exception(_("NOS: could not prune switch interfaces %s"),
+                      sorted(interface_ids))
+
+
+def _delete_unused_interfaces(session, interface_ids):
+    """Delete the interface rows among interface_ids without bindings.
+
+    The interface rows are locked before their bindings are read: a
+    binding insert checking its foreign key meanwhile is either seen or
+    waits and then fails, to be retried with a new interface row.
+    Returns the number of rows deleted.
+    """
+    interface = nos_models_v2.NOSSwitchInterface
+    binding = nos_models_v2.NOSPortBinding
+    with session.begin(subtransactions=True):
+        rows = session.query(interface.id, interface.switch_id,
+                             interface.port_id).filter(
+            interface.id.in_(sorted(interface_ids))).order_by(
+            interface.id).with_for_update().all()
+        if not rows:
+            return 0
+        used = set(interface_id for interface_id, in session.query(
+            binding.interface_id).filter(
+            binding.interface_id.in_([row.id for row in rows])).
+            with_for_update())
+        unused = [row for row in rows if row.id not in used]
+        if unused:
+            session.query(interface).filter(
+                interface.id.in_([row.id for row in unused])).delete(
+                synchronize_session=False)
+    for row in unused:
+        _interface_ids.pop((row.switch_id, row.port_id), None)
+    return len(unused)
+
+
+def _id_filter(session, bfilter):
+    """Replace switch_ip and port_id in a filter by the integer ids.
+
+    Returns None if the switch or interface is unknown, i.e. nothing
+    can match.
+    """
+    bfilter = dict(bfilter)
+    if 'switch_ip' not in bfilter:
+        return bfilter
+    switch_id = _get_switch_id(session, bfilter.pop('switch_ip'))
+    if switch_id is None:
+        return None
+    bfilter['switch_id'] = switch_id
+    if 'port_id' in bfilter:
+        interface_id = _get_interface_id(session, switch_id,
+                                         bfilter.pop('port_id'))
+        if interface_id is None:
+            return None
+        bfilter['interface_id'] = interface_id
+    return bfilter
+
+
+def _get_reader_session():
+    """Session for a reporting query, on a reader engine if enabled.
+
+    Only for reads that never decide a switch change: the replicas may
+    lag behind the writes of any process or greenthread.  Until
+    reader_freshness_window seconds after this thread last wrote
+    bindings its reports stay on the writer, so that it reads back its
+    own writes.
+    """
+    conf = cfg.CONF.ml2_lenovo
+    if not conf.use_reader_db:
+        return db.get_session()
+    last_write = getattr(_local, 'last_write', None)
+    if (last_write is not None and
+            time.time() - last_write < conf.reader_freshness_window):
+        return db.get_session()
+    return db.get_session(use_slave=True)
+
+
+def _after_commit(session, handler, values):
+    """Call handler(values) once the transaction of the session commits.
+
+    At once when no transaction is open.  The values queued by the
+    writes of a transaction are merged in a set per handler, and kept on
+    a rollback, since a savepoint rollback may follow the writes of an
+    earlier savepoint: the handler must be harmless for values of a
+    rolled back write.  It runs in a transaction of its own and must
+    not raise.
+    """
+    if session.transaction is None:
+        handler(values)
+        return
+    if not session.info.get('lenovo_commit_listener'):
+        session.info['lenovo_commit_listener'] = True
+        sa.event.listen(session, 'after_commit', _run_after_commit)
+    session.info.setdefault('lenovo_after_commit', {}).setdefault(
+        handler, set()).update(values)
+
+
+def _run_after_commit(session):
+    if not _outermost(session):
+        return
+    for handler, values in session.info.pop('lenovo_after_commit',
+                                            {}).items():
+        handler(values)
+
+
+def _bump_generations(session, switch_ids):
+    """Invalidate the cached bindings of the switches in every process.
+
+    Inside a transaction the bump waits for its commit and then runs in
+    a short transaction of its own, so that the switch rows are not
+    locked by every binding write until the end of its ML2 transaction.
+    Until then other processes may still read the previous bindings
+    from their caches.  Nothing is updated when the read cache is
+    disabled.
+    """
+    _local.last_write = time.time()
+    if _read_cache is None:
+        return
+    switch_ids = set(int(switch_id) for switch_id in switch_ids
+                     if switch_id is not None)
+    if switch_ids:
+        _after_commit(session, _commit_generations, switch_ids)
+
+
+def _commit_generations(switch_ids):
+    try:
+        _update_generations(db.get_session(), switch_ids)
+    except Exception:
+        # The bindings are committed: drop this process' cache at least.
+        LOG.exception(_("NOS: could not bump the generation of switches "
+                        "%s, cached bindings may be stale"),
+                      sorted(switch_ids))
+        if _read_cache is not None:
+            _read_cache.clear()
+
+
+def _update_generations(session, switch_ids):
+    """Add one to the generation of the switches.
+
+    MySQL locks the switch rows in id order, so that concurrent bumps of
+    overlapping switches cannot deadlock on them.
+    """
+    table = nos_models_v2.NOSSwitch.__table__.name
+    order_by = ' ORDER BY id' if session.bind.dialect.name == 'mysql' else ''
+    with session.begin(subtransactions=True):
+        session.execute(sa.text(
+            "UPDATE %s SET generation = generation + 1 WHERE id IN (%s)%s" %
+            (table, ', '.join(str(switch_id)
+                              for switch_id in sorted(switch_ids)),
+             order_by)))
+
+
+def _cached_bindings(session, switch_ip, key, **bfilter):
+    """Bindings of a switch matching the filter, through the read cache.
 
-def get_nosport_binding(port_id, vlan_id, switch_ip, instance_id):
+    The generation of the switch is read before the bindings, so that
+    rows are never cached under a generation newer than them.  Returns
+    None when the cache is disabled or the caller reads in its own
+    transaction, whose uncommitted writes must not be shared.
+    """
+    if _read_cache is None or session is not None:
+        return None
+    session = db.get_session()
+    switch_id = _get_switch_id(session, switch_ip)
+    if switch_id is None:
+        return ()
+    switch = nos_models_v2.NOSSwitch
+    generation = session.query(switch.generation).filter_by(
+        id=switch_id).scalar()
+    cache_key = (switch_ip,) + key
+    rows = _read_cache.get(cache_key, generation)
+    if rows is None:
+        id_filter = _id_filter(session, dict(bfilter, switch_ip=switch_ip))
+        rows = () if id_filter is None else tuple(
+            nos_binding_cache.BindingRow.from_model(binding)
+            for binding in session.query(
+                nos_models_v2.NOSPortBinding).filter_by(**id_filter))
+        _read_cache.put(cache_key, generation, rows)
+    return rows
+
+
+def _cached_vlan_bindings(vlan_id, switch_ip, session):
+    return _cached_bindings(session, switch_ip, ('vlan', int(vlan_id)),
+                            vlan_id=vlan_id)
+
+
+def _cached_port_bindings(port_id, switch_ip, session):
+    return _cached_bindings(session, switch_ip, ('port', port_id),
+                            port_id=port_id)
+
+
+def enable_read_cache(max_entries):
+    """Cache the bindings read per (switch, vlan) and (switch, port)."""
+    global _read_cache
+    _read_cache = nos_binding_cache.BindingReadCache(max_entries)
+    return _read_cache
+
+
+def get_read_cache():
+    """Return the binding read cache, None if disabled."""
+    return _read_cache
+
+
+def get_nosport_binding(port_id, vlan_id, switch_ip, instance_id,
+                        session=None):
     """Lists a nosport binding."""
     LOG.debug(_("get_nosport_binding() called"))
-    return _lookup_all_nos_bindings(port_id=port_id,
-                                      vlan_id=vlan_id,
-                                      switch_ip=switch_ip,
-                                      instance_id=instance_id)
+    return _lookup_all_nos_bindings(session=session,
+                                    port_id=port_id,
+                                    vlan_id=vlan_id,
+                                    switch_ip=switch_ip,
+                                    instance_id=instance_id)
 
 
-def get_nosvlan_binding(vlan_id, switch_ip):
+def get_nosvlan_binding(vlan_id, switch_ip, session=None):
     """Lists a vlan and switch binding."""
     LOG.debug(_("get_nosvlan_binding() called"))
-    return _lookup_all_nos_bindings(vlan_id=vlan_id, switch_ip=switch_ip)
+    rows = _cached_vlan_bindings(vlan_id, switch_ip, session)
+    if rows is not None:
+        if not rows:
+            raise c_exc.NOSPortBindingNotFound(vlan_id=vlan_id,
+                                               switch_ip=switch_ip)
+        return list(rows)
+    return _lookup_all_nos_bindings(session=session, vlan_id=vlan_id,
+                                    switch_ip=switch_ip)
 
 
-def add_nosport_binding(port_id, vlan_id, switch_ip, instance_id, processed=False):
+def add_nosport_binding(port_id, vlan_id, switch_ip, instance_id, processed=False,
+                        session=None):
     """Adds a nosport binding."""
     LOG.debug(_("add_nosport_binding() called"))
-    session = db.get_session()
-    binding = nos_models_v2.NOSPortBinding(port_id=port_id,
+    if session is None:
+        session = db.get_session()
+    return _add_nosport_binding(session, port_id, vlan_id, switch_ip,
+                                instance_id, processed)[0]
+
+
+def _add_nosport_binding(session, port_id, vlan_id, switch_ip, instance_id,
+                         processed):
+    """Add a binding, return it and whether it was not there yet."""
+    for lock in (False, True):
+        switch_id, interface_id = _binding_ids(session, switch_ip, port_id,
+                                               lock)
+        binding = nos_models_v2.NOSPortBinding(port_id=port_id,
                                                vlan_id=vlan_id,
                                                switch_ip=switch_ip,
                                                instance_id=instance_id,
-                                               processed=processed)
-    session.add(binding)
-    session.flush()
-    return binding
+                                               processed=processed,
+                                               switch_id=switch_id,
+                                               interface_id=interface_id)
+        try:
+            # The savepoint keeps the enclosing transaction usable when a
+            # concurrent request already added the same binding.
+            with _savepoint(session):
+                session.add(binding)
+            break
+        except db_exc.DBReferenceError:
+            # A cached interface id whose row was pruned meanwhile.
+            _evict_ids(switch_ip)
+            if lock:
+                raise
+        except db_exc.DBDuplicateEntry:
+            LOG.debug(_("add_nosport_binding() binding already exists"))
+            return _lookup_one_nos_binding(session=session,
+                                           port_id=port_id,
+                                           vlan_id=vlan_id,
+                                           switch_ip=switch_ip,
+                                           instance_id=instance_id), False
+    _bump_generations(session, [switch_id])
+    if _refcounts is not None:
+        _refcounts.add(switch_ip, port_id, vlan_id, instance_id, processed)
+    return binding, True
 
 
-def remove_nosport_binding(port_id, vlan_id, switch_ip, instance_id):
+def remove_nosport_binding(port_id, vlan_id, switch_ip, instance_id,
+                           session=None):
     """Removes a nosport binding."""
     LOG.debug(_("remove_nosport_binding() called"))
-    session = db.get_session()
+    if session is None:
+        session = db.get_session()
     binding = _lookup_all_nos_bindings(session=session,
                                          vlan_id=vlan_id,
                                          switch_ip=switch_ip,
@@ -66,23 +463,35 @@ def remove_nosport_binding(port_id, vlan_id, switch_ip, instance_id):
     for bind in binding:
         session.delete(bind)
     session.flush()
+    _bump_generations(session, [bind.switch_id for bind in binding])
+    _prune_interfaces(session, [bind.interface_id for bind in binding])
+    if _refcounts is not None:
+        _refcounts.remove(switch_ip, port_id, vlan_id, instance_id)
     return binding
 
 
-def update_nosport_binding(port_id, new_vlan_id):
+def update_nosport_binding(port_id, new_vlan_id, session=None):
     """Updates nosport binding."""
     if not new_vlan_id:
         LOG.warning(_("update_nosport_binding called with no vlan"))
         return
     LOG.debug(_("update_nosport_binding called"))
-    session = db.get_session()
+    if session is None:
+        session = db.get_session()
     binding = _lookup_one_nos_binding(session=session, port_id=port_id)
+    old_vlan_id = binding.vlan_id
     binding.vlan_id = new_vlan_id
     session.merge(binding)
     session.flush()
+    _bump_generations(session, [binding.switch_id])
+    if _refcounts is not None:
+        _refcounts.remove_one(binding.switch_ip, port_id, old_vlan_id,
+                              binding.instance_id, binding.processed)
+        _refcounts.add(binding.switch_ip, port_id, new_vlan_id,
+                       binding.instance_id, binding.processed)
     return binding
 
-def process_binding(port_id, vlan_id, switch_ip, instance_id):
+def process_binding(port_id, vlan_id, switch_ip, instance_id, session=None):
     """Mark a binding as processed (i.e. changes have been made to
        the switch"""
 
@@ -90,7 +499,8 @@ def process_binding(port_id, vlan_id, switch_ip, instance_id):
     dbg_str = dbg_str % (instance_id, vlan_id, switch_ip, port_id)
     LOG.debug(dbg_str)
 
-    session = db.get_session()
+    if session is None:
+        session = db.get_session()
     binding = _lookup_one_nos_binding(session=session,
                                       port_id=port_id,
                                       vlan_id=vlan_id,
@@ -100,36 +510,656 @@ def process_binding(port_id, vlan_id, switch_ip, instance_id):
     binding.processed = True
     session.merge(binding)
     session.flush()
+    _bump_generations(session, [binding.switch_id])
+    if _refcounts is not None:
+        _refcounts.process(switch_ip, port_id, vlan_id, instance_id)
     return binding
 
 
-def get_nosvm_bindings(vlan_id, instance_id):
+def add_nosport_bindings(bindings, processed=False, session=None):
+    """Adds nosport bindings with a single INSERT.
+
+    :param bindings: (port_id, vlan_id, switch_ip, instance_id) tuples
+    :param processed: initial processed flag of the bindings
+    :return: number of bindings added, those already present are skipped
+    """
+    LOG.debug(_("add_nosport_bindings() called"))
+    wanted = set((str(port_id), int(vlan_id), str(switch_ip),
+                  str(instance_id))
+                 for port_id, vlan_id, switch_ip, instance_id in bindings)
+    if not wanted:
+        return 0
+
+    if session is None:
+        session = db.get_session()
+    model = nos_models_v2.NOSPortBinding
+    vm_filters = [sa.and_(model.instance_id == instance_id,
+                          model.vlan_id == vlan_id)
+                  for instance_id, vlan_id in
+                  set((key[3], key[1]) for key in wanted)]
+    existing = set((port_id, int(vlan_id), switch_ip, instance_id)
+                   for port_id, vlan_id, switch_ip, instance_id in
+                   session.query(model.port_id, model.vlan_id,
+                                 model.switch_ip, model.instance_id).filter(
+                       sa.or_(*vm_filters)))
+    new = sorted(wanted - existing)
+    if not new:
+        return 0
+
+    rows = []
+    for port_id, vlan_id, switch_ip, instance_id in new:
+        switch_id, interface_id = _binding_ids(session, switch_ip, port_id)
+        rows.append({'port_id': port_id, 'vlan_id': vlan_id,
+                     'switch_ip': switch_ip, 'instance_id': instance_id,
+                     'processed': processed, 'switch_id': switch_id,
+                     'interface_id': interface_id})
+    try:
+        with _savepoint(session):
+            session.execute(model.__table__.insert(), rows)
+    except (db_exc.DBReferenceError, db_exc.DBDuplicateEntry) as e:
+        # A concurrent request added some of them or pruned one of their
+        # interfaces: add them one by one.
+        if isinstance(e, db_exc.DBReferenceError):
+            for switch_ip in set(key[2] for key in new):
+                _evict_ids(switch_ip)
+        return sum(_add_nosport_binding(session, port_id, vlan_id,
+                                        switch_ip, instance_id, processed)[1]
+                   for port_id, vlan_id, switch_ip, instance_id in new)
+
+    _bump_generations(session, [row['switch_id'] for row in rows])
+    if _refcounts is not None:
+        for port_id, vlan_id, switch_ip, instance_id in new:
+            _refcounts.add(switch_ip, port_id, vlan_id, instance_id,
+                           processed)
+    return len(rows)
+
+
+def _bulk_query(session, vlan_id=None, switch_ip=None, instance_ids=None,
+                port_ids=None):
+    """Query of the bindings matching all the filters, None if none can."""
+    model = nos_models_v2.NOSPortBinding
+    query = session.query(model)
+    if vlan_id is not None:
+        query = query.filter(model.vlan_id == vlan_id)
+    if instance_ids is not None:
+        query = query.filter(model.instance_id.in_(list(instance_ids)))
+    if switch_ip is not None:
+        switch_id = _get_switch_id(session, switch_ip)
+        if switch_id is None:
+            return None
+        query = query.filter(model.switch_id == switch_id)
+        if port_ids is not None:
+            interface_ids = [_get_interface_id(session, switch_id, port_id)
+                             for port_id in port_ids]
+            interface_ids = [interface_id for interface_id in interface_ids
+                             if interface_id is not None]
+            if not interface_ids:
+                return None
+            query = query.filter(model.interface_id.in_(interface_ids))
+    elif port_ids is not None:
+        query = query.filter(model.port_id.in_(list(port_ids)))
+    return query
+
+
+def _binding_keys(query):
+    model = nos_models_v2.NOSPortBinding
+    return query.with_entities(model.switch_ip, model.port_id,
+                               model.vlan_id, model.instance_id).all()
+
+
+def process_bindings(vlan_id, switch_ip, instance_id, port_ids=None,
+                     session=None):
+    """Mark the bindings of an instance on a switch as processed.
+
+    Issues a single UPDATE, optionally restricted to some ports.
+    Returns the number of bindings marked.
+    """
+    LOG.debug(_("process_bindings() called"))
+    if port_ids is not None and not port_ids:
+        return 0
+    if session is None:
+        session = db.get_session()
+    query = _bulk_query(session, vlan_id=vlan_id, switch_ip=switch_ip,
+                        instance_ids=[instance_id], port_ids=port_ids)
+    if query is None:
+        return 0
+    query = query.filter_by(processed=False)
+    keys = _binding_keys(query) if _refcounts is not None else ()
+    count = query.update({'processed': True}, synchronize_session=False)
+    if count:
+        _bump_generations(session, [_get_switch_id(session, switch_ip)])
+    for key in keys:
+        _refcounts.process(*key)
+    return count
+
+
+def remove_nosport_bindings(vlan_id=None, switch_ip=None, instance_ids=None,
+                            port_ids=None, session=None):
+    """Removes the nosport bindings matching all the given filters.
+
+    Issues a single DELETE, e.g. for all the instances of a host or all
+    the bindings of a network VLAN.  Returns the number of bindings
+    removed.
+    """
+    LOG.debug(_("remove_nosport_bindings() called"))
+    if vlan_id is None and switch_ip is None and not instance_ids and (
+            not port_ids):
+        raise ValueError(_("remove_nosport_bindings() needs a filter"))
+    if (instance_ids is not None and not instance_ids) or (
+            port_ids is not None and not port_ids):
+        return 0
+    if session is None:
+        session = db.get_session()
+    query = _bulk_query(session, vlan_id=vlan_id, switch_ip=switch_ip,
+                        instance_ids=instance_ids, port_ids=port_ids)
+    if query is None:
+        return 0
+    keys = _binding_keys(query) if _refcounts is not None else ()
+    model = nos_models_v2.NOSPortBinding
+    rows = query.with_entities(model.switch_id,
+                               model.interface_id).distinct().all()
+    count = query.delete(synchronize_session=False)
+    if count:
+        _bump_generations(session, [row.switch_id for row in rows])
+        _prune_interfaces(session, [row.interface_id for row in rows])
+    for key in keys:
+        _refcounts.remove(*key)
+    return count
+
+
+def get_nosvm_bindings(vlan_id, instance_id, session=None):
     """Lists nosvm bindings."""
     LOG.debug(_("get_nosvm_bindings() called"))
-    return _lookup_all_nos_bindings(instance_id=instance_id,
-                                      vlan_id=vlan_id)
+    return _lookup_all_nos_bindings(session=session,
+                                    instance_id=instance_id,
+                                    vlan_id=vlan_id)
 
 
-def get_port_vlan_switch_binding(port_id, vlan_id, switch_ip):
+def get_port_vlan_switch_binding(port_id, vlan_id, switch_ip, session=None):
     """Lists nosvm bindings."""
     LOG.debug(_("get_port_vlan_switch_binding() called"))
-    return _lookup_all_nos_bindings(port_id=port_id,
-                                      switch_ip=switch_ip,
-                                      vlan_id=vlan_id)
+    rows = _cached_port_bindings(port_id, switch_ip, session)
+    if rows is not None:
+        rows = [row for row in rows if row.vlan_id == int(vlan_id)]
+        if not rows:
+            raise c_exc.NOSPortBindingNotFound(port_id=port_id,
+                                               switch_ip=switch_ip,
+                                               vlan_id=vlan_id)
+        return rows
+    return _lookup_all_nos_bindings(session=session,
+                                    port_id=port_id,
+                                    switch_ip=switch_ip,
+                                    vlan_id=vlan_id)
 
 
-def get_port_switch_bindings(port_id, switch_ip):
+def get_port_switch_bindings(port_id, switch_ip, session=None):
     """List all vm/vlan bindings on a NOS switch port."""
     LOG.debug(_("get_port_switch_bindings() called, "
                 "port:'%(port_id)s', switch:'%(switch_ip)s'"),
               {'port_id': port_id, 'switch_ip': switch_ip})
+    rows = _cached_port_bindings(port_id, switch_ip, session)
+    if rows is not None:
+        return list(rows) or None
     try:
-        return _lookup_all_nos_bindings(port_id=port_id,
-                                          switch_ip=switch_ip)
+        return _lookup_all_nos_bindings(session=session,
+                                        port_id=port_id,
+                                        switch_ip=switch_ip)
     except c_exc.NOSPortBindingNotFound:
         pass
 
 
+def nosport_binding_exists(session=None, **bfilter):
+    """Whether a binding matching the filter exists, using EXISTS."""
+    LOG.debug(_("nosport_binding_exists() called"))
+    if session is None:
+        session = db.get_session()
+    bfilter = _id_filter(session, bfilter)
+    if bfilter is None:
+        return False
+    query = session.query(nos_models_v2.NOSPortBinding).filter_by(**bfilter)
+    return session.query(query.exists()).scalar()
+
+
+def nosvlan_binding_exists(vlan_id, switch_ip, session=None):
+    """Whether any binding uses the vlan on the switch."""
+    rows = _cached_vlan_bindings(vlan_id, switch_ip, session)
+    if rows is not None:
+        return bool(rows)
+    return nosport_binding_exists(session=session, vlan_id=vlan_id,
+                                  switch_ip=switch_ip)
+
+
+def port_vlan_switch_binding_exists(port_id, vlan_id, switch_ip,
+                                    session=None):
+    """Whether any binding uses the vlan on the switch port."""
+    rows = _cached_port_bindings(port_id, switch_ip, session)
+    if rows is not None:
+        return any(row.vlan_id == int(vlan_id) for row in rows)
+    return nosport_binding_exists(session=session, port_id=port_id,
+                                  vlan_id=vlan_id, switch_ip=switch_ip)
+
+
+def get_port_switch_bindings_count(port_id, switch_ip, session=None):
+    """Count the vm/vlan bindings on a NOS switch port."""
+    LOG.debug(_("get_port_switch_bindings_count() called, "
+                "port:'%(port_id)s', switch:'%(switch_ip)s'"),
+              {'port_id': port_id, 'switch_ip': switch_ip})
+    rows = _cached_port_bindings(port_id, switch_ip, session)
+    if rows is not None:
+        return len(rows)
+    if session is None:
+        session = db.get_session()
+    bfilter = _id_filter(session, {'port_id': port_id,
+                                   'switch_ip': switch_ip})
+    if bfilter is None:
+        return 0
+    model = nos_models_v2.NOSPortBinding
+    return session.query(sa.func.count(model.binding_id)).filter_by(
+        **bfilter).scalar()
+
+
+def _count_if(condition):
+    return sa.func.coalesce(
+        sa.func.sum(sa.case([(condition, 1)], else_=0)), 0)
+
+
+def get_vlan_binding_summary(vlan_id, switch_ip, port_id, instance_id,
+                             session=None):
+    """Summarize the bindings of a vlan on a switch in one query.
+
+    :return: (own, own_processed, others_processed) where own are the
+             bindings of instance_id on port_id and others all the rest
+    """
+    LOG.debug(_("get_vlan_binding_summary() called"))
+    rows = _cached_vlan_bindings(vlan_id, switch_ip, session)
+    if rows is not None:
+        own = [row for row in rows
+               if row.port_id == port_id and row.instance_id == instance_id]
+        own_processed = sum(row.processed for row in own)
+        return (len(own), own_processed,
+                sum(row.processed for row in rows) - own_processed)
+    if session is None:
+        session = db.get_session()
+    switch_id = _get_switch_id(session, switch_ip)
+    if switch_id is None:
+        return 0, 0, 0
+    interface_id = _get_interface_id(session, switch_id, port_id)
+    model = nos_models_v2.NOSPortBinding
+    own = sa.and_(model.interface_id == interface_id,
+                  model.instance_id == instance_id)
+    processed = model.processed == sa.true()
+    row = session.query(
+        _count_if(own),
+        _count_if(sa.and_(own, processed)),
+        _count_if(sa.and_(sa.not_(own), processed))).filter_by(
+            vlan_id=vlan_id, switch_id=switch_id).one()
+    return tuple(int(count) for count in row)
+
+
+def get_switch_vlan_usage(switch_ip=None, session=None):
+    """Count the bindings per vlan of each switch.
+
+    :return: {switch_ip: {vlan_id: bindings}}
+    """
+    LOG.debug(_("get_switch_vlan_usage() called"))
+    if session is None:
+        session = _get_reader_session()
+    model = nos_models_v2.NOSPortBinding
+    switch = nos_models_v2.NOSSwitch
+    query = session.query(switch.switch_ip, model.vlan_id,
+                          sa.func.count(model.binding_id)).select_from(
+        model).join(switch, model.switch_id == switch.id)
+    if switch_ip is not None:
+        query = query.filter(switch.switch_ip == switch_ip)
+    usage = {}
+    for row_switch_ip, vlan_id, count in query.group_by(switch.switch_ip,
+                                                        model.vlan_id):
+        usage.setdefault(row_switch_ip, {})[int(vlan_id)] = count
+    return usage
+
+
+def get_interface_vlan_usage(switch_ip, session=None):
+    """Count the bindings per vlan of each interface of a switch.
+
+    :return: {port_id: {vlan_id: (bindings, processed bindings)}}
+    """
+    LOG.debug(_("get_interface_vlan_usage() called"))
+    if session is None:
+        session = _get_reader_session()
+    switch_id = _get_switch_id(session, switch_ip)
+    if switch_id is None:
+        return {}
+    model = nos_models_v2.NOSPortBinding
+    interface = nos_models_v2.NOSSwitchInterface
+    query = session.query(interface.port_id, model.vlan_id,
+                          sa.func.count(model.binding_id),
+                          _count_if(model.processed == sa.true())).select_from(
+        model).join(interface, model.interface_id == interface.id).filter(
+        model.switch_id == switch_id).group_by(interface.port_id,
+                                               model.vlan_id)
+    usage = {}
+    for port_id, vlan_id, count, processed in query:
+        usage.setdefault(port_id, {})[int(vlan_id)] = (count, int(processed))
+    return usage
+
+
+def get_all_nosport_bindings(switch_ip=None, session=None, reader=False):
+    """List all bindings, optionally only those of one NOS switch.
+
+    :param reader: the bindings are only reported, they may be read
+                   from the reader database
+    """
+    LOG.debug(_("get_all_nosport_bindings() called"))
+    if session is None:
+        session = _get_reader_session() if reader else db.get_session()
+    query = session.query(nos_models_v2.NOSPortBinding)
+    if switch_ip is not None:
+        switch_id = _get_switch_id(session, switch_ip)
+        if switch_id is None:
+            return []
+        query = query.filter_by(switch_id=switch_id)
+    return query.all()
+
+
+def _unclaimed(model, now):
+    return sa.or_(model.claimed_until.is_(None), model.claimed_until <= now)
+
+
+def get_stale_bindings(older_than, limit, now=None, session=None):
+    """Unprocessed bindings created before older_than, oldest first.
+
+    The bindings claimed by a sweeper until after 'now' are skipped.
+    """
+    LOG.debug(_("get_stale_bindings() called"))
+    if now is None:
+        now = timeutils.utcnow()
+    if session is None:
+        session = db.get_session()
+    model = nos_models_v2.NOSPortBinding
+    return session.query(model).filter(
+        model.processed == sa.false(),
+        model.created_at < older_than,
+        _unclaimed(model, now)).order_by(
+        model.created_at).limit(limit).all()
+
+
+def get_orphaned_bindings(older_than, limit, now=None, session=None):
+    """Bindings created before older_than whose instance has no port.
+
+    The bindings claimed by a sweeper until after 'now' are skipped.
+    """
+    LOG.debug(_("get_orphaned_bindings() called"))
+    if now is None:
+        now = timeutils.utcnow()
+    if session is None:
+        session = db.get_session()
+    model = nos_models_v2.NOSPortBinding
+    port_exists = sa.exists().where(
+        models_v2.Port.device_id == model.instance_id)
+    return session.query(model).filter(
+        model.created_at < older_than,
+        _unclaimed(model, now),
+        ~port_exists).order_by(model.created_at).limit(limit).all()
+
+
+def claim_binding(binding, now, lease):
+    """Claim a binding for a sweeper retry or purge of 'lease' seconds.
+
+    A compare-and-set on the attempts counter read with the binding:
+    only one of the sweepers that read it at that count wins, and its
+    claim counts one more attempt.  A claim is taken over once expired.
+
+    Returns True if this sweeper got the binding.
+    """
+    LOG.debug(_("claim_binding() called"))
+    session = db.get_session()
+    model = nos_models_v2.NOSPortBinding
+    with session.begin(subtransactions=True):
+        return session.query(model).filter(
+            model.binding_id == binding.binding_id,
+            model.attempts == binding.attempts,
+            _unclaimed(model, now)).update(
+            {'attempts': model.attempts + 1,
+             'claimed_until': now + datetime.timedelta(seconds=lease)},
+            synchronize_session=False) == 1
+
+
+def schedule_vlan_deletion(switch_ip, vlan_id, delete_after, session=None):
+    """Schedule the deletion of a VLAN unless it is already scheduled.
+
+    Returns True if the deletion was not scheduled yet.
+    """
+    LOG.debug(_("schedule_vlan_deletion() called"))
+    if session is None:
+        session = db.get_session()
+    switch_id = _get_switch_id(session, switch_ip, create=True)
+    try:
+        with _savepoint(session):
+            session.add(nos_models_v2.NOSVlanDeletion(
+                switch_id=switch_id, vlan_id=int(vlan_id),
+                delete_after=delete_after))
+    except db_exc.DBDuplicateEntry:
+        return False
+    return True
+
+
+def cancel_vlan_deletion(switch_ip, vlan_id, session=None):
+    """Cancel the scheduled deletion of a VLAN.
+
+    A deletion claimed by a sweep is waited for, polling the row without
+    holding any lock, until the sweep completes or its claim expires.
+
+    Returns True if an unclaimed deletion was pending and is cancelled:
+    the VLAN is still on the switch.  False means that the VLAN may have
+    been deleted.
+    """
+    LOG.debug(_("cancel_vlan_deletion() called"))
+    if session is None:
+        session = db.get_session()
+    switch_id = _get_switch_id(session, switch_ip)
+    if switch_id is None:
+        return False
+    model = nos_models_v2.NOSVlanDeletion
+    waited = False
+    while True:
+        row = session.query(model.claim_id, model.claimed_until).filter_by(
+            switch_id=switch_id, vlan_id=int(vlan_id)).first()
+        if row is None:
+            return False
+        claim_id, claimed_until = row
+        if claim_id is not None and claimed_until > timeutils.utcnow():
+            waited = True
+            time.sleep(_CLAIM_POLL_INTERVAL)
+            continue
+        if session.query(model).filter_by(
+                switch_id=switch_id, vlan_id=int(vlan_id),
+                claim_id=claim_id).delete(synchronize_session=False):
+            # An expired claim leaves the VLAN in an unknown state.
+            return not waited and claim_id is None
+
+
+def get_vlan_deletions(switch_ip=None, due_before=None, session=None):
+    """Scheduled VLAN deletions as sorted (switch_ip, vlan_id) pairs.
+
+    :param switch_ip: only those of this switch
+    :param due_before: only those due before this time
+    """
+    LOG.debug(_("get_vlan_deletions() called"))
+    if session is None:
+        session = db.get_session()
+    model = nos_models_v2.NOSVlanDeletion
+    switch = nos_models_v2.NOSSwitch
+    query = session.query(switch.switch_ip, model.vlan_id).select_from(
+        model).join(switch, model.switch_id == switch.id)
+    if switch_ip is not None:
+        query = query.filter(switch.switch_ip == switch_ip)
+    if due_before is not None:
+        query = query.filter(model.delete_after <= due_before)
+    return sorted((row_switch_ip, int(vlan_id))
+                  for row_switch_ip, vlan_id in query)
+
+
+def claim_vlan_deletions(switch_ip, now, limit, lease):
+    """Claim the due VLAN deletions of a switch, at most 'limit'.
+
+    The rows are marked with a new claim id, valid for 'lease' seconds,
+    in a short transaction; the rows whose VLAN got a binding again are
+    removed at once.  The caller deletes the claimed VLANs from the
+    switch outside of any transaction, then calls
+    complete_vlan_deletions() or release_vlan_deletions().  A claim left
+    by a dead sweep is taken over once expired.
+
+    :return: the claim id, the VLAN ids to delete from the switch and
+             the number of rows claimed
+    """
+    LOG.debug(_("claim_vlan_deletions() called"))
+    session = db.get_session()
+    switch_id = _get_switch_id(session, switch_ip)
+    if switch_id is None:
+        return None, [], 0
+    model = nos_models_v2.NOSVlanDeletion
+    binding = nos_models_v2.NOSPortBinding
+    claim_id = uuidutils.generate_uuid()
+    claimable = sa.or_(model.claim_id.is_(None), model.claimed_until <= now)
+    with session.begin(subtransactions=True):
+        vlan_ids = [vlan_id for vlan_id, in session.query(
+            model.vlan_id).filter(
+            model.switch_id == switch_id, model.delete_after <= now,
+            claimable).order_by(model.vlan_id).limit(limit)]
+        if not vlan_ids:
+            return claim_id, [], 0
+        # Only the rows still claimable are taken, should another sweep
+        # have claimed some meanwhile.
+        session.query(model).filter(
+            model.switch_id == switch_id, model.vlan_id.in_(vlan_ids),
+            claimable).update(
+            {'claim_id': claim_id,
+             'claimed_until': now + datetime.timedelta(seconds=lease)},
+            synchronize_session=False)
+        claimed = [vlan_id for vlan_id, in session.query(
+            model.vlan_id).filter(model.claim_id == claim_id)]
+        if not claimed:
+            return claim_id, [], 0
+        used = set(vlan_id for vlan_id, in session.query(
+            binding.vlan_id).filter(binding.switch_id == switch_id,
+                                    binding.vlan_id.in_(claimed)).distinct())
+        if used:
+            session.query(model).filter(
+                model.claim_id == claim_id,
+                model.vlan_id.in_(list(used))).delete(
+                synchronize_session=False)
+    return (claim_id,
+            sorted(vlan_id for vlan_id in claimed if vlan_id not in used),
+            len(claimed))
+
+
+def complete_vlan_deletions(claim_id):
+    """Remove the rows of a claim whose VLANs were deleted."""
+    LOG.debug(_("complete_vlan_deletions() called"))
+    session = db.get_session()
+    model = nos_models_v2.NOSVlanDeletion
+    with session.begin(subtransactions=True):
+        return session.query(model).filter_by(claim_id=claim_id).delete(
+            synchronize_session=False)
+
+
+def release_vlan_deletions(claim_id):
+    """Give up a claim, keeping its rows for a later sweep."""
+    LOG.debug(_("release_vlan_deletions() called"))
+    session = db.get_session()
+    model = nos_models_v2.NOSVlanDeletion
+    with session.begin(subtransactions=True):
+        return session.query(model).filter_by(claim_id=claim_id).update(
+            {'claim_id': None, 'claimed_until': None},
+            synchronize_session=False)
+
+
+def acquire_lease(name, holder, duration, now=None):
+    """Take or renew the lease 'name' for 'duration' seconds.
+
+    A lease is taken over once expired.  Returns True if 'holder' holds
+    the lease.
+    """
+    LOG.debug(_("acquire_lease() called"))
+    if now is None:
+        now = timeutils.utcnow()
+    expires_at = now + datetime.timedelta(seconds=duration)
+    session = db.get_session()
+    model = nos_models_v2.NOSLease
+    with session.begin(subtransactions=True):
+        if session.query(model).filter(
+                model.name == name,
+                sa.or_(model.holder == holder,
+                       model.expires_at <= now)).update(
+                {'holder': holder, 'expires_at': expires_at},
+                synchronize_session=False):
+            return True
+    try:
+        with session.begin(subtransactions=True):
+            session.add(model(name=name, holder=holder,
+                              expires_at=expires_at))
+    except db_exc.DBDuplicateEntry:
+        # Held by another process.
+        return False
+    return True
+
+
+def release_lease(name, holder):
+    """Give up the lease 'name' if 'holder' holds it."""
+    LOG.debug(_("release_lease() called"))
+    session = db.get_session()
+    model = nos_models_v2.NOSLease
+    with session.begin(subtransactions=True):
+        return session.query(model).filter_by(
+            name=name, holder=holder).delete(synchronize_session=False)
+
+
+def get_binding_refcounts():
+    """Return the in-memory binding reference counts, None if disabled."""
+    return _refcounts
+
+
+def load_binding_refcounts(session=None):
+    """Build the binding reference counts from the database."""
+    LOG.debug(_("load_binding_refcounts() called"))
+    if session is None:
+        session = db.get_session()
+    model = nos_models_v2.NOSPortBinding
+    processed = _count_if(model.processed == sa.true())
+    rows = session.query(model.switch_ip, model.port_id, model.vlan_id,
+                         model.instance_id, sa.func.count(),
+                         processed).group_by(model.switch_ip,
+                                             model.port_id,
+                                             model.vlan_id,
+                                             model.instance_id)
+    return nos_binding_refcount.BindingRefCounts.from_counts(rows)
+
+
+def enable_binding_refcounts():
+    """Load the binding reference counts and keep them up to date."""
+    global _refcounts
+    _refcounts = load_binding_refcounts()
+    return _refcounts
+
+
+def resync_binding_refcounts():
+    """Rebuild the binding reference counts from the database.
+
+    Corrects the counts for writes made by other processes or rolled
+    back after the counts were updated.  Returns True if they drifted.
+    """
+    global _refcounts
+    if _refcounts is None:
+        return False
+    refcounts = load_binding_refcounts()
+    drifted = refcounts != _refcounts
+    if drifted:
+        LOG.info(_("NOS binding reference counts were out of sync with "
+                   "the database, reloaded"))
+    _refcounts = refcounts
+    return drifted
+
+
 def _lookup_nos_bindings(query_type, session=None, **bfilter):
     """Look up 'query_type' NOS bindings matching the filter.
 
@@ -141,8 +1171,11 @@ def _lookup_nos_bindings(query_type, session=None, **bfilter):
     """
     if session is None:
         session = db.get_session()
+    id_filter = _id_filter(session, bfilter)
+    if id_filter is None:
+        raise c_exc.NOSPortBindingNotFound(**bfilter)
     query_method = getattr(session.query(
-        nos_models_v2.NOSPortBinding).filter_by(**bfilter), query_type)
+        nos_models_v2.NOSPortBinding).filter_by(**id_filter), query_type)
     try:
         bindings = query_method()
         if bindings:
@@ -0,0 +1,69 @@
+# Copyright (c) 2017, Lenovo.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Time budget of the switch I/O done for one mechanism driver hook
+"""
+
+import time
+
+from oslo_config import cfg
+
+from networking_lenovo.ml2 import exceptions as cexc
+
+
+class Deadline(object):
+    """
+    Point in time by which all the switch I/O of a hook must be done.
+
+    The mechanism driver creates one per hook and passes it down, as the
+    'deadline' keyword argument, to every backend call.  Each switch
+    request then waits at most the remaining time, and no new request is
+    started once the budget is spent.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.expires_at = time.time() + budget
+
+    @classmethod
+    def for_hook(cls):
+        """ Deadline of a hook, None if switch_io_deadline is 0 """
+        budget = cfg.CONF.ml2_lenovo.switch_io_deadline
+        return cls(budget) if budget else None
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.time())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def check(self, operation):
+        """ Raise NOSDeadlineExceeded if the budget is spent """
+        if self.expired():
+            raise cexc.NOSDeadlineExceeded(operation=operation,
+                                           budget=self.budget)
+
+
+def bounded_timeout(deadline, timeout, operation):
+    """
+    Timeout of one switch request: 'timeout' cut down to what is left
+    of 'deadline' (which may be None).  Raises NOSDeadlineExceeded when
+    nothing is left.
+    """
+    if deadline is None:
+        return timeout
+    deadline.check(operation)
+    return min(timeout, deadline.remaining())
@@ -0,0 +1,145 @@
+# Copyright (c) 2017, Lenovo.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Switch health: per switch circuit breaker and background prober
+"""
+
+import time
+
+import eventlet
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_service import loopingcall
+
+LOG = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker(object):
+    """
+    Up/down state of one switch.
+
+    The breaker opens after 'threshold' consecutive failures to reach
+    the switch; operations are then not attempted.  After reset_timeout
+    seconds it lets a single trial operation through (half-open): its
+    success closes the breaker, its failure opens it again.  Should the
+    trial report neither, another one is let through reset_timeout
+    seconds later.  A successful health probe closes it at once.
+    on_change(host, old, new) is called on every state change.
+    """
+
+    def __init__(self, host, threshold, reset_timeout, on_change):
+        self.host = host
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._on_change = on_change
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.trial_at = None
+
+    def _set_state(self, state):
+        old, self.state = self.state, state
+        if old != state:
+            self._on_change(self.host, old, state)
+
+    def allow(self):
+        """ Whether an operation may be attempted on the switch """
+        if self.state == CLOSED:
+            return True
+        if self.retry_after() > 0:
+            return False
+        # The caller is the trial of the half-open breaker.
+        self.trial_at = time.time()
+        self._set_state(HALF_OPEN)
+        return True
+
+    def retry_after(self):
+        """ Seconds before allow() lets an operation through """
+        if self.state == OPEN:
+            since = self.opened_at
+        elif self.state == HALF_OPEN and self.trial_at is not None:
+            since = self.trial_at
+        else:
+            return 0
+        return max(0, since + self.reset_timeout - time.time())
+
+    def success(self):
+        self.failures = 0
+        self.trial_at = None
+        self._set_state(CLOSED)
+
+    def failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.threshold:
+            self.opened_at = time.time()
+            self.trial_at = None
+            self._set_state(OPEN)
+
+
+class SwitchHealthMonitor(object):
+    """
+    Probes every configured switch in the background.
+
+    Each probe is the lightest request of the switch backend (REST
+    login, NETCONF hello, SNMP GET of sysUpTime) and its outcome feeds
+    the circuit breaker of the switch, so a switch going down is noticed
+    without a port event paying for it, and one coming back is used,
+    and its deferred work replayed, without waiting for reset_timeout.
+    """
+
+    def __init__(self, driver, switch_ips):
+        """
+        :param driver: LenovoNOSDriver
+        :param switch_ips: callable returning the switches to probe
+        """
+        self.driver = driver
+        self._switch_ips = switch_ips
+        self._timer = None
+
+    def start(self, interval):
+        """ Probe the switches every 'interval' seconds """
+        self._timer = loopingcall.FixedIntervalLoopingCall(self._run)
+        self._timer.start(interval=interval, initial_delay=interval)
+
+    def stop(self):
+        if self._timer:
+            self._timer.stop()
+            self._timer = None
+
+    def _run(self):
+        try:
+            self.probe_all()
+        except Exception:
+            LOG.exception(_("NOS switch health probe failed"))
+
+    def probe_all(self):
+        """
+        Probe all the switches concurrently.
+
+        Returns {switch_ip: True if the switch answered}.
+        """
+        switch_ips = list(self._switch_ips())
+        timeout = cfg.CONF.ml2_lenovo.switch_health_timeout
+        pool = eventlet.GreenPool(
+            cfg.CONF.ml2_lenovo.switch_fanout_concurrency)
+        results = pool.imap(
+            lambda switch_ip: self.driver.probe(switch_ip, timeout),
+            switch_ips)
+        return dict(zip(switch_ips, results))
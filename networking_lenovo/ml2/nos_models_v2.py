@@ -14,15 +14,92 @@
 # limitations under the License.
 
 
+from oslo_utils import timeutils
 import sqlalchemy as sa
 
 from neutron.db import model_base
 
 
+class NOSSwitch(model_base.BASEV2):
+    """Represents a NOS switch."""
+
+    __tablename__ = "lenovo_ml2_nos_switches"
+
+    id = sa.Column(sa.Integer, primary_key=True, autoincrement=True)
+    switch_ip = sa.Column(sa.String(255), nullable=False, unique=True)
+    # Bumped by every write to the bindings of the switch.
+    generation = sa.Column(sa.BigInteger, nullable=False, default=0,
+                           server_default='0')
+
+
+class NOSSwitchInterface(model_base.BASEV2):
+    """Represents an interface of a NOS switch, e.g. 'portchannel:64'."""
+
+    __tablename__ = "lenovo_ml2_nos_switch_interfaces"
+    __table_args__ = (
+        sa.UniqueConstraint('switch_id', 'port_id',
+                            name='uniq_lenovo_nos_switch_interfaces0port'),
+    )
+
+    id = sa.Column(sa.Integer, primary_key=True, autoincrement=True)
+    switch_id = sa.Column(sa.Integer,
+                          sa.ForeignKey('lenovo_ml2_nos_switches.id',
+                                        ondelete='CASCADE'),
+                          nullable=False)
+    port_id = sa.Column(sa.String(255), nullable=False)
+
+
+class NOSVlanDeletion(model_base.BASEV2):
+    """Represents an unused VLAN to delete from a switch after a delay."""
+
+    __tablename__ = "lenovo_ml2_nos_vlan_deletions"
+    __table_args__ = (
+        sa.Index('ix_lenovo_nos_vlan_deletions_delete_after',
+                 'delete_after'),
+    )
+
+    switch_id = sa.Column(sa.Integer,
+                          sa.ForeignKey('lenovo_ml2_nos_switches.id',
+                                        ondelete='CASCADE'),
+                          primary_key=True)
+    vlan_id = sa.Column(sa.Integer, primary_key=True, autoincrement=False)
+    delete_after = sa.Column(sa.DateTime, nullable=False)
+    # Sweep deleting the VLAN from the switch, and until when
+    claim_id = sa.Column(sa.String(36), nullable=True)
+    claimed_until = sa.Column(sa.DateTime, nullable=True)
+
+
+class NOSLease(model_base.BASEV2):
+    """Represents the election of one neutron-server for a periodic task."""
+
+    __tablename__ = "lenovo_ml2_nos_leases"
+
+    name = sa.Column(sa.String(64), primary_key=True)
+    # Id of the process holding the lease, and until when
+    holder = sa.Column(sa.String(36), nullable=False)
+    expires_at = sa.Column(sa.DateTime, nullable=False)
+
+
 class NOSPortBinding(model_base.BASEV2):
     """Represents a binding of VM's to nos ports."""
 
     __tablename__ = "lenovo_ml2_nosport_bindings"
+    __table_args__ = (
+        sa.UniqueConstraint(
+            'switch_id', 'interface_id', 'vlan_id', 'instance_id',
+            name='uniq_lenovo_nosport_bindings0binding'),
+        sa.Index('ix_lenovo_nosport_bindings_switch_ip_port_id',
+                 'switch_ip', 'port_id'),
+        sa.Index('ix_lenovo_nosport_bindings_instance_id_vlan_id',
+                 'instance_id', 'vlan_id'),
+        sa.Index('ix_lenovo_nosport_bindings_switch_id_vlan_id',
+                 'switch_id', 'vlan_id'),
+        sa.Index('ix_lenovo_nosport_bindings_interface_id_vlan_id',
+                 'interface_id', 'vlan_id'),
+        sa.Index('ix_lenovo_nosport_bindings_processed_created_at',
+                 'processed', 'created_at'),
+        sa.Index('ix_lenovo_nosport_bindings_created_at', 'created_at'),
+    )
 
     binding_id = sa.Column(sa.Integer, primary_key=True, autoincrement=True)
     port_id = sa.Column(sa.String(255))
@@ -30,6 +107,19 @@ class NOSPortBinding(model_base.BASEV2):
     switch_ip = sa.Column(sa.String(255))
     instance_id = sa.Column(sa.String(255))
     processed = sa.Column(sa.Boolean, nullable=False)
+    switch_id = sa.Column(sa.Integer,
+                          sa.ForeignKey('lenovo_ml2_nos_switches.id',
+                                        ondelete='CASCADE'))
+    interface_id = sa.Column(
+        sa.Integer,
+        sa.ForeignKey('lenovo_ml2_nos_switch_interfaces.id',
+                      ondelete='CASCADE'))
+    created_at = sa.Column(sa.DateTime, default=timeutils.utcnow)
+    # Configuration attempts made by the stale binding sweeper
+    attempts = sa.Column(sa.Integer, nullable=False, default=0,
+                         server_default='0')
+    # Until when a sweeper retries or purges the binding
+    claimed_until = sa.Column(sa.DateTime, nullable=True)
 
     def __repr__(self):
         """Just the binding, without the id key."""
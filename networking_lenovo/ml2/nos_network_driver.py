@@ -14,15 +14,25 @@
 # limitations under the License.
 
 
+import collections
+import socket
+
+import eventlet
+from eventlet import event
+from eventlet import semaphore
 from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_utils import excutils
 from oslo_utils import importutils
+import requests
 
 from networking_lenovo.ml2 import config as conf
 from networking_lenovo.ml2 import constants as const
 from networking_lenovo.ml2 import exceptions as cexc
 from networking_lenovo.ml2 import nos_db_v2
+from networking_lenovo.ml2 import nos_deadline
+from networking_lenovo.ml2 import nos_health
+from networking_lenovo.ml2 import nos_retry
 from networking_lenovo.ml2 import nos_snippets as snipp
 from networking_lenovo.ml2 import nos_network_driver_netconf
 from networking_lenovo.ml2 import nos_network_driver_snmp
@@ -30,7 +40,90 @@ from networking_lenovo.ml2 import cnos_network_driver_rest
 
 LOG = logging.getLogger(__name__)
 
+
+# One operation of a batch passed to apply_batch()
+SwitchOperation = collections.namedtuple(
+    'SwitchOperation', ['op', 'vlan_id', 'vlan_name', 'intf_type', 'interface'])
+SwitchOperation.__new__.__defaults__ = (None, None, None)
+
+# Returned by an operation queued because its switch is down
+DEFERRED = object()
+
+# Errors meaning the switch could not be reached
+SWITCH_DOWN_ERRORS = (cexc.NOSConnectFailed, cexc.NOSSNMPFailure)
+
+# Errors meaning the switch did not answer in time or the transport broke
+NO_ANSWER_ERRORS = SWITCH_DOWN_ERRORS + (
+    cexc.NOSDeadlineExceeded, socket.error,
+    requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+# Operations that may be queued while their switch is down
+DEFERRABLE_OPERATIONS = ('delete_vlan', 'enable_vlan_on_trunk_int',
+                         'disable_vlan_on_trunk_int', 'create_and_trunk_vlan',
+                         'apply_batch')
+
+
+def _is_ncclient_error(exc, module, name):
+    ncclient_module = importutils.try_import('ncclient.' + module)
+    error = getattr(ncclient_module, name, None)
+    return error is not None and isinstance(exc, error)
+
+
+def switch_answered(exc):
+    """
+    What a failed operation tells about its switch: True if the switch
+    answered, rejecting the request (a 4xx or a NETCONF rpc-error),
+    False if it did not answer (connection or transport error,
+    timeout, 5xx) and None if the error is not about the switch.
+    """
+    if isinstance(exc, cexc.NOSConfigFailed) and exc.exc is not None:
+        exc = exc.exc
+    if (isinstance(exc, NO_ANSWER_ERRORS) or
+            _is_ncclient_error(exc, 'transport', 'TransportError') or
+            _is_ncclient_error(exc, 'operations', 'TimeoutExpiredError')):
+        return False
+    if isinstance(exc, cexc.NOSRestHTTPError):
+        return exc.http_code < 500
+    if (isinstance(exc, cexc.NOSJsonFieldNotFound) or
+            _is_ncclient_error(exc, 'operations', 'RPCError')):
+        return True
+    return None
+
+
+class _TrunkBatch(object):
+    """
+    VLAN add/remove requests waiting for the same switch interface.
+
+    Every request adds +1 (add) or -1 (remove) to its VLAN, so an add
+    and a remove of the same VLAN offset each other.  The callers wait
+    on 'done', which is sent a {vlan_id: exception or None} dictionary.
+    'deferred' tells whether the switch was down and the batch queued.
+    """
+
+    def __init__(self):
+        self.deltas = collections.OrderedDict()
+        self.done = event.Event()
+        self.deferred = False
+
+    def add(self, vlan_id, delta):
+        self.deltas[vlan_id] = self.deltas.get(vlan_id, 0) + delta
+
+
 class LenovoNOSDriver(object):
+    """
+    Dispatches the switch operations to the backend of each switch.
+
+    Every operation accepts a 'deadline' (nos_deadline.Deadline) bounding
+    the time its switch I/O may take; it is handed to the backend as is.
+
+    Each switch has a circuit breaker (nos_health.CircuitBreaker).  While
+    it is open, operations on the switch raise NOSSwitchUnavailable at
+    once or, with switch_down_action = defer, are queued and return
+    DEFERRED; the queue is replayed in order once the breaker closes, or
+    tried again each time the breaker lets a trial operation through.
+    Operations arriving while a queue is replayed are queued behind it.
+    """
+
     PROTO_SNMP = 'snmp'
     PROTO_NETCONF = 'netconf'
     PROTO_REST = 'rest'
@@ -51,6 +144,18 @@ class LenovoNOSDriver(object):
                   cnos_network_driver_rest.LenovoCNOSDriverREST(),
         }
 
+        self.pending_trunk_ops = {}
+        # One lock per interface, held while a batch is applied
+        self._trunk_locks = collections.defaultdict(semaphore.Semaphore)
+
+        self._breakers = {}
+        self._deferred = {}
+        self._replaying = set()
+        # Timed replays armed while a switch is down
+        self._replay_timers = {}
+        self._replay_backoff = nos_retry.RetryPolicy.from_config()
+        self.health_stats = collections.Counter()
+
 
     def _get_driver(self, host):
         """ 
@@ -73,25 +178,302 @@ class LenovoNOSDriver(object):
         return driver
         
 
-    def delete_vlan(self, nos_host, vlan_id):
-        func = self._get_driver(nos_host).delete_vlan
+    def _breaker(self, nos_host):
+        """ Circuit breaker of a switch, None if disabled """
+        threshold = cfg.CONF.ml2_lenovo.switch_breaker_threshold
+        if not threshold:
+            return None
+        breaker = self._breakers.get(nos_host)
+        if breaker is None:
+            breaker = nos_health.CircuitBreaker(
+                nos_host, threshold,
+                cfg.CONF.ml2_lenovo.switch_breaker_reset_timeout,
+                self._breaker_changed)
+            self._breakers[nos_host] = breaker
+        return breaker
+
+    def switch_states(self):
+        """ {switch_ip: breaker state} of the switches used so far """
+        return dict((nos_host, breaker.state)
+                    for nos_host, breaker in self._breakers.items())
+
+    def _breaker_changed(self, nos_host, old, new):
+        self.health_stats['switch_%s' % new.replace('-', '_')] += 1
+        if new == nos_health.OPEN:
+            LOG.error(_("NOS switch %(host)s is down (%(old)s -> %(new)s), "
+                        "operations on it %(action)s"),
+                      {'host': nos_host, 'old': old, 'new': new,
+                       'action': ('are deferred'
+                                  if cfg.CONF.ml2_lenovo.switch_down_action ==
+                                  'defer' else 'fail fast')})
+        else:
+            LOG.info(_("NOS switch %(host)s health: %(old)s -> %(new)s"),
+                     {'host': nos_host, 'old': old, 'new': new})
+        if new == nos_health.CLOSED and self._deferred.get(nos_host):
+            self._start_replay(nos_host)
+
+    def _invoke(self, nos_host, name, args, kwargs):
+        """ Run a backend operation, feeding the switch breaker """
+        breaker = self._breaker(nos_host)
+        func = getattr(self._get_driver(nos_host), name)
+        try:
+            result = func(nos_host, *args, **kwargs)
+        except Exception as e:
+            if breaker is not None:
+                answered = switch_answered(e)
+                if answered:
+                    breaker.success()
+                elif answered is not None:
+                    breaker.failure()
+            raise
+        if breaker is not None:
+            breaker.success()
+        return result
+
+    def _call(self, nos_host, name, *args, **kwargs):
+        """ Run a backend operation unless the switch is down """
+        breaker = self._breaker(nos_host)
+        if name in DEFERRABLE_OPERATIONS and self._deferred.get(nos_host):
+            # Keep the order of the operations already queued.
+            return self._defer(nos_host, name, args, kwargs)
+        if breaker is not None and not breaker.allow():
+            self.health_stats['switch_down_calls'] += 1
+            if (cfg.CONF.ml2_lenovo.switch_down_action == 'defer' and
+                    name in DEFERRABLE_OPERATIONS):
+                return self._defer(nos_host, name, args, kwargs)
+            raise cexc.NOSSwitchUnavailable(nos_host=nos_host, operation=name)
+        return self._invoke(nos_host, name, args, kwargs)
+
+    def _defer(self, nos_host, name, args, kwargs):
+        """ Queue an operation for replay, or fail if the queue is full """
+        queue = self._deferred.setdefault(nos_host, collections.deque())
+        if len(queue) >= cfg.CONF.ml2_lenovo.switch_deferred_ops_max:
+            self.health_stats['deferred_dropped'] += 1
+            raise cexc.NOSSwitchUnavailable(nos_host=nos_host, operation=name)
+        # The hook that set the deadline is gone by the replay.
+        kwargs = dict(kwargs, deadline=None)
+        queue.append((name, args, kwargs))
+        self.health_stats['deferred'] += 1
+        LOG.debug("NOS switch %s: %s deferred (%d queued)" %
+                  (nos_host, name, len(queue)))
+        self._start_replay(nos_host)
+        return DEFERRED
+
+    def _start_replay(self, nos_host):
+        if nos_host not in self._replaying:
+            self._replaying.add(nos_host)
+            eventlet.spawn_n(self._replay, nos_host)
 
-        return func(nos_host, vlan_id)
+    def _arm_replay(self, nos_host, delay):
+        """
+        Replay the queue of a switch in 'delay' seconds, so that it is
+        not left waiting for a health probe or a new operation
+        """
+        if nos_host not in self._replay_timers:
+            self._replay_timers[nos_host] = eventlet.spawn_after(
+                delay, self._timed_replay, nos_host)
+
+    def _timed_replay(self, nos_host):
+        del self._replay_timers[nos_host]
+        if self._deferred.get(nos_host):
+            self._start_replay(nos_host)
+
+    def _replay(self, nos_host):
+        """
+        Run the queued operations of a switch in order.  Stops, keeping
+        the rest of the queue, if the switch goes down again, and is
+        then armed again for when the breaker lets a trial through.  A
+        switch failing to answer without going down is tried again
+        after a backoff delay.
+        """
+        queue = self._deferred.get(nos_host)
+        failures = 0
+        try:
+            while queue:
+                breaker = self._breaker(nos_host)
+                if breaker is not None and not breaker.allow():
+                    self._arm_replay(nos_host, max(1, breaker.retry_after()))
+                    return
+                name, args, kwargs = queue[0]
+                try:
+                    self._invoke(nos_host, name, args, kwargs)
+                except Exception as e:
+                    if switch_answered(e) is False:
+                        failures += 1
+                        delay = self._replay_backoff.delay(failures + 1)
+                        LOG.warning(_("NOS switch %(host)s: replay of "
+                                      "%(op)s failed, will retry in "
+                                      "%(delay).2fs: %(exc)s"),
+                                    {'host': nos_host, 'op': name,
+                                     'delay': delay, 'exc': e})
+                        if breaker is None:
+                            self._arm_replay(nos_host, delay)
+                            return
+                        eventlet.sleep(delay)
+                        continue
+                    self.health_stats['replay_failed'] += 1
+                    LOG.error(_("NOS switch %(host)s: replay of %(op)s "
+                                "failed: %(exc)s"),
+                              {'host': nos_host, 'op': name, 'exc': e})
+                else:
+                    self.health_stats['replayed'] += 1
+                failures = 0
+                queue.popleft()
+            LOG.info(_("NOS switch %s: deferred operations replayed"),
+                     nos_host)
+        finally:
+            self._replaying.discard(nos_host)
+
+    def probe(self, nos_host, timeout):
+        """
+        Check that a switch answers, within 'timeout' seconds, and feed
+        the result to its breaker.  Returns True if it answered.
+        """
+        breaker = self._breaker(nos_host)
+        deadline = nos_deadline.Deadline(timeout)
+        try:
+            self._get_driver(nos_host).probe(nos_host, deadline=deadline)
+        except Exception as e:
+            self.health_stats['probe_failed'] += 1
+            LOG.debug("NOS switch %s health probe failed: %s" %
+                      (nos_host, e))
+            if breaker is not None:
+                breaker.failure()
+            return False
+        if breaker is not None:
+            breaker.success()
+        return True
+
+    def delete_vlan(self, nos_host, vlan_id, deadline=None):
+        return self._call(nos_host, 'delete_vlan', vlan_id,
+                          deadline=deadline)
+
+
+    def _coalesce_trunk_op(self, nos_host, vlan_id, intf_type, interface,
+                           delta, deadline=None):
+        """
+        Queue a VLAN add (delta 1) or remove (delta -1) on an interface.
 
+        The first request for an interface opens a window of
+        trunk_coalesce_window seconds; requests arriving meanwhile are
+        merged into it and the net change is applied once the window
+        closes, within the deadline of the first request.  Every caller
+        gets the outcome for its own VLAN.
 
-    def enable_vlan_on_trunk_int(self, nos_host, vlan_id, intf_type, interface):
-        func = self._get_driver(nos_host).enable_vlan_on_trunk_int
+        A batch is closed to new requests when its window ends, but the
+        next batch of the interface is only applied once it completes,
+        so that two read-modify-write updates of the same trunk never
+        overlap.
+        """
+        key = (nos_host, intf_type, interface)
+        batch = self.pending_trunk_ops.get(key)
+        if batch is not None:
+            batch.add(vlan_id, delta)
+            results = batch.done.wait()
+        else:
+            batch = _TrunkBatch()
+            batch.add(vlan_id, delta)
+            self.pending_trunk_ops[key] = batch
+            try:
+                window = cfg.CONF.ml2_lenovo.trunk_coalesce_window
+                if deadline is not None:
+                    window = min(window, deadline.remaining())
+                eventlet.sleep(window)
+            finally:
+                del self.pending_trunk_ops[key]
+            try:
+                with self._trunk_locks[key]:
+                    results = self._apply_trunk_batch(nos_host, intf_type,
+                                                      interface, batch,
+                                                      deadline)
+            except Exception as e:
+                # Never leave the other callers waiting.
+                results = dict((vid, e) for vid in batch.deltas)
+            batch.done.send(results)
+
+        exc = results.get(vlan_id)
+        if exc is not None:
+            raise exc
+        if batch.deferred:
+            return DEFERRED
+
+    def _apply_trunk_batch(self, nos_host, intf_type, interface, batch,
+                           deadline=None):
+        """ Apply the net VLAN changes of a batch, one result per VLAN """
+        operations = []
+        for vlan_id, delta in batch.deltas.items():
+            if delta > 0:
+                operations.append(SwitchOperation(
+                    const.OP_ENABLE_VLAN, vlan_id,
+                    intf_type=intf_type, interface=interface))
+            elif delta < 0:
+                operations.append(SwitchOperation(
+                    const.OP_DISABLE_VLAN, vlan_id,
+                    intf_type=intf_type, interface=interface))
+            else:
+                LOG.debug(_("host %(host)s: add and remove of vlan "
+                            "%(vlan)s on %(type)s:%(intf)s cancelled "
+                            "each other"),
+                          {'host': nos_host, 'vlan': vlan_id,
+                           'type': intf_type, 'intf': interface})
+
+        error = None
+        if operations:
+            try:
+                if self.apply_batch(nos_host, operations,
+                                    deadline=deadline) is DEFERRED:
+                    batch.deferred = True
+            except Exception as e:
+                error = e
+        return dict((vlan_id, error if delta else None)
+                    for vlan_id, delta in batch.deltas.items())
 
-        return func(nos_host, vlan_id, intf_type, interface)
+    def enable_vlan_on_trunk_int(self, nos_host, vlan_id, intf_type, interface,
+                                 deadline=None):
+        if cfg.CONF.ml2_lenovo.trunk_coalesce_window:
+            return self._coalesce_trunk_op(nos_host, vlan_id, intf_type,
+                                           interface, 1, deadline)
 
+        return self._call(nos_host, 'enable_vlan_on_trunk_int', vlan_id,
+                          intf_type, interface, deadline=deadline)
 
-    def disable_vlan_on_trunk_int(self, nos_host, vlan_id, intf_type, interface):
-        func = self._get_driver(nos_host).disable_vlan_on_trunk_int
 
-        return func(nos_host, vlan_id, intf_type, interface)
+    def disable_vlan_on_trunk_int(self, nos_host, vlan_id, intf_type, interface,
+                                  deadline=None):
+        if cfg.CONF.ml2_lenovo.trunk_coalesce_window:
+            return self._coalesce_trunk_op(nos_host, vlan_id, intf_type,
+                                           interface, -1, deadline)
 
+        return self._call(nos_host, 'disable_vlan_on_trunk_int', vlan_id,
+                          intf_type, interface, deadline=deadline)
 
-    def create_and_trunk_vlan(self, nos_host, vlan_id, vlan_name, intf_type, nos_port):
-        func = self._get_driver(nos_host).create_and_trunk_vlan
 
-        return func(nos_host, vlan_id, vlan_name, intf_type, nos_port)
+    def create_and_trunk_vlan(self, nos_host, vlan_id, vlan_name, intf_type, nos_port,
+                              deadline=None):
+        return self._call(nos_host, 'create_and_trunk_vlan', vlan_id,
+                          vlan_name, intf_type, nos_port, deadline=deadline)
+
+
+    def apply_batch(self, nos_host, operations, deadline=None):
+        """
+        Apply a list of SwitchOperation to a switch in one go.
+
+        The backend applies the whole list over a single session and
+        commit, instead of one per operation.
+        """
+        if not operations:
+            return
+
+        return self._call(nos_host, 'apply_batch', operations,
+                          deadline=deadline)
+
+
+    def get_vlan_state(self, nos_host, interfaces, deadline=None):
+        """
+        Read the VLANs of a switch and the VLANs trunked on interfaces.
+
+        Returns (set of VLAN ids, {(intf_type, interface): set of VLAN
+        ids}), or None when the backend cannot read the switch state.
+        """
+        return self._call(nos_host, 'get_vlan_state', interfaces,
+                          deadline=deadline)
@@ -26,7 +26,10 @@ from networking_lenovo.ml2 import config as conf
 from networking_lenovo.ml2 import constants as const
 from networking_lenovo.ml2 import exceptions as cexc
 from networking_lenovo.ml2 import nos_db_v2
+from networking_lenovo.ml2 import nos_deadline
+from networking_lenovo.ml2 import nos_retry
 from networking_lenovo.ml2 import nos_snippets as snipp
+from networking_lenovo.ml2 import vlan_set
 
 LOG = logging.getLogger(__name__)
 
@@ -37,6 +40,7 @@ class LenovoNOSDriverNetconf(object):
         self.ncclient = None
         self.nos_switches = conf.ML2MechLenovoConfig.nos_dict
         self.connections = {}
+        self.retry_policy = nos_retry.RetryPolicy.from_config()
 
 
     def _import_ncclient(self):
@@ -51,8 +55,14 @@ class LenovoNOSDriverNetconf(object):
         return importutils.import_module('ncclient.manager')
 
 
+    def _is_rpc_error(self, exc):
+        """Whether the switch answered the RPC, rejecting it."""
+        rpc_error = importutils.import_class('ncclient.operations.RPCError')
+        return isinstance(exc, rpc_error)
+
+
     def _edit_config(self, nos_host, target='running', config='',
-                     allowed_exc_strs=None):
+                     allowed_exc_strs=None, deadline=None):
         """Modify switch config for a target config type.
 
         :param nos_host: IP address of switch to configure
@@ -61,15 +71,39 @@ class LenovoNOSDriverNetconf(object):
         :param allowed_exc_strs: Exceptions which have any of these strings
                                  as a subset of their exception message
                                  (str(exception)) can be ignored
+        :param deadline: Deadline bounding the RPC timeout and its
+                         retries, if any
+
+        The CLI configuration is declarative, so an edit-config that got
+        no answer is sent again on a new connection; one the switch
+        rejected is not.
 
-        :raises: NOSConfigFailed
+        :raises: NOSConfigFailed, NOSConnectFailed, NOSDeadlineExceeded
 
         """
         if not allowed_exc_strs:
             allowed_exc_strs = []
-        mgr = self._nos_connect(nos_host)
+
+        def attempt():
+            mgr = self._nos_connect(nos_host, deadline)
+            mgr.timeout = nos_deadline.bounded_timeout(
+                deadline, cfg.CONF.ml2_lenovo.switch_read_timeout,
+                'edit-config on %s' % nos_host)
+            try:
+                mgr.edit_config(target=target, config=config, format='text')
+            except Exception as e:
+                if not self._is_rpc_error(e):
+                    self.connections.pop(nos_host, None)
+                raise
+
         try:
-            mgr.edit_config(target=target, config=config, format='text')
+            self.retry_policy.run(
+                attempt, 'NETCONF edit-config',
+                'NETCONF edit-config on %s' % nos_host,
+                deadline=deadline,
+                retryable=lambda e: not self._is_rpc_error(e))
+        except (cexc.NOSConnectFailed, cexc.NOSDeadlineExceeded):
+            raise
         except Exception as e:
             for exc_str in allowed_exc_strs:
                 if exc_str in str(e):
@@ -80,7 +114,7 @@ class LenovoNOSDriverNetconf(object):
                 raise cexc.NOSConfigFailed(config=config, exc=e)
 
 
-    def _nos_connect(self, nos_host):
+    def _nos_connect(self, nos_host, deadline=None):
         """Make SSH connection to the NOS Switch."""
         if getattr(self.connections.get(nos_host), 'connected', None):
             return self.connections[nos_host]
@@ -90,6 +124,9 @@ class LenovoNOSDriverNetconf(object):
         nos_ssh_port = int(self.nos_switches[nos_host, 'ssh_port'])
         nos_user = self.nos_switches[nos_host, const.USERNAME]
         nos_password = self.nos_switches[nos_host, const.PASSWORD]
+        timeout = nos_deadline.bounded_timeout(
+            deadline, cfg.CONF.ml2_lenovo.switch_connect_timeout,
+            'connect to %s' % nos_host)
         try:
             try:
                 # With new ncclient version, we can pass device_params...
@@ -97,6 +134,7 @@ class LenovoNOSDriverNetconf(object):
                                             port=nos_ssh_port,
                                             username=nos_user,
                                             password=nos_password,
+                                            timeout=timeout,
 					    hostkey_verify=False)
                 #                           device_params={"name": "nos"})
             except TypeError:
@@ -105,7 +143,8 @@ class LenovoNOSDriverNetconf(object):
                 man = self.ncclient.connect(host=nos_host,
                                             port=nos_ssh_port,
                                             username=nos_user,
-                                            password=nos_password)
+                                            password=nos_password,
+                                            timeout=timeout)
         except Exception as e:
             # Raise a Neutron exception. Include a description of
             # the original ncclient exception.
@@ -124,67 +163,176 @@ class LenovoNOSDriverNetconf(object):
         return conf_xml_snippet
 
 
-    def _create_vlan(self, nos_host, vlanid, vlanname):
-        """Create a VLAN on NOS Switch given the VLAN ID and Name."""
-	try:
-            confstr = self._create_xml_snippet(
-                snipp.CMD_VLAN_CONF_SNIPPET % (vlanid, vlanname))
-            LOG.debug(_("NOSDriver: %s"), confstr)
-            self._edit_config(nos_host, target='running', config=confstr)
-	except cexc.NOSConfigFailed:
-	    with excutils.save_and_reraise_exception():
-                self.delete_vlan(nos_host, vlanid)
-		
-
+    def _create_vlan_config(self, vlanid, vlanname):
+        """CLI configuration creating a VLAN in no-shutdown state."""
         # Enable VLAN active and no-shutdown states. Some versions of
         # NOS switch do not allow state changes for the extended VLAN
         # range (1006-4094), but these errors can be ignored (default
         # values are appropriate).
-        try:
-            confstr = self._create_xml_snippet(snipp.CMD_VLAN_NO_SHUTDOWN_SNIPPET % vlanid)
-            self._edit_config( nos_host, target='running', config=confstr)
-        except cexc.NOSConfigFailed:
-            with excutils.save_and_reraise_exception():
-                self.delete_vlan(nos_host, vlanid)
+        return (snipp.CMD_VLAN_CONF_SNIPPET % (vlanid, vlanname) +
+                snipp.CMD_EXIT_SNIPPET +
+                snipp.CMD_VLAN_NO_SHUTDOWN_SNIPPET % vlanid +
+                snipp.CMD_EXIT_SNIPPET)
+
+
+    def _enable_vlan_config(self, nos_host, vlanid, intf_type, interface):
+        """
+        CLI configuration adding a VLAN, or a "10,20-30" range list, to a
+        trunk interface.
+        """
+        # If more than one VLAN is configured on this interface then
+        # include the 'add' keyword.
+        if nos_db_v2.get_port_switch_bindings_count(
+                '%s:%s' % (intf_type, interface), nos_host) == 1:
+            snippet = snipp.CMD_INT_VLAN_SNIPPET
+        else:
+            snippet = snipp.CMD_INT_VLAN_ADD_SNIPPET
+
+        return snippet % (intf_type, interface, vlanid)
+
+
+    def _trunk_config(self, nos_host, op, vlans, intf_type, interface):
+        """CLI configuration of a VlanSet added to or removed from a trunk."""
+        if op == const.OP_ENABLE_VLAN:
+            return self._enable_vlan_config(nos_host, vlans.to_ranges(),
+                                            intf_type, interface)
+        return (snipp.CMD_NO_VLAN_INT_SNIPPET %
+                (intf_type, interface, vlans.to_ranges()))
+
+
+    def _batch_config(self, nos_host, operations):
+        """
+        CLI configuration of apply_batch() operations.  Consecutive
+        trunk operations of the same kind on the same interface are
+        merged in one "allowed vlan add/remove" range list.
+        """
+        trunk_ops = (const.OP_ENABLE_VLAN, const.OP_DISABLE_VLAN)
+        configs = []
+        pending = None
+        for operation in operations:
+            key = (operation.op, operation.intf_type, operation.interface)
+            if pending and pending[0] == key:
+                pending[1].add(operation.vlan_id)
+                continue
+            if pending:
+                configs.append(self._trunk_config(nos_host, pending[0][0],
+                                                  pending[1], *pending[0][1:]))
+                pending = None
+            if operation.op in trunk_ops:
+                pending = (key, vlan_set.VlanSet([operation.vlan_id]))
+            else:
+                configs.append(self._operation_config(nos_host, operation))
+        if pending:
+            configs.append(self._trunk_config(nos_host, pending[0][0],
+                                              pending[1], *pending[0][1:]))
+        return ''.join(configs)
+
+
+    def _operation_config(self, nos_host, operation):
+        """CLI configuration of one apply_batch() operation."""
+        if operation.op == const.OP_CREATE_VLAN:
+            return self._create_vlan_config(operation.vlan_id,
+                                            operation.vlan_name)
+        elif operation.op == const.OP_DELETE_VLAN:
+            return snipp.CMD_NO_VLAN_CONF_SNIPPET % operation.vlan_id
+        elif operation.op == const.OP_ENABLE_VLAN:
+            return self._enable_vlan_config(nos_host, operation.vlan_id,
+                                            operation.intf_type,
+                                            operation.interface)
+        elif operation.op == const.OP_DISABLE_VLAN:
+            return (snipp.CMD_NO_VLAN_INT_SNIPPET %
+                    (operation.intf_type, operation.interface,
+                     operation.vlan_id))
+        raise cexc.NOSConfigFailed(config=operation,
+                                   exc='Unknown operation')
+
+
+    def probe(self, nos_host, deadline=None):
+        """Check that the switch completes a NETCONF hello.
+
+        A session still connected is kept; a closed one is reopened.
+        """
+        self._nos_connect(nos_host, deadline)
 
 
-    def delete_vlan(self, nos_host, vlanid):
+    def delete_vlan(self, nos_host, vlanid, deadline=None):
         """Delete a VLAN on NOS Switch given the VLAN ID."""
         confstr = snipp.CMD_NO_VLAN_CONF_SNIPPET % vlanid
         confstr = self._create_xml_snippet(confstr)
-        self._edit_config(nos_host, target='running', config=confstr)
+        self._edit_config(nos_host, target='running', config=confstr,
+                          deadline=deadline)
 
 
     def enable_vlan_on_trunk_int(self, nos_host, vlanid, intf_type,
-                                 interface):
+                                 interface, deadline=None):
         """Enable a VLAN on a trunk interface."""
-        # If more than one VLAN is configured on this interface then
-        # include the 'add' keyword.
-        if len(nos_db_v2.get_port_switch_bindings(
-                '%s:%s' % (intf_type, interface), nos_host)) == 1:
-            snippet = snipp.CMD_INT_VLAN_SNIPPET
-        else:
-            snippet = snipp.CMD_INT_VLAN_ADD_SNIPPET
-
-        confstr = snippet % (intf_type, interface, vlanid)
+        confstr = self._enable_vlan_config(nos_host, vlanid, intf_type,
+                                           interface)
         confstr = self._create_xml_snippet(confstr)
         LOG.debug(_("NOSDriver: %s"), confstr)
-        self._edit_config(nos_host, target='running', config=confstr)
+        self._edit_config(nos_host, target='running', config=confstr,
+                          deadline=deadline)
 
 
-    def disable_vlan_on_trunk_int(self, nos_host, vlanid, intf_type, interface):
+    def disable_vlan_on_trunk_int(self, nos_host, vlanid, intf_type, interface,
+                                  deadline=None):
         """Disable a VLAN on a trunk interface."""
         confstr = (snipp.CMD_NO_VLAN_INT_SNIPPET %
                    (intf_type, interface, vlanid))
         confstr = self._create_xml_snippet(confstr)
         LOG.debug(_("NOSDriver: %s"), confstr)
-        self._edit_config(nos_host, target='running', config=confstr)
+        self._edit_config(nos_host, target='running', config=confstr,
+                          deadline=deadline)
 
 
-    def create_and_trunk_vlan(self, nos_host, vlan_id, vlan_name, intf_type, nos_port):
+    def create_and_trunk_vlan(self, nos_host, vlan_id, vlan_name, intf_type, nos_port,
+                              deadline=None):
         """Create VLAN and trunk it on the specified ports."""
-        self._create_vlan(nos_host, vlan_id, vlan_name)
-        LOG.debug(_("NOSDriver created VLAN: %s"), vlan_id)
+        confstr = self._create_vlan_config(vlan_id, vlan_name)
         if nos_port:
-            self.enable_vlan_on_trunk_int(nos_host, vlan_id, intf_type,
-                                          nos_port)
+            confstr += self._enable_vlan_config(nos_host, vlan_id, intf_type,
+                                                nos_port)
+        self._edit_config_or_undo(nos_host, confstr, [vlan_id], deadline)
+        LOG.debug(_("NOSDriver created VLAN: %s"), vlan_id)
+
+
+    def apply_batch(self, nos_host, operations, deadline=None):
+        """Apply a list of operations with a single edit-config."""
+        confstr = self._batch_config(nos_host, operations)
+        created = [operation.vlan_id for operation in operations
+                   if operation.op == const.OP_CREATE_VLAN]
+        self._edit_config_or_undo(nos_host, confstr, created, deadline)
+
+
+    def _edit_config_or_undo(self, nos_host, confstr, created_vlans,
+                             deadline=None):
+        """Send the configuration; on failure delete the created VLANs.
+
+        The switch VLANs are not read back over NETCONF, so a VLAN with a
+        processed binding on the switch is taken to exist before the
+        configuration and is never deleted by the undo.
+        """
+        created_vlans = [vlanid for vlanid in created_vlans
+                         if not nos_db_v2.nosport_binding_exists(
+                             vlan_id=vlanid, switch_ip=nos_host,
+                             processed=True)]
+        confstr = self._create_xml_snippet(confstr)
+        LOG.debug(_("NOSDriver: %s"), confstr)
+        try:
+            self._edit_config(nos_host, target='running', config=confstr,
+                              deadline=deadline)
+        except cexc.NOSConfigFailed:
+            with excutils.save_and_reraise_exception():
+                for vlanid in created_vlans:
+                    try:
+                        self.delete_vlan(nos_host, vlanid, deadline)
+                    except (cexc.NOSConfigFailed,
+                            cexc.NOSDeadlineExceeded) as e:
+                        LOG.warning(_("NOSDriver: could not delete VLAN "
+                                      "%(vlan)s: %(exc)s"),
+                                    {'vlan': vlanid, 'exc': e})
+
+
+    def get_vlan_state(self, nos_host, interfaces, deadline=None):
+        """The switch state is not read back over NETCONF: unknown."""
+        return None
@@ -26,6 +26,8 @@ from networking_lenovo.ml2 import config as conf
 from networking_lenovo.ml2 import constants as const
 from networking_lenovo.ml2 import exceptions as cexc
 from networking_lenovo.ml2 import nos_db_v2
+from networking_lenovo.ml2 import nos_deadline
+from networking_lenovo.ml2 import nos_retry
 from networking_lenovo.ml2 import nos_snippets as snipp
 
 LOG = logging.getLogger(__name__)
@@ -35,6 +37,8 @@ from pysnmp import error as snmp_error
 from pysnmp.proto import rfc1902
 
 SNMP_PORT = 161
+# Retransmissions of an unanswered request (pysnmp default)
+SNMP_RETRIES = 5
 SNMP_V1 = '1'
 SNMP_V2C = '2c'
 SNMP_V3 = '3'
@@ -50,9 +54,9 @@ USM_NO_PRIV   = (1, 3, 6, 1, 6, 3, 10, 1, 2, 1)
 USM_DES_PRIV  = (1, 3, 6, 1, 6, 3, 10, 1, 2, 2)
 USM_AES_PRIV  = (1, 3, 6, 1, 6, 3, 10, 1, 2, 4)
 
-cmdGen = cmdgen.CommandGenerator()
 oid_enterprise = (1, 3, 6, 1, 4, 1,)
 sysDescr = (1, 3, 6, 1, 2, 1, 1, 1, 0)
+sysUpTime = (1, 3, 6, 1, 2, 1, 1, 3, 0)
 
 GRYPHONFC_SYSDESCR = "G8264CS"
 PEGASUS_SYSDESCR = "G8264-T"
@@ -287,6 +291,19 @@ class LenovoNOSDriverSNMP(object):
     def __init__(self):
         self.nos_switches = conf.ML2MechLenovoConfig.nos_dict
         self.nos_oid_table = {}
+        self.cmd_gens = {}
+        self.retry_policy = nos_retry.RetryPolicy.from_config()
+
+    def _get_cmd_gen(self, nos_host):
+        """
+        Each switch gets its own command generator (and SNMP engine) so
+        that several switches can be configured concurrently.
+        """
+        cmd_gen = self.cmd_gens.get(nos_host)
+        if cmd_gen is None:
+            cmd_gen = cmdgen.CommandGenerator()
+            self.cmd_gens[nos_host] = cmd_gen
+        return cmd_gen
 
     def _get_auth(self, nos_host):
         if self.nos_switches[nos_host, 'snmp_version'] == SNMP_V3:
@@ -318,22 +335,57 @@ class LenovoNOSDriverSNMP(object):
             mp_model = 1 if self.nos_switches[nos_host, 'snmp_version'] == SNMP_V2C else 0
             return cmdgen.CommunityData(self.nos_switches[nos_host, 'snmp_community'], mpModel=mp_model)
 
-    def _get_transport(self, nos_host):
-        return cmdgen.UdpTransportTarget((nos_host, int(self.nos_switches[nos_host, 'snmp_port'])))
+    def _get_transport(self, nos_host, deadline=None):
+        """
+        UDP target whose request, retransmissions included, is answered
+        within switch_read_timeout, cut down to the deadline if given.
+        """
+        timeout = nos_deadline.bounded_timeout(
+            deadline, cfg.CONF.ml2_lenovo.switch_read_timeout,
+            'SNMP request to %s' % nos_host)
+        return cmdgen.UdpTransportTarget((nos_host, int(self.nos_switches[nos_host, 'snmp_port'])),
+                                         timeout=timeout / (SNMP_RETRIES + 1),
+                                         retries=SNMP_RETRIES)
     
-    def _set(self, nos_host, varBinds):
+    def _command(self, nos_host, operation, varBinds, deadline=None):
+        """
+        Send a GET or SET, retrying it while the switch does not answer
+        (error indication).  Both only read or set values, so a request
+        whose answer was lost can be sent again.
+        """
+        if operation == 'SET':
+            command = self._get_cmd_gen(nos_host).setCmd
+        else:
+            command = self._get_cmd_gen(nos_host).getCmd
+
+        def attempt():
+            results = command(self._get_auth(nos_host),
+                              self._get_transport(nos_host, deadline=deadline),
+                              *varBinds)
+            err_indication = results[0]
+            if err_indication:
+                LOG.warning(_("SNMP %(op)s to %(host)s failed: %(err)s"),
+                            {'op': operation, 'host': nos_host,
+                             'err': err_indication})
+                raise cexc.NOSSNMPFailure(operation=operation,
+                                          nos_host=nos_host,
+                                          error=err_indication)
+            return results
+
         try:
-            results = cmdGen.setCmd(self._get_auth(nos_host),
-                                   self._get_transport(nos_host),
-                                   *varBinds)
+            return self.retry_policy.run(
+                attempt, 'SNMP %s' % operation,
+                'SNMP %s to %s' % (operation, nos_host), deadline=deadline,
+                retryable=lambda e: isinstance(e, cexc.NOSSNMPFailure))
         except snmp_error.PySnmpError as e:
-            raise cexc.NOSSNMPFailure(operation='SET', error=e)
+            raise cexc.NOSSNMPFailure(operation=operation, nos_host=nos_host,
+                                      error=e)
+
+    def _set(self, nos_host, varBinds, deadline=None):
+        results = self._command(nos_host, 'SET', varBinds, deadline=deadline)
 
         err_indication, err_status, err_index, var_binds = results
-        if err_indication:
-            print(err_indication)
-            raise cexc.NOSSNMPFailure(operation='SET', error=err_indication)
-        elif err_status:
+        if err_status:
             print('%s at %s' % (
                 err_status.prettyPrint(),
                 err_index and var_binds[int(err_index)-1][0] or '?'
@@ -342,19 +394,11 @@ class LenovoNOSDriverSNMP(object):
             """not raise exception for error_status"""
             #raise cexc.NOSSNMPFailure(operation='SET', error=err_status.prettyPrint())
     
-    def _get(self, nos_host, varBinds):
-        try:
-            results = cmdGen.getCmd(self._get_auth(nos_host),
-                                   self._get_transport(nos_host),
-                                   *varBinds)
-        except snmp_error.PySnmpError as e:
-            raise cexc.NOSSNMPFailure(operation='GET', error=e)
+    def _get(self, nos_host, varBinds, deadline=None):
+        results = self._command(nos_host, 'GET', varBinds, deadline=deadline)
 
         err_indication, err_status, err_index, var_binds = results
-        if err_indication:
-            print(err_indication)
-            raise cexc.NOSSNMPFailure(operation='GET', error=err_indication)
-        elif err_status:
+        if err_status:
             print('%s at %s' % (
                 err_status.prettyPrint(),
                 err_index and var_binds[int(err_index)-1][0] or '?'
@@ -365,23 +409,28 @@ class LenovoNOSDriverSNMP(object):
         return var_binds
     
 
-    def _get_sys_descr(self, nos_host):
+    def probe(self, nos_host, deadline=None):
+        """Check that the switch answers a GET of sysUpTime."""
+        self._get(nos_host, [sysUpTime], deadline=deadline)
+
+
+    def _get_sys_descr(self, nos_host, deadline=None):
         LOG.debug(_('_get_sys_descr %s'), nos_host)
         varBinds = []
         varBinds += sysDescr,
         
-        ret = self._get(nos_host, varBinds)
+        ret = self._get(nos_host, varBinds, deadline=deadline)
         name, val = ret[0]
         return str(val)
 
 
-    def _get_oid_table(self, nos_host):
+    def _get_oid_table(self, nos_host, deadline=None):
         if nos_host in self.nos_oid_table:
             LOG.debug(_("device %s exist"), self.nos_oid_table[nos_host]['device'])
             return self.nos_oid_table[nos_host]
         else:
             LOG.debug(_("detect device type..."))
-            sys_descr = self._get_sys_descr(nos_host)
+            sys_descr = self._get_sys_descr(nos_host, deadline=deadline)
             if sys_descr.find(GRYPHONFC_SYSDESCR) != -1:
                 LOG.debug(_("this is a GryphonFC"))
                 self.nos_oid_table[nos_host] = gryphonfc_oid
@@ -453,15 +502,15 @@ class LenovoNOSDriverSNMP(object):
 
         
 
-    def _apply_config(self, nos_host):
+    def _apply_config(self, nos_host, deadline=None):
         APPLY = 2
-        oid_table = self._get_oid_table(nos_host)
+        oid_table = self._get_oid_table(nos_host, deadline=deadline)
         varBinds = []
         snmp_oid = oid_enterprise + oid_table['agApplyConfiguration']
         value = rfc1902.Integer(APPLY)
         varBinds += (snmp_oid, value),
 
-        self._set(nos_host, varBinds)
+        self._set(nos_host, varBinds, deadline=deadline)
 
     def _support_old_release(self, host):
         """
@@ -481,10 +530,10 @@ class LenovoNOSDriverSNMP(object):
         return False
 
     #create VLAN
-    def _create_vlan(self, nos_host, vlan_id, vlan_name):
+    def _create_vlan(self, nos_host, vlan_id, vlan_name, deadline=None):
         """Create a VLAN on NOS Switch given the VLAN ID and Name."""
         LOG.debug(_('_create_vlan %s %d'), nos_host, vlan_id) 
-        oid_table = self._get_oid_table(nos_host)
+        oid_table = self._get_oid_table(nos_host, deadline=deadline)
 
         varBinds = []
         ENABLED = 2
@@ -496,15 +545,13 @@ class LenovoNOSDriverSNMP(object):
         value = rfc1902.OctetString(vlan_name)
         varBinds += (snmp_oid, value),
 
-        self._set(nos_host, varBinds)
-
-        self._apply_config(nos_host)
+        self._set(nos_host, varBinds, deadline=deadline)
 
 
-    def delete_vlan(self, nos_host, vlan_id):
+    def _delete_vlan(self, nos_host, vlan_id, deadline=None):
         """Delete a VLAN on NOS Switch given the VLAN ID."""
-        LOG.debug(_('delete_vlan %s %d'), nos_host, vlan_id)
-        oid_table = self._get_oid_table(nos_host)
+        LOG.debug(_('_delete_vlan %s %d'), nos_host, vlan_id)
+        oid_table = self._get_oid_table(nos_host, deadline=deadline)
 
         varBinds = []
         DELETE = 2
@@ -512,61 +559,76 @@ class LenovoNOSDriverSNMP(object):
         value = rfc1902.Integer(DELETE)
         varBinds += (snmp_oid, value),
 
-        self._set(nos_host, varBinds)
+        self._set(nos_host, varBinds, deadline=deadline)
 
-        self._apply_config(nos_host)
 
-    
-    def enable_vlan_on_trunk_int(self, nos_host, vlan_id, intf_type, interface):
-        LOG.debug(_('enable_vlan_on_trunk_int %s %d %s:%s'), nos_host, vlan_id, intf_type, interface)
-        oid_table = self._get_oid_table(nos_host)
-        
+    def delete_vlan(self, nos_host, vlan_id, deadline=None):
+        """Delete a VLAN on NOS Switch given the VLAN ID."""
+        LOG.debug(_('delete_vlan %s %d'), nos_host, vlan_id)
+        self._delete_vlan(nos_host, vlan_id, deadline=deadline)
+        self._apply_config(nos_host, deadline=deadline)
+
+
+    def _get_port_nums(self, nos_host, intf_type, interface, deadline=None):
+        """
+        Physical ports behind an interface: the port itself or the
+        member ports of a portchannel.
+        """
+        if intf_type != "portchannel":
+            return [int(interface)]
+
+        oid_table = self._get_oid_table(nos_host, deadline=deadline)
+        varBinds = []
+        snmp_oid = oid_enterprise + oid_table['trunkGroupInfoPorts'] + (interface,) 
+        varBinds += (snmp_oid),
+        ret = self._get(nos_host, varBinds, deadline=deadline)
+        _n, _v = ret[0]
+        portmap = _v.asNumbers()
+        port_nums = []
+        port_base = 0
+        for byte in portmap:
+            if byte != 0:
+                bit = 7
+                while bit >= 0:
+                    if (byte & (1<<bit)):
+                        port_nums.append(port_base + 7 - bit)
+                    bit -= 1
+            port_base += 8
+        return port_nums
+
+
+    def _enable_vlan_on_trunk_int(self, nos_host, vlan_id, intf_type, interface,
+                                  deadline=None):
+        """Add the VLAN to the trunk, without applying the configuration."""
         trunk_init = False
-        if len(nos_db_v2.get_port_switch_bindings(
-                '%s:%s' % (intf_type, interface), nos_host)) == 1:
+        if nos_db_v2.get_port_switch_bindings_count(
+                '%s:%s' % (intf_type, interface), nos_host) == 1:
             trunk_init = True
 
-        if intf_type == "portchannel":
-            varBinds = []
-            snmp_oid = oid_enterprise + oid_table['trunkGroupInfoPorts'] + (interface,) 
-            varBinds += (snmp_oid),
-            ret = self._get(nos_host, varBinds)
-            _n, _v = ret[0]
-            portmap = _v.asNumbers()
-            port_base = 0
-            for byte in portmap:
-                if byte != 0:
-                    bit = 7
-                    while bit >= 0:
-                        if (byte & (1<<bit)):
-                            port_num = port_base + 7 - bit
-                            LOG.debug(_("interface port %d"), port_num)
-                            if trunk_init is True:
-                                LOG.debug(_("    switchport mode trunk"))
-                                LOG.debug(_("    switchport trunk allowed vlan 1"))
-                                self._switchport_mode_trunk_init(nos_host, port_num)
-                            LOG.debug(_("    switchport trunk allowed vlan add %d"), vlan_id)
-                            self._enable_vlan_on_port(nos_host, vlan_id, port_num)
-                        bit -= 1
-                port_base += 8
-        else:
-            port_num = int(interface)
+        port_nums = self._get_port_nums(nos_host, intf_type, interface, deadline=deadline)
+        for port_num in port_nums:
             LOG.debug(_("interface port %d"), port_num)
             if trunk_init is True:
                 LOG.debug(_("    switchport mode trunk"))
                 LOG.debug(_("    switchport trunk allowed vlan 1"))
-                self._switchport_mode_trunk_init(nos_host, port_num)
+                self._switchport_mode_trunk_init(nos_host, port_num, deadline=deadline)
             LOG.debug(_("    switchport trunk allowed vlan add %d"), vlan_id)
-            self._enable_vlan_on_port(nos_host, vlan_id, port_num)
-        
-        self._apply_config(nos_host)
+
+        self._vlan_ports_set(nos_host, 'vlanNewCfgAddPort', vlan_id, port_nums, deadline=deadline)
+
+
+    def enable_vlan_on_trunk_int(self, nos_host, vlan_id, intf_type, interface,
+                                 deadline=None):
+        LOG.debug(_('enable_vlan_on_trunk_int %s %d %s:%s'), nos_host, vlan_id, intf_type, interface)
+        self._enable_vlan_on_trunk_int(nos_host, vlan_id, intf_type, interface, deadline=deadline)
+        self._apply_config(nos_host, deadline=deadline)
         
 
-    def _switchport_mode_trunk_init(self, nos_host, port_num):
+    def _switchport_mode_trunk_init(self, nos_host, port_num, deadline=None):
         """Enable a port as VLAN trunk mode."""
         LOG.debug(_('_switchport_mode_trunk_init %s %d'), nos_host, port_num)
 
-        oid_table = self._get_oid_table(nos_host)
+        oid_table = self._get_oid_table(nos_host, deadline=deadline)
 
         """Change switchport to trunk mode, and set PVID = 1"""
         varBinds = []
@@ -579,7 +641,7 @@ class LenovoNOSDriverSNMP(object):
         value = rfc1902.Integer32(1)
         varBinds += (snmp_oid, value),
 
-        self._set(nos_host, varBinds)
+        self._set(nos_host, varBinds, deadline=deadline)
 
         """Remove all other VLAN except 1 for the first time config this port"""
         try:
@@ -590,6 +652,8 @@ class LenovoNOSDriverSNMP(object):
             max_vlan_id = 4094
         else:
             max_vlan_id = 4094 if self._support_old_release(nos_host) else 4095
+        # The ENOS MIBs known to the driver remove one VLAN per varbind,
+        # there is no per port VLAN bitmap to write in a single SET.
         vlans = range(2, max_vlan_id+1)
         varBinds = []
         for vid in vlans:
@@ -597,76 +661,96 @@ class LenovoNOSDriverSNMP(object):
             value = rfc1902.Gauge32(port_num)
             varBinds += (snmp_oid, value),
             if vid%20 == 0:
-                self._set(nos_host, varBinds)
+                self._set(nos_host, varBinds, deadline=deadline)
                 varBinds = []
         
-        self._set(nos_host, varBinds)
+        if varBinds:
+            self._set(nos_host, varBinds, deadline=deadline)
 
  
-    def _enable_vlan_on_port(self, nos_host, vlan_id, port_num):
-        """Enable a VLAN on a port interface."""
-        LOG.debug(_('_enable_vlan_on_port %s %d %d'), nos_host, vlan_id, port_num)
+    def _vlan_ports_set(self, nos_host, oid_name, vlan_id, port_nums,
+                        deadline=None):
+        """
+        Add ports to (vlanNewCfgAddPort) or remove ports from
+        (vlanNewCfgRemovePort) a VLAN, one SET per port: the port is the
+        value of a per VLAN OID, and how an agent handles the same OID
+        twice in a SET is implementation-defined.
+        """
+        if not port_nums:
+            return
 
-        oid_table = self._get_oid_table(nos_host)
+        oid_table = self._get_oid_table(nos_host, deadline=deadline)
+
+        snmp_oid = oid_enterprise + oid_table[oid_name] + (vlan_id,)
+        for port_num in port_nums:
+            value = rfc1902.Gauge32(port_num)
+            self._set(nos_host, [(snmp_oid, value)], deadline=deadline)
 
-        varBinds = []
-        snmp_oid = oid_enterprise + oid_table['vlanNewCfgAddPort'] + (vlan_id,)
-        value = rfc1902.Gauge32(port_num)
-        varBinds += (snmp_oid, value),
 
-        self._set(nos_host, varBinds)
+    def _disable_vlan_on_trunk_int(self, nos_host, vlan_id, intf_type, interface,
+                                   deadline=None):
+        """Remove the VLAN from the trunk, without applying the configuration."""
+        port_nums = self._get_port_nums(nos_host, intf_type, interface, deadline=deadline)
+        for port_num in port_nums:
+            LOG.debug(_("interface port %d"), port_num)
+            LOG.debug(_("    switchport trunk allowed vlan remove %d"), vlan_id)
 
+        self._vlan_ports_set(nos_host, 'vlanNewCfgRemovePort', vlan_id, port_nums, deadline=deadline)
 
-    def disable_vlan_on_trunk_int(self, nos_host, vlan_id, intf_type, interface):
+
+    def disable_vlan_on_trunk_int(self, nos_host, vlan_id, intf_type, interface,
+                                  deadline=None):
         LOG.debug(_('disable_vlan_on_trunk_int %s %d %s'), nos_host, vlan_id, interface)
+        self._disable_vlan_on_trunk_int(nos_host, vlan_id, intf_type, interface, deadline=deadline)
+        self._apply_config(nos_host, deadline=deadline)
 
-        oid_table = self._get_oid_table(nos_host)
-
-        if intf_type == "portchannel":
-            varBinds = []
-            snmp_oid = oid_enterprise + oid_table['trunkGroupInfoPorts'] + (interface,) 
-            varBinds += (snmp_oid),
-            ret = self._get(nos_host, varBinds)
-            _n, _v = ret[0]
-            portmap = _v.asNumbers()
-            port_base = 0
-            for byte in portmap:
-                if byte != 0:
-                    bit = 7
-                    while bit >= 0:
-                        if (byte & (1<<bit)):
-                            port_num = port_base + 7 - bit
-                            LOG.debug(_("interface port %d"), port_num)
-                            LOG.debug(_("    switchport trunk allowed vlan remove %d"), vlan_id)
-                            self._disable_vlan_on_port(nos_host, vlan_id, port_num)
-                        bit -= 1
-                port_base += 8
-        else:
-            port_num = int(interface)
-            LOG.debug(_("interface port %d"), port_num)
-            LOG.debug(_("    switchport trunk allowed vlan remove %d"), vlan_id)
-            self._disable_vlan_on_port(nos_host, vlan_id, port_num)
-        
-        self._apply_config(nos_host)
 
-    
-    def _disable_vlan_on_port(self, nos_host, vlan_id, port_num):
-        """Disable a VLAN on a port interface."""
-        LOG.debug(_('_disable_vlan_on_port %s %d %d'), nos_host, vlan_id, port_num)
+    def create_and_trunk_vlan(self, nos_host, vlan_id, vlan_name, intf_type, interface,
+                              deadline=None):
+        LOG.debug(_('create_and_trunk_vlan %s %d %s'), nos_host, vlan_id, interface)
+        self._create_vlan(nos_host, vlan_id, vlan_name, deadline=deadline)
+        if interface:
+            self._enable_vlan_on_trunk_int(nos_host, vlan_id, intf_type, interface, deadline=deadline)
+        self._apply_config(nos_host, deadline=deadline)
 
-        oid_table = self._get_oid_table(nos_host)
 
-        varBinds = []
+    def apply_batch(self, nos_host, operations, deadline=None):
+        """
+        Apply a list of operations with a single agApplyConfiguration.
 
-        snmp_oid = oid_enterprise + oid_table['vlanNewCfgRemovePort'] + (vlan_id,)
-        value = rfc1902.Gauge32(port_num)
-        varBinds += (snmp_oid, value),
+        The SETs of all the operations (one per member port of a
+        portchannel) are sent first; the pending configuration is applied
+        once, after the last operation.
+        """
+        LOG.debug(_('apply_batch %s %d operations'), nos_host, len(operations))
+        for operation in operations:
+            if operation.op == const.OP_CREATE_VLAN:
+                self._create_vlan(nos_host, operation.vlan_id,
+                                  operation.vlan_name,
+                                  deadline=deadline)
+            elif operation.op == const.OP_DELETE_VLAN:
+                self._delete_vlan(nos_host, operation.vlan_id, deadline=deadline)
+            elif operation.op == const.OP_ENABLE_VLAN:
+                self._enable_vlan_on_trunk_int(nos_host, operation.vlan_id,
+                                               operation.intf_type,
+                                               operation.interface,
+                                               deadline=deadline)
+            elif operation.op == const.OP_DISABLE_VLAN:
+                self._disable_vlan_on_trunk_int(nos_host, operation.vlan_id,
+                                                operation.intf_type,
+                                                operation.interface,
+                                                deadline=deadline)
+            else:
+                raise cexc.NOSSNMPFailure(operation=operation.op,
+                                          nos_host=nos_host,
+                                          error='Unknown operation')
 
-        self._set(nos_host, varBinds)
+        self._apply_config(nos_host, deadline=deadline)
 
 
-    def create_and_trunk_vlan(self, nos_host, vlan_id, vlan_name, intf_type, interface):
-        LOG.debug(_('create_and_trunk_vlan %s %d %s'), nos_host, vlan_id, interface)
-        self._create_vlan(nos_host, vlan_id, vlan_name)
-        if interface:
-            self.enable_vlan_on_trunk_int(nos_host, vlan_id, intf_type, interface)
+    def get_vlan_state(self, nos_host, interfaces, deadline=None):
+        """
+        The VLAN membership of the ports cannot be read back with the
+        OIDs known to this driver, so the state is reported as unknown.
+        """
+        return None
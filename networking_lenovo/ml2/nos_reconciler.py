@@ -0,0 +1,281 @@
+# Copyright (c) 2017, Lenovo.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Periodic reconciliation of the switch VLAN configuration with the
+bindings stored in the database
+"""
+
+import collections
+
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_service import loopingcall
+from oslo_utils import uuidutils
+
+from networking_lenovo.ml2 import constants as const
+from networking_lenovo.ml2 import nos_db_v2
+from networking_lenovo.ml2 import nos_network_driver
+
+LOG = logging.getLogger(__name__)
+
+# Lease electing the neutron-server that runs the periodic reconciliation
+LEASE_NAME = 'reconciler'
+
+
+class LenovoNOSReconciler(object):
+    """
+    Brings the switches back in line with lenovo_ml2_nosport_bindings.
+
+    Each run builds the desired VLANs per switch interface from the
+    database, reads the actual state of each switch in bulk and applies
+    only the missing VLANs and trunk members, at most
+    reconcile_max_ops_per_switch operations per switch and run.
+
+    VLANs trunked on an interface but unknown to the database are only
+    reported, since they may have been configured by hand.  When a
+    backend cannot read the switch state (SNMP, NETCONF), only the
+    bindings whose postcommit never completed (processed=False) are
+    replayed.
+
+    The periodic runs of all neutron-server processes are elected
+    through a database lease: a single one reconciles at a time.
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+        self._timer = None
+        # Id of this process for the lease, and its duration in seconds
+        # while the periodic runs are started
+        self._holder = uuidutils.generate_uuid()
+        self._lease = None
+        # Switches whose state the backend cannot read, warned about
+        self._stateless = set()
+
+    def start(self, interval):
+        """ Run the reconciliation every 'interval' seconds """
+        # Renewed before every switch, so that the lease of a live
+        # process expires only if a switch takes that long.
+        self._lease = 2 * interval
+        self._timer = loopingcall.FixedIntervalLoopingCall(self._run)
+        self._timer.start(interval=interval, initial_delay=interval)
+
+    def stop(self):
+        if self._timer:
+            self._timer.stop()
+            self._timer = None
+            nos_db_v2.release_lease(LEASE_NAME, self._holder)
+            self._lease = None
+
+    def _run(self):
+        try:
+            if not self._elected():
+                LOG.debug("NOS reconciliation runs on another server")
+                return
+            self.reconcile()
+        except Exception:
+            LOG.exception(_("NOS reconciliation failed"))
+
+    def _elected(self):
+        """ Take or renew the lease of the periodic runs, if started """
+        return self._lease is None or nos_db_v2.acquire_lease(
+            LEASE_NAME, self._holder, self._lease)
+
+    def _desired_state(self, reader=False):
+        """
+        Desired state from the database:
+        {switch_ip: {(intf_type, interface): {vlan_id: [bindings]}}}
+        """
+        desired = collections.defaultdict(
+            lambda: collections.defaultdict(dict))
+        for row in nos_db_v2.get_all_nosport_bindings(reader=reader):
+            intf_type, sep, interface = row.port_id.partition(':')
+            intf_vlans = desired[row.switch_ip][intf_type, interface]
+            intf_vlans.setdefault(int(row.vlan_id), []).append(row)
+        return desired
+
+    def reconcile(self, dry_run=None):
+        """
+        Run one reconciliation pass over all switches.
+
+        Returns a report per switch_ip.  A dry run also reports the
+        bindings per VLAN of each switch, and per VLAN and interface
+        with how many of them are processed.
+        """
+        if dry_run is None:
+            dry_run = cfg.CONF.ml2_lenovo.reconcile_dry_run
+
+        report = {}
+        vlan_usage = nos_db_v2.get_switch_vlan_usage() if dry_run else {}
+        # A dry run only reports, the replicas may serve it.
+        for switch_ip, intf_bindings in self._desired_state(
+                reader=dry_run).items():
+            if not self._elected():
+                LOG.warning(_("NOS reconciliation lease lost, another "
+                              "server takes over"))
+                break
+            try:
+                report[switch_ip] = self._reconcile_switch(
+                    switch_ip, intf_bindings, dry_run)
+                if dry_run:
+                    self._report_usage(report[switch_ip], switch_ip,
+                                       vlan_usage.get(switch_ip, {}))
+            except Exception as e:
+                LOG.error(_("NOS reconciliation of switch %(switch_ip)s "
+                            "failed: %(exc)s"),
+                          {'switch_ip': switch_ip, 'exc': e})
+                report[switch_ip] = {'error': str(e)}
+        return report
+
+    def _report_usage(self, report, switch_ip, vlan_usage):
+        interface_usage = nos_db_v2.get_interface_vlan_usage(switch_ip)
+        report['vlan_usage'] = vlan_usage
+        report['interface_vlan_usage'] = interface_usage
+        LOG.info(_("NOS reconciliation: switch %(switch_ip)s has bindings "
+                   "on VLANs %(vlans)s"),
+                 {'switch_ip': switch_ip, 'vlans': vlan_usage})
+        for port_id, vlans in sorted(interface_usage.items()):
+            LOG.debug(_("NOS reconciliation: switch %(switch_ip)s %(port)s "
+                        "has (bindings, processed) per VLAN: %(vlans)s"),
+                      {'switch_ip': switch_ip, 'port': port_id,
+                       'vlans': vlans})
+
+    def _corrections(self, switch_ip, intf_bindings):
+        """
+        Compute the corrections needed on one switch.
+
+        Returns a list of (operations, bindings) where the bindings are
+        the unprocessed rows fixed once the operations are applied, and
+        the {port_id: [vlan_id]} of unexpected trunk members.
+        """
+        vlan_name_prefix = cfg.CONF.ml2_lenovo.vlan_name_prefix
+        corrections = []
+        extra_members = {}
+
+        def create_op(vlan_id):
+            return nos_network_driver.SwitchOperation(
+                const.OP_CREATE_VLAN, vlan_id,
+                vlan_name_prefix + str(vlan_id))
+
+        def enable_op(vlan_id, intf_type, interface):
+            return nos_network_driver.SwitchOperation(
+                const.OP_ENABLE_VLAN, vlan_id,
+                intf_type=intf_type, interface=interface)
+
+        state = self.driver.get_vlan_state(switch_ip, list(intf_bindings))
+        if state is None:
+            if switch_ip not in self._stateless:
+                self._stateless.add(switch_ip)
+                LOG.warning(_("NOS reconciliation: the state of switch "
+                              "%s cannot be read by its driver, only its "
+                              "unprocessed bindings are replayed"),
+                            switch_ip)
+            # A VLAN with a processed binding already exists on the switch.
+            created = set(vlan_id for vlans in intf_bindings.values()
+                          for vlan_id, rows in vlans.items()
+                          if any(row.processed for row in rows))
+            for (intf_type, interface), vlans in intf_bindings.items():
+                for vlan_id, rows in sorted(vlans.items()):
+                    pending = [row for row in rows if not row.processed]
+                    if not pending:
+                        continue
+                    operations = []
+                    if vlan_id not in created:
+                        created.add(vlan_id)
+                        operations.append(create_op(vlan_id))
+                    operations.append(enable_op(vlan_id, intf_type,
+                                                interface))
+                    corrections.append((operations, pending))
+            return corrections, extra_members
+
+        switch_vlans, intf_vlans = state
+        desired_vlans = set()
+        for vlans in intf_bindings.values():
+            desired_vlans.update(vlans)
+        for vlan_id in sorted(desired_vlans - switch_vlans):
+            corrections.append(([create_op(vlan_id)], []))
+
+        for (intf_type, interface), vlans in intf_bindings.items():
+            actual = intf_vlans.get((intf_type, interface), set())
+            for vlan_id, rows in sorted(vlans.items()):
+                pending = [row for row in rows if not row.processed]
+                if vlan_id in actual:
+                    if pending:
+                        corrections.append(([], pending))
+                    continue
+                corrections.append(
+                    ([enable_op(vlan_id, intf_type, interface)], pending))
+
+            extra = actual - set(vlans)
+            if extra:
+                extra_members['%s:%s' % (intf_type, interface)] = (
+                    sorted(extra))
+
+        return corrections, extra_members
+
+    def _reconcile_switch(self, switch_ip, intf_bindings, dry_run):
+        corrections, extra_members = self._corrections(switch_ip,
+                                                       intf_bindings)
+
+        max_ops = cfg.CONF.ml2_lenovo.reconcile_max_ops_per_switch
+        operations = []
+        fixed = []
+        deferred = 0
+        for correction_ops, rows in corrections:
+            # Once a correction is deferred, defer the following ones too:
+            # they may depend on it (e.g. trunking a VLAN it creates).
+            if correction_ops and (deferred or (
+                    operations and
+                    len(operations) + len(correction_ops) > max_ops)):
+                deferred += len(correction_ops)
+                continue
+            operations.extend(correction_ops)
+            fixed.extend(rows)
+
+        report = {'operations': len(operations),
+                  'deferred': deferred,
+                  'bindings_fixed': len(fixed),
+                  'extra_members': extra_members}
+
+        for operation in operations:
+            LOG.info(_("NOS reconciliation: switch %(switch_ip)s needs "
+                       "%(op)s vlan %(vlan)s %(intf_type)s %(interface)s"),
+                     {'switch_ip': switch_ip, 'op': operation.op,
+                      'vlan': operation.vlan_id,
+                      'intf_type': operation.intf_type or '',
+                      'interface': operation.interface or ''})
+        for port_id, vlans in extra_members.items():
+            LOG.debug(_("NOS reconciliation: switch %(switch_ip)s %(port)s "
+                        "has VLANs unknown to the database: %(vlans)s"),
+                      {'switch_ip': switch_ip, 'port': port_id,
+                       'vlans': vlans})
+
+        if dry_run:
+            return report
+
+        if self.driver.apply_batch(switch_ip,
+                                   operations) is nos_network_driver.DEFERRED:
+            # The switch is down: the bindings are processed by a later
+            # run, once the queued operations have been replayed.
+            report['bindings_fixed'] = 0
+            report['switch_deferred'] = True
+            return report
+        port_ids = collections.defaultdict(list)
+        for row in fixed:
+            port_ids[row.vlan_id, row.instance_id].append(row.port_id)
+        for (vlan_id, instance_id), ports in port_ids.items():
+            nos_db_v2.process_bindings(vlan_id, switch_ip, instance_id,
+                                       ports)
+        return report
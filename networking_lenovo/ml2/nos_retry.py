@@ -0,0 +1,107 @@
+# Copyright (c) 2017, Lenovo.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Retry policy for the switch requests of all the backends
+"""
+
+import collections
+import random
+import time
+
+import eventlet
+from oslo_config import cfg
+from oslo_log import log as logging
+
+from networking_lenovo.ml2 import exceptions as cexc
+
+LOG = logging.getLogger(__name__)
+
+# Idempotency classes of a switch request.  An idempotent request (a
+# read, a PUT of VLAN deltas, a DELETE, a declarative configuration) may
+# be sent again after a failure; a non-idempotent one (a POST creating an
+# object) is never retried.
+IDEMPOTENT = 'idempotent'
+NON_IDEMPOTENT = 'non-idempotent'
+
+
+class RetryPolicy(object):
+    """
+    Exponential backoff with jitter, shared by the requests of a backend.
+
+    Attempt n (n >= 2) waits base_delay * 2**(n - 2), capped at
+    max_delay, of which a random 'jitter' fraction is taken off so that
+    the workers retrying against the same overloaded switch spread out.
+    A retry is only made if its delay ends before the caller's deadline.
+    The retries are counted per kind of request in 'stats'.
+    """
+
+    def __init__(self, max_attempts, base_delay, max_delay, jitter):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.stats = collections.Counter()
+
+    @classmethod
+    def from_config(cls):
+        conf = cfg.CONF.ml2_lenovo
+        return cls(conf.switch_retry_max_attempts,
+                   conf.switch_retry_base_delay,
+                   conf.switch_retry_max_delay,
+                   conf.switch_retry_jitter)
+
+    def delay(self, attempt):
+        """ Seconds to wait before attempt number 'attempt' (2, 3, ...) """
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 2))
+        return delay * (1 - self.jitter * random.random())
+
+    def run(self, func, kind, operation, idempotency=IDEMPOTENT,
+            deadline=None, retryable=None):
+        """
+        Call func() until it returns, retrying the exceptions for which
+        retryable(exc) is true (all of them by default).
+
+        kind - kind of request counted in 'stats', e.g. 'REST GET'
+        operation - description of the request, for the logs
+        idempotency - IDEMPOTENT or NON_IDEMPOTENT
+        deadline - nos_deadline.Deadline of the caller, or None
+        """
+        started = time.time()
+        attempt = 1
+        while True:
+            try:
+                return func()
+            except Exception as e:
+                if (idempotency != IDEMPOTENT or
+                        attempt >= self.max_attempts or
+                        isinstance(e, cexc.NOSDeadlineExceeded) or
+                        (retryable is not None and not retryable(e))):
+                    raise
+                attempt += 1
+                delay = self.delay(attempt)
+                if deadline is not None and delay >= deadline.remaining():
+                    LOG.debug("%s: not retrying, the deadline is too "
+                              "close" % operation)
+                    raise
+                self.stats[kind] += 1
+                LOG.warning(_("%(op)s failed after %(elapsed).2fs: %(exc)s; "
+                              "attempt %(attempt)d of %(max)d in "
+                              "%(delay).2fs"),
+                            {'op': operation,
+                             'elapsed': time.time() - started,
+                             'exc': e, 'attempt': attempt,
+                             'max': self.max_attempts, 'delay': delay})
+                eventlet.sleep(delay)
@@ -100,6 +100,10 @@ CMD_NO_VLAN_CONF_SNIPPET = """
 		no vlan %s
 """
 
+CMD_EXIT_SNIPPET = """
+		exit
+"""
+
 CMD_INT_VLAN_HEADER = """
           <interface>
             <%s>
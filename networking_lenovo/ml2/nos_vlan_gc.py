@@ -0,0 +1,150 @@
+# Copyright (c) 2017, Lenovo.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Deferred removal of the VLANs no longer used on a NOS switch
+"""
+
+import datetime
+
+from oslo_log import log as logging
+from oslo_service import loopingcall
+from oslo_utils import timeutils
+
+from networking_lenovo.ml2 import constants as const
+from networking_lenovo.ml2 import nos_db_v2
+from networking_lenovo.ml2 import nos_network_driver
+
+LOG = logging.getLogger(__name__)
+
+
+class DeferredVlanDeleter(object):
+    """
+    Delete unused VLANs from the switches after a grace period.
+
+    A VLAN whose last binding disappears is scheduled for deletion
+    instead of being deleted at once.  If a new binding for the same
+    (switch_ip, vlan_id) arrives before the grace period expires the
+    deletion is cancelled and the VLAN only needs to be trunked again.
+    Expired deletions are swept periodically, one batch per switch.
+
+    The scheduled deletions are rows of lenovo_ml2_nos_vlan_deletions,
+    shared by all the neutron-server processes and kept across restarts.
+    A sweep claims the rows of its batch for 'lease' seconds, checks the
+    bindings, and deletes the VLANs from the switch without holding any
+    database lock; a cancel of a claimed VLAN waits for the sweep, so a
+    VLAN is never deleted under a new binding.
+    """
+
+    def __init__(self, driver, grace, batch_size, lease):
+        """
+        :param driver: LenovoNOSDriver used to delete the VLANs
+        :param grace: seconds a VLAN is kept after its last binding
+        :param batch_size: maximum VLANs deleted per switch and batch
+        :param lease: seconds a sweep may take to delete a batch
+        """
+        self.driver = driver
+        self.grace = grace
+        self.batch_size = batch_size
+        self.lease = lease
+        self._timer = None
+
+    def start(self, interval):
+        """ Sweep the expired deletions every 'interval' seconds """
+        self._timer = loopingcall.FixedIntervalLoopingCall(self._run)
+        self._timer.start(interval=interval, initial_delay=interval)
+
+    def stop(self):
+        if self._timer:
+            self._timer.stop()
+            self._timer = None
+
+    def _run(self):
+        try:
+            self.sweep()
+        except Exception:
+            LOG.exception(_("NOS deferred VLAN deletion failed"))
+
+    def schedule(self, switch_ip, vlan_id):
+        """ Delete the VLAN from the switch once the grace period expires """
+        delete_after = timeutils.utcnow() + datetime.timedelta(
+            seconds=self.grace)
+        if nos_db_v2.schedule_vlan_deletion(switch_ip, vlan_id,
+                                            delete_after):
+            LOG.debug("NOS: vlan %s on %s scheduled for deletion" %
+                      (vlan_id, switch_ip))
+
+    def cancel(self, switch_ip, vlan_id):
+        """
+        Cancel the scheduled deletion of a VLAN.
+
+        Returns True if a deletion was pending, i.e. the VLAN is still
+        configured on the switch.
+        """
+        if not nos_db_v2.cancel_vlan_deletion(switch_ip, vlan_id):
+            return False
+        LOG.debug("NOS: deletion of vlan %s on %s cancelled" %
+                  (vlan_id, switch_ip))
+        return True
+
+    def pending(self, switch_ip=None):
+        """ VLANs scheduled for deletion, optionally of one switch only """
+        return nos_db_v2.get_vlan_deletions(switch_ip)
+
+    def sweep(self, now=None):
+        """
+        Delete the VLANs whose grace period expired.
+
+        VLANs that got a binding again are dropped without touching the
+        switch.  Returns the number of VLANs deleted.
+        """
+        if now is None:
+            now = timeutils.utcnow()
+
+        switch_ips = sorted(set(
+            switch_ip for switch_ip, vlan_id in
+            nos_db_v2.get_vlan_deletions(due_before=now)))
+        return sum(self._sweep_switch(switch_ip, now)
+                   for switch_ip in switch_ips)
+
+    def _sweep_switch(self, switch_ip, now):
+        """ Delete the expired VLANs of a switch, batch after batch """
+        deleted = 0
+        while True:
+            try:
+                claim_id, vlan_ids, claimed = (
+                    nos_db_v2.claim_vlan_deletions(switch_ip, now,
+                                                   self.batch_size,
+                                                   self.lease))
+                if vlan_ids:
+                    try:
+                        self._delete(switch_ip, vlan_ids)
+                    except Exception:
+                        nos_db_v2.release_vlan_deletions(claim_id)
+                        raise
+                    nos_db_v2.complete_vlan_deletions(claim_id)
+            except Exception as e:
+                LOG.error(_("NOS: deleting vlans from switch %(switch_ip)s "
+                            "failed, will retry: %(exc)s"),
+                          {'switch_ip': switch_ip, 'exc': e})
+                return deleted
+            deleted += len(vlan_ids)
+            if claimed < self.batch_size:
+                return deleted
+
+    def _delete(self, switch_ip, vlan_ids):
+        operations = [nos_network_driver.SwitchOperation(
+            const.OP_DELETE_VLAN, vlan_id) for vlan_id in vlan_ids]
+        self.driver.apply_batch(switch_ip, operations)
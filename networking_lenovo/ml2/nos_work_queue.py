@@ -0,0 +1,88 @@
+# Copyright (c) 2017, Lenovo.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Per-switch work queues drained by a pool of background workers
+"""
+
+import eventlet
+from eventlet import queue
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+
+
+class SwitchWorkQueues(object):
+    """
+    Runs switch configuration work outside of the caller.
+
+    Each switch has its own bounded FIFO queue and at most one worker
+    draining it, so work for a switch (and for any of its interfaces)
+    is applied in the order it was queued.  Different switches are
+    drained in parallel, up to the size of the worker pool.
+    """
+
+    def __init__(self, workers, queue_size):
+        self._pool = eventlet.GreenPool(workers)
+        self._queue_size = queue_size
+        self._queues = {}
+        self._active = set()
+
+    def _get_queue(self, switch_ip):
+        work_queue = self._queues.get(switch_ip)
+        if work_queue is None:
+            work_queue = queue.LightQueue(self._queue_size)
+            self._queues[switch_ip] = work_queue
+        return work_queue
+
+    def enqueue(self, switch_ip, func, *args):
+        """
+        Queue func(*args) for switch_ip.
+
+        Blocks while the switch queue is full, which pushes back on the
+        caller instead of growing the backlog without bound.
+        """
+        work_queue = self._get_queue(switch_ip)
+        work_queue.put((func, args))
+
+        if switch_ip not in self._active:
+            self._active.add(switch_ip)
+            self._pool.spawn_n(self._drain, switch_ip, work_queue)
+
+    def _drain(self, switch_ip, work_queue):
+        """ Worker loop: run the queued work of one switch until empty """
+        try:
+            while True:
+                try:
+                    func, args = work_queue.get_nowait()
+                except queue.Empty:
+                    return
+
+                try:
+                    func(*args)
+                except Exception:
+                    LOG.exception(_("Background configuration of switch %s "
+                                    "failed"), switch_ip)
+        finally:
+            self._active.discard(switch_ip)
+
+    def pending(self, switch_ip):
+        """ Number of work items waiting for switch_ip """
+        work_queue = self._queues.get(switch_ip)
+        return work_queue.qsize() if work_queue is not None else 0
+
+    def wait(self):
+        """ Wait until all queued work has been run """
+        self._pool.waitall()
@@ -18,21 +18,48 @@ REST API client utility for configuring the Lenovo CNOS switch
 """
 
 
+import contextlib
+import threading
+import time
 
 import requests
 import requests.auth
 from oslo_log import log as logging
 
+from networking_lenovo.ml2 import nos_deadline
+from networking_lenovo.ml2 import nos_retry
+
 LOG = logging.getLogger(__name__)
 
 
+class _ServerError(Exception):
+    """ 5xx answer of the switch, retried like a transport error """
+
+    def __init__(self, resp):
+        super(_ServerError, self).__init__(
+            "HTTP %d (%s)" % (resp.status_code, resp.reason))
+        self.resp = resp
+
+
 class LenovoRestClient(object):
     """
     Class to implement basic REST client operations
     """
     RESP_CODE_OK = 200
+    RESP_CODE_UNAUTHORIZED = 401
+    RESP_CODE_NOT_FOUND = 404
+    RESP_CODE_SERVER_ERROR = 500
+
+    # A POST creates an object: sending it twice is not safe
+    METHOD_IDEMPOTENCY = {
+        'get': nos_retry.IDEMPOTENT,
+        'put': nos_retry.IDEMPOTENT,
+        'delete': nos_retry.IDEMPOTENT,
+        'post': nos_retry.NON_IDEMPOTENT,
+    }
 
-    def __init__(self, ip, user, passwd, tcp_port, use_https):
+    def __init__(self, ip, user, passwd, tcp_port, use_https,
+                 connect_timeout=None, read_timeout=None, retry_policy=None):
         self.ip = ip
         self.tcp_port = tcp_port
         self.user = user
@@ -43,6 +70,19 @@ class LenovoRestClient(object):
         self.headers = {"Content-Type" : "application/json"}
         self.login_obj = "nos/api/login/"
         self.session = None
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        # Deadline of the operation the client is used for, if any
+        self.deadline = None
+        self.retry_policy = retry_policy
+
+    def _timeout(self, method, url):
+        """ (connect, read) timeout of a request, cut to the deadline """
+        operation = "%s %s" % (method.upper(), url)
+        return tuple(
+            timeout if timeout is None else
+            nos_deadline.bounded_timeout(self.deadline, timeout, operation)
+            for timeout in (self.connect_timeout, self.read_timeout))
 
     def _build_url(self, obj):
         """ 
@@ -59,15 +99,18 @@ class LenovoRestClient(object):
     def login(self):
         """ Method to be called first in order to login on the switch """
         url = self._build_url(self.login_obj)
-        self.session = requests.Session()
+        # A re-login keeps the session and its open connections.
+        if self.session is None:
+            self.session = requests.Session()
 
-        for attempt in range(3):
-            resp = self._get(url)
-            if resp.status_code == self.RESP_CODE_OK:
-                return
+        def attempt():
+            resp = self._request('get', url)
+            if resp.status_code != self.RESP_CODE_OK:
+                error_str = "REST HTTP error: %d(%s)" % (resp.status_code,
+                                                         resp.reason)
+                raise Exception(error_str)
 
-        error_str = "REST HTTP error: %d(%s)" % (resp.status_code, resp.reason)
-        raise Exception(error_str)
+        self._retry(attempt, 'get', url, None)
 
 
     def _log_http(self, resp):
@@ -91,31 +134,75 @@ class LenovoRestClient(object):
         log_print(resp.text)
         log_print("----------------------------\n\n")
 
-    def _get(self, url):
-        """ Internal method for the GET operation """
-        resp = self.session.get(url, headers=self.headers, auth=self.http_auth, 
-                                verify=self.verify_certificate)
+    def _request(self, method, url, js_body=None):
+        """ Send one request on the session """
+        kwargs = {}
+        if js_body is not None:
+            kwargs['json'] = js_body
+        resp = self.session.request(method, url, headers=self.headers,
+                                    auth=self.http_auth,
+                                    verify=self.verify_certificate,
+                                    timeout=self._timeout(method, url),
+                                    **kwargs)
         self._log_http(resp)
         return resp
 
+    def _retry(self, func, method, url, retryable):
+        """ Run func() under the retry policy of the client, if any """
+        if self.retry_policy is None:
+            return func()
+        return self.retry_policy.run(
+            func, 'REST %s' % method.upper(),
+            "REST %s %s" % (method.upper(), url),
+            idempotency=self.METHOD_IDEMPOTENCY[method],
+            deadline=self.deadline, retryable=retryable)
+
+    @staticmethod
+    def _transient(exc):
+        """ Errors worth retrying: no answer or a 5xx answer """
+        return isinstance(exc, (_ServerError,
+                                requests.exceptions.ConnectionError,
+                                requests.exceptions.Timeout))
+
+    def _send_once(self, method, url, js_body=None):
+        """ Send a request, logging in again if the session expired """
+        resp = self._request(method, url, js_body)
+        if resp.status_code == self.RESP_CODE_UNAUTHORIZED:
+            LOG.debug("REST session to %s expired, logging in again" %
+                      self.ip)
+            self.login()
+            resp = self._request(method, url, js_body)
+        if resp.status_code >= self.RESP_CODE_SERVER_ERROR:
+            raise _ServerError(resp)
+        return resp
+
+    def _send(self, method, url, js_body=None):
+        """
+        Send a request, retrying the idempotent ones after a transient
+        error.  A 5xx answer is returned once the retries are exhausted.
+        """
+        try:
+            return self._retry(
+                lambda: self._send_once(method, url, js_body),
+                method, url, self._transient)
+        except _ServerError as e:
+            return e.resp
+
+    def _get(self, url):
+        """ Internal method for the GET operation """
+        return self._send('get', url)
+
     def _post(self, url, js_body):
         """ Internal method for the POST operation """
-        resp = self.session.post(url, json=js_body, headers=self.headers, 
-                                 auth=self.http_auth, verify=self.verify_certificate)
-        self._log_http(resp)
-        return resp
+        return self._send('post', url, js_body)
 
     def _del(self, url):
         """ Internal method for the DELETE operation """
-        self.session.delete(url, headers=self.headers, auth=self.http_auth, 
-                            verify=self.verify_certificate)
+        return self._send('delete', url)
 
     def _put(self, url, js_body):
         """ Internal method for the PUT operation """
-        resp = self.session.put(url, json=js_body, headers=self.headers, 
-                                auth=self.http_auth, verify=self.verify_certificate)
-        self._log_http(resp)
-        return resp
+        return self._send('put', url, js_body)
 
     def get(self, obj):
         """ Implements HTTP GET operation """
@@ -143,6 +230,84 @@ class LenovoRestClient(object):
             pass
         else:
             self.session.close()
-            self.session = None 
-    
+            self.session = None
+
+
+class LenovoRestSessionPool(object):
+    """
+    Per switch pool of logged-in REST clients
+
+    Checked in clients keep their keep-alive connections and login
+    cookie, so an operation only costs its own requests.  Clients idle
+    for more than idle_ttl seconds are closed instead of being reused.
+    """
+
+    def __init__(self, connect, max_idle, idle_ttl):
+        """
+        connect - callable(host, deadline) returning a logged-in
+                  LenovoRestClient
+        max_idle - maximum number of idle clients kept per switch
+        idle_ttl - seconds an idle client may be reused
+        """
+        self._connect = connect
+        self.max_idle = max_idle
+        self.idle_ttl = idle_ttl
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def checkout(self, host, deadline=None):
+        """ Return an idle client of the switch or a new one """
+        expired = []
+        client = None
+        now = time.time()
+        with self._lock:
+            idle = self._idle.get(host, [])
+            while idle:
+                candidate, last_used = idle.pop()
+                if now - last_used <= self.idle_ttl:
+                    client = candidate
+                    break
+                expired.append(candidate)
+        for candidate in expired:
+            candidate.close()
+        if client is None:
+            client = self._connect(host, deadline)
+        return client
+
+    def checkin(self, host, client):
+        """ Give a client back for reuse """
+        client.deadline = None
+        with self._lock:
+            idle = self._idle.setdefault(host, [])
+            if len(idle) < self.max_idle:
+                idle.append((client, time.time()))
+                return
+        client.close()
+
+    @contextlib.contextmanager
+    def connection(self, host, deadline=None):
+        """
+        Check out a client for the duration of the block, bound to
+        'deadline'.  A client whose block raised is closed rather than
+        reused.
+        """
+        client = self.checkout(host, deadline)
+        client.deadline = deadline
+        try:
+            yield client
+        except Exception:
+            client.close()
+            raise
+        self.checkin(host, client)
 
+    def clear(self, host=None):
+        """ Close the idle clients, of one switch or of all of them """
+        with self._lock:
+            if host is None:
+                idle = [entry for entries in self._idle.values()
+                        for entry in entries]
+                self._idle = {}
+            else:
+                idle = self._idle.pop(host, [])
+        for client, last_used in idle:
+            client.close()
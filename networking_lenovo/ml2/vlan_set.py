@@ -0,0 +1,205 @@
+# Copyright (c) 2017, Lenovo.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compact set of VLAN ids shared by the switch backends
+"""
+
+MAX_VLAN_ID = 4095
+
+# The VLANs meant by "all" in the CNOS REST API
+CNOS_ALL_FIRST = 1
+CNOS_ALL_LAST = 4094
+
+
+class VlanSet(object):
+    """
+    Set of VLAN ids 0-4095 kept as a 4096-bit bitmap.
+
+    Membership, union, difference and comparison work on the bitmap, so
+    their cost does not depend on how many VLANs the set holds.  Besides
+    lists of ids, the set reads and writes the range ("10-20,30") and
+    CNOS ("all", "none", [ids]) encodings.
+    """
+
+    __slots__ = ('_bits',)
+
+    def __init__(self, vlan_ids=()):
+        self._bits = 0
+        self.update(vlan_ids)
+
+    @classmethod
+    def _from_bits(cls, bits):
+        vlans = cls()
+        vlans._bits = bits
+        return vlans
+
+    @staticmethod
+    def _bit(vlan_id):
+        vlan_id = int(vlan_id)
+        if not 0 <= vlan_id <= MAX_VLAN_ID:
+            raise ValueError("VLAN id out of range: %s" % vlan_id)
+        return 1 << vlan_id
+
+    @staticmethod
+    def _range_bits(first, last):
+        if first > last:
+            return 0
+        return ((1 << (last + 1)) - 1) ^ ((1 << first) - 1)
+
+    @classmethod
+    def from_range(cls, first, last):
+        """ VLANs first to last, both included """
+        cls._bit(first)
+        cls._bit(last)
+        return cls._from_bits(cls._range_bits(first, last))
+
+    @classmethod
+    def cnos_all(cls):
+        """ The VLANs of a CNOS interface trunking "all" """
+        return cls.from_range(CNOS_ALL_FIRST, CNOS_ALL_LAST)
+
+    @classmethod
+    def from_cnos(cls, vlist):
+        """
+        Parse the 'vlans' of a CNOS vlan_interface: "all", "none", a
+        list of ids or a VlanSet (copied)
+        """
+        if isinstance(vlist, VlanSet):
+            return vlist.copy()
+        if vlist == "all":
+            return cls.cnos_all()
+        if vlist == "none":
+            return cls()
+        if not isinstance(vlist, list):
+            raise ValueError("Unexpected vlan list: " + str(vlist))
+        return cls(vlist)
+
+    @classmethod
+    def from_ranges(cls, text):
+        """ Parse a range list such as "1,10-20,30" """
+        vlans = cls()
+        for item in text.split(','):
+            item = item.strip()
+            if not item:
+                continue
+            first, sep, last = item.partition('-')
+            vlans |= cls.from_range(int(first), int(last if sep else first))
+        return vlans
+
+    def copy(self):
+        return self._from_bits(self._bits)
+
+    def add(self, vlan_id):
+        self._bits |= self._bit(vlan_id)
+
+    def discard(self, vlan_id):
+        self._bits &= ~self._bit(vlan_id)
+
+    def update(self, vlan_ids):
+        if isinstance(vlan_ids, VlanSet):
+            self._bits |= vlan_ids._bits
+            return
+        for vlan_id in vlan_ids:
+            self._bits |= self._bit(vlan_id)
+
+    def first(self):
+        """ Lowest VLAN id of the set, None if empty """
+        if not self._bits:
+            return None
+        return (self._bits & -self._bits).bit_length() - 1
+
+    def complement(self, universe=None):
+        """ VLANs of 'universe' (CNOS "all" by default) not in the set """
+        if universe is None:
+            universe = self.cnos_all()
+        return universe - self
+
+    def ranges(self):
+        """ List of (first, last) runs of consecutive VLAN ids """
+        runs = []
+        for vlan_id in self:
+            if runs and runs[-1][1] == vlan_id - 1:
+                runs[-1][1] = vlan_id
+            else:
+                runs.append([vlan_id, vlan_id])
+        return [tuple(run) for run in runs]
+
+    def to_ranges(self):
+        """ Range list encoding, e.g. "1,10-20,30" """
+        return ','.join(str(first) if first == last else
+                        '%d-%d' % (first, last)
+                        for first, last in self.ranges())
+
+    def _coerce(self, other):
+        if isinstance(other, VlanSet):
+            return other
+        return VlanSet(other)
+
+    def __contains__(self, vlan_id):
+        try:
+            return bool(self._bits & self._bit(vlan_id))
+        except (TypeError, ValueError):
+            return False
+
+    def __iter__(self):
+        bits = self._bits
+        while bits:
+            low = bits & -bits
+            yield low.bit_length() - 1
+            bits ^= low
+
+    def __len__(self):
+        return bin(self._bits).count('1')
+
+    def __bool__(self):
+        return self._bits != 0
+
+    __nonzero__ = __bool__
+
+    def __or__(self, other):
+        return self._from_bits(self._bits | self._coerce(other)._bits)
+
+    def __and__(self, other):
+        return self._from_bits(self._bits & self._coerce(other)._bits)
+
+    def __sub__(self, other):
+        return self._from_bits(self._bits & ~self._coerce(other)._bits)
+
+    def __ior__(self, other):
+        self._bits |= self._coerce(other)._bits
+        return self
+
+    def __isub__(self, other):
+        self._bits &= ~self._coerce(other)._bits
+        return self
+
+    def __eq__(self, other):
+        if not isinstance(other, VlanSet):
+            return NotImplemented
+        return self._bits == other._bits
+
+    def __ne__(self, other):
+        if not isinstance(other, VlanSet):
+            return NotImplemented
+        return self._bits != other._bits
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return (self._from_bits, (self._bits,))
+
+    def __repr__(self):
+        return 'VlanSet(%r)' % self.to_ranges()
@@ -0,0 +1,95 @@
+# Copyright (c) 2017, Lenovo.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+
+import mock
+from oslo_config import cfg
+
+from neutron.tests import base
+
+from networking_lenovo.ml2 import cnos_network_driver_rest
+from networking_lenovo.ml2 import config as conf
+
+NOS_HOST = '10.0.0.1'
+IF_NAME = 'Ethernet1/10'
+
+
+class TestCNOSMirroredTrunkChanges(base.BaseTestCase):
+    """Writes built from the mirrored state of an interface"""
+
+    def setUp(self):
+        super(TestCNOSMirroredTrunkChanges, self).setUp()
+        cfg.CONF.set_override('rest_session_pool_size', 0, 'ml2_lenovo')
+        mock.patch.object(conf.ML2MechLenovoConfig, 'nos_dict', {}).start()
+        self.driver = cnos_network_driver_rest.LenovoCNOSDriverREST()
+        self.mirrored = None
+        self.driver._mirror = mock.Mock()
+        self.driver._mirror.get_intf.side_effect = (
+            lambda host, if_name: copy.deepcopy(self.mirrored))
+        self.conn = mock.Mock(ip=NOS_HOST)
+        self.conn.put.return_value = self._resp({})
+
+    def _resp(self, json):
+        resp = mock.Mock(status_code=200)
+        resp.json.return_value = json
+        return resp
+
+    def _on_switch(self, mode, pvid, vlans):
+        self.conn.get.return_value = self._resp(
+            {'if_name': IF_NAME, 'bridgeport_mode': mode, 'pvid': pvid,
+             'vlans': vlans})
+
+    def _put_vlans(self):
+        self.assertEqual(1, self.conn.put.call_count)
+        return self.conn.put.call_args[0][1]
+
+    def test_remove_delta_from_mirror(self):
+        self.mirrored = {'bridgeport_mode': 'trunk', 'pvid': 1,
+                         'vlans': [1, 10, 20]}
+        self.driver._rem_intf_from_vlan(self.conn, 10, IF_NAME)
+        self.assertFalse(self.conn.get.called)
+        self.assertEqual(['remove', 10], self._put_vlans()['vlans'])
+
+    def test_remove_to_access_reads_switch(self):
+        # The mirror only knows of vlans 1 and 10, another process
+        # trunked vlan 20: the port must stay a trunk.
+        self.mirrored = {'bridgeport_mode': 'trunk', 'pvid': 1,
+                         'vlans': [1, 10]}
+        self._on_switch('trunk', 1, [1, 10, 20])
+        self.driver._rem_intf_from_vlan(self.conn, 10, IF_NAME)
+        self.assertTrue(self.conn.get.called)
+        req = self._put_vlans()
+        self.assertEqual('trunk', req['bridgeport_mode'])
+        self.assertEqual(['remove', 10], req['vlans'])
+
+    def test_add_to_access_port_reads_switch(self):
+        self.mirrored = {'bridgeport_mode': 'access', 'pvid': 1,
+                         'vlans': [1]}
+        self._on_switch('trunk', 1, [1, 20])
+        self.driver._add_intf_to_vlan(self.conn, 10, IF_NAME)
+        self.assertTrue(self.conn.get.called)
+        self.assertEqual(['add', 10], self._put_vlans()['vlans'])
+
+    def test_except_encoding_reads_switch(self):
+        # The mirror misses vlan 7, trunked by another process: an
+        # ["except", 7] built from it would remove vlan 7.
+        self.mirrored = {'bridgeport_mode': 'trunk', 'pvid': 1,
+                         'vlans': list(range(1, 5)) + list(range(8, 4095))}
+        self._on_switch('trunk', 1, list(range(1, 5)) + list(range(7, 4095)))
+        intf_info = self.driver._get_intf_info(self.conn, IF_NAME)
+        self.driver._add_intf_to_vlans(self.conn, intf_info, [5, 6], IF_NAME)
+        self.assertTrue(self.conn.get.called)
+        self.assertEqual(['add', 5, 6], self._put_vlans()['vlans'])
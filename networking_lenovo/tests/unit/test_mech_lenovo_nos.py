@@ -0,0 +1,165 @@
+# Copyright (c) 2017, Lenovo.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+from oslo_config import cfg
+
+from neutron.tests import base
+
+from networking_lenovo.ml2 import config as conf
+from networking_lenovo.ml2 import mech_lenovo_nos
+from networking_lenovo.ml2 import nos_db_v2
+from networking_lenovo.ml2 import nos_network_driver
+
+SWITCH_1 = '10.0.0.1'
+SWITCH_2 = '10.0.0.2'
+VLAN = 267
+DEVICE = 'instance-1'
+
+# host-1 and host-2 share portchannel 10 of switch 1, host-2 also has a
+# port on switch 2.
+NOS_SWITCHES = {
+    (SWITCH_1, 'username'): 'admin',
+    (SWITCH_1, 'host-1'): 'portchannel:10,5',
+    (SWITCH_1, 'host-2'): 'portchannel:10,6',
+    (SWITCH_2, 'host-2'): '7',
+}
+
+
+class TestMigration(base.BaseTestCase):
+    """Make-before-break handling of a VM migration"""
+
+    def setUp(self):
+        super(TestMigration, self).setUp()
+        self.mech = mech_lenovo_nos.LenovoNOSMechanismDriver()
+        self.mech._host_connections = self.mech._build_host_connections(
+            NOS_SWITCHES)
+        self.mech._work_queues = None
+        self.calls = mock.Mock()
+        self.mech._configure_switch = self.calls.configure
+        self.mech._delete_switch = self.calls.delete
+        mock.patch.object(self.mech, '_hook_deadline',
+                          return_value=None).start()
+
+    def test_split_migration_skips_shared_portchannel(self):
+        dest_only, src_only = self.mech._split_migration('host-1', 'host-2')
+        self.assertEqual([(SWITCH_1, 'port', '6'), (SWITCH_2, 'port', '7')],
+                         sorted(dest_only))
+        self.assertEqual([(SWITCH_1, 'port', '5')], src_only)
+
+    def test_split_migration_without_dest_host(self):
+        for dest_host_id in (None, 'unknown-host'):
+            dest_only, src_only = self.mech._split_migration('host-1',
+                                                             dest_host_id)
+            self.assertEqual([], dest_only)
+            self.assertEqual([(SWITCH_1, 'portchannel', '10'),
+                              (SWITCH_1, 'port', '5')], src_only)
+
+    def test_migrate_nxos_db(self):
+        add = mock.patch.object(nos_db_v2, 'add_nosport_bindings').start()
+        remove = mock.patch.object(nos_db_v2,
+                                   'remove_nosport_bindings').start()
+        session = mock.Mock()
+        self.mech._migrate_nxos_db(VLAN, DEVICE, 'host-1', 'host-2',
+                                   session=session)
+        self.assertEqual(
+            [('port:6', VLAN, SWITCH_1, DEVICE),
+             ('port:7', VLAN, SWITCH_2, DEVICE)],
+            sorted(add.call_args[0][0]))
+        remove.assert_called_once_with(
+            vlan_id=VLAN, switch_ip=SWITCH_1, instance_ids=[DEVICE],
+            port_ids=['port:5'], session=session)
+
+    def _op_order(self):
+        return [name for name, args, kwargs in self.calls.mock_calls]
+
+    def test_source_removed_after_dest_configured(self):
+        self.mech._migrate_switch_entry(VLAN, DEVICE, 'host-1', 'host-2')
+        self.assertEqual(['configure', 'configure', 'delete'],
+                         self._op_order())
+        self.calls.delete.assert_called_once_with(
+            VLAN, SWITCH_1, [('port', '5')], None)
+
+    def test_source_removed_after_dest_failure(self):
+        self.calls.configure.side_effect = ValueError('switch rejected')
+        self.assertRaises(Exception, self.mech._migrate_switch_entry,
+                          VLAN, DEVICE, 'host-1', 'host-2')
+        self.assertTrue(self.calls.delete.called)
+
+    def test_source_removed_after_async_dest_configured(self):
+        queued = []
+        self.mech._work_queues = mock.Mock()
+        self.mech._work_queues.enqueue.side_effect = (
+            lambda switch_ip, func, *args: queued.append((func, args)))
+        mock.patch.object(mech_lenovo_nos.eventlet, 'spawn_n',
+                          side_effect=lambda f, *args: f(*args)).start()
+
+        self.mech._migrate_switch_entry(VLAN, DEVICE, 'host-1', 'host-2')
+        # Only the destination switches are queued at first.
+        self.assertEqual(2, len(queued))
+        func, args = queued.pop(0)
+        func(*args)
+        self.assertEqual(1, len(queued))
+        self.assertFalse(self.calls.delete.called)
+        func, args = queued.pop(0)
+        func(*args)
+        # The removal is queued once the destination is configured.
+        self.assertEqual(1, len(queued))
+        func, args = queued.pop(0)
+        func(*args)
+        self.assertEqual(['configure', 'configure', 'delete'],
+                         self._op_order())
+
+
+class TestConfigReload(base.BaseTestCase):
+    """Rebuild of the host index when the configuration is re-read"""
+
+    def setUp(self):
+        super(TestConfigReload, self).setUp()
+        self.config = dict(NOS_SWITCHES)
+        mock.patch.object(conf.ML2MechLenovoConfig, 'nos_dict', {}).start()
+        mock.patch.object(conf.ML2MechLenovoConfig,
+                          '_create_ml2_mech_device_lenovo_dictionary',
+                          self._read_config).start()
+        mock.patch.object(nos_network_driver, 'LenovoNOSDriver').start()
+        self.register = mock.patch.object(cfg.CONF,
+                                          'register_mutate_hook').start()
+        self.mech = mech_lenovo_nos.LenovoNOSMechanismDriver()
+        self.mech.initialize()
+        self.hook = self.register.call_args[0][0]
+
+    def _read_config(self):
+        if self.config is None:
+            raise cfg.Error('unreadable')
+        conf.ML2MechLenovoConfig.nos_dict.update(self.config)
+
+    def test_reloaded_by_the_mutate_hook(self):
+        switches = conf.ML2MechLenovoConfig.nos_dict
+        self.config[SWITCH_2, 'host-3'] = 'portchannel:20'
+        self.hook(cfg.CONF, {})
+        self.assertEqual([(SWITCH_2, 'portchannel', '20')],
+                         list(self.mech._host_connections['host-3']))
+        # The drivers see the new switch configuration.
+        self.assertIs(switches, conf.ML2MechLenovoConfig.nos_dict)
+        self.assertEqual('portchannel:20', switches[SWITCH_2, 'host-3'])
+
+    def test_failed_reload_keeps_the_configuration(self):
+        switches = conf.ML2MechLenovoConfig.nos_dict
+        host_connections = self.mech._host_connections
+        self.config = None
+        self.hook(cfg.CONF, {})
+        self.assertIs(switches, conf.ML2MechLenovoConfig.nos_dict)
+        self.assertEqual(NOS_SWITCHES, switches)
+        self.assertIs(host_connections, self.mech._host_connections)
@@ -0,0 +1,56 @@
+# Copyright (c) 2017, Lenovo.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from neutron.tests import base
+
+from networking_lenovo.ml2 import nos_binding_cache
+
+ROW = nos_binding_cache.BindingRow('ethernet:1/10', 267, '10.0.0.1',
+                                   'instance-1', True)
+
+
+class TestBindingReadCache(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestBindingReadCache, self).setUp()
+        self.cache = nos_binding_cache.BindingReadCache(2)
+
+    def test_hit(self):
+        self.cache.put('a', 1, [ROW])
+        self.assertEqual((ROW,), self.cache.get('a', 1))
+        self.assertEqual({'hits': 1, 'misses': 0, 'entries': 1,
+                          'max_entries': 2}, self.cache.stats())
+
+    def test_generation_mismatch_is_a_miss(self):
+        self.cache.put('a', 1, [ROW])
+        self.assertIsNone(self.cache.get('a', 2))
+        # The stale entry is dropped.
+        self.assertIsNone(self.cache.get('a', 1))
+        self.assertEqual({'hits': 0, 'misses': 2, 'entries': 0,
+                          'max_entries': 2}, self.cache.stats())
+
+    def test_lru_eviction(self):
+        self.cache.put('a', 1, [])
+        self.cache.put('b', 1, [])
+        self.cache.get('a', 1)
+        self.cache.put('c', 1, [])
+        self.assertIsNone(self.cache.get('b', 1))
+        self.assertEqual((), self.cache.get('a', 1))
+        self.assertEqual((), self.cache.get('c', 1))
+
+    def test_clear(self):
+        self.cache.put('a', 1, [ROW])
+        self.cache.clear()
+        self.assertIsNone(self.cache.get('a', 1))
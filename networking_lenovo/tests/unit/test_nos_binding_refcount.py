@@ -0,0 +1,107 @@
+# Copyright (c) 2017, Lenovo.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from neutron.tests import base
+
+from networking_lenovo.ml2 import nos_binding_refcount
+
+SWITCH = '10.0.0.1'
+PORT_1 = 'ethernet:1/10'
+PORT_2 = 'ethernet:1/11'
+VLAN = 267
+INSTANCE_1 = 'instance-1'
+INSTANCE_2 = 'instance-2'
+
+
+class TestBindingRefCounts(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestBindingRefCounts, self).setUp()
+        self.refcounts = nos_binding_refcount.BindingRefCounts()
+
+    def test_add(self):
+        self.refcounts.add(SWITCH, PORT_1, VLAN, INSTANCE_1)
+        self.assertTrue(self.refcounts.vlan_in_use(SWITCH, VLAN))
+        self.assertTrue(self.refcounts.port_vlan_in_use(SWITCH, PORT_1,
+                                                        str(VLAN)))
+        self.assertFalse(self.refcounts.port_vlan_in_use(SWITCH, PORT_2,
+                                                         VLAN))
+        self.assertEqual((1, 0), self.refcounts.own_counts(
+            SWITCH, PORT_1, VLAN, INSTANCE_1))
+
+    def test_process(self):
+        self.refcounts.add(SWITCH, PORT_1, VLAN, INSTANCE_1)
+        self.refcounts.process(SWITCH, PORT_1, VLAN, INSTANCE_1)
+        self.assertEqual((1, 1), self.refcounts.own_counts(
+            SWITCH, PORT_1, VLAN, INSTANCE_1))
+        # Processing twice does not count the binding twice.
+        self.refcounts.process(SWITCH, PORT_1, VLAN, INSTANCE_1)
+        self.assertEqual((1, 1), self.refcounts.own_counts(
+            SWITCH, PORT_1, VLAN, INSTANCE_1))
+
+    def test_process_unknown_binding(self):
+        self.refcounts.process(SWITCH, PORT_1, VLAN, INSTANCE_1)
+        self.assertEqual((0, 0), self.refcounts.own_counts(
+            SWITCH, PORT_1, VLAN, INSTANCE_1))
+        self.assertFalse(self.refcounts.vlan_in_use(SWITCH, VLAN))
+
+    def test_remove(self):
+        self.refcounts.add(SWITCH, PORT_1, VLAN, INSTANCE_1, processed=True)
+        self.refcounts.add(SWITCH, PORT_1, VLAN, INSTANCE_1)
+        self.refcounts.remove(SWITCH, PORT_1, VLAN, INSTANCE_1)
+        self.assertFalse(self.refcounts.vlan_in_use(SWITCH, VLAN))
+        self.assertFalse(self.refcounts.port_vlan_in_use(SWITCH, PORT_1,
+                                                         VLAN))
+        self.assertEqual((0, 0), self.refcounts.own_counts(
+            SWITCH, PORT_1, VLAN, INSTANCE_1))
+
+    def test_remove_one(self):
+        self.refcounts.add(SWITCH, PORT_1, VLAN, INSTANCE_1, processed=True)
+        self.refcounts.add(SWITCH, PORT_1, VLAN, INSTANCE_1)
+        self.refcounts.remove_one(SWITCH, PORT_1, VLAN, INSTANCE_1)
+        self.assertEqual((1, 1), self.refcounts.own_counts(
+            SWITCH, PORT_1, VLAN, INSTANCE_1))
+        self.refcounts.remove_one(SWITCH, PORT_1, VLAN, INSTANCE_1,
+                                  processed=True)
+        self.assertFalse(self.refcounts.vlan_in_use(SWITCH, VLAN))
+        # Removing an unknown binding leaves the counts alone.
+        self.refcounts.remove_one(SWITCH, PORT_1, VLAN, INSTANCE_1)
+        self.assertEqual(nos_binding_refcount.BindingRefCounts(),
+                         self.refcounts)
+
+    def test_vlan_configured_by_others(self):
+        self.refcounts.add(SWITCH, PORT_1, VLAN, INSTANCE_1, processed=True)
+        self.assertFalse(self.refcounts.vlan_configured_by_others(
+            SWITCH, PORT_1, VLAN, INSTANCE_1))
+        self.assertTrue(self.refcounts.vlan_configured_by_others(
+            SWITCH, PORT_2, VLAN, INSTANCE_2))
+        # An unprocessed binding has not configured the VLAN yet.
+        self.refcounts.add(SWITCH, PORT_2, VLAN, INSTANCE_2)
+        self.assertFalse(self.refcounts.vlan_configured_by_others(
+            SWITCH, PORT_1, VLAN, INSTANCE_1))
+        self.refcounts.process(SWITCH, PORT_2, VLAN, INSTANCE_2)
+        self.assertTrue(self.refcounts.vlan_configured_by_others(
+            SWITCH, PORT_1, VLAN, INSTANCE_1))
+
+    def test_from_counts(self):
+        self.refcounts.add(SWITCH, PORT_1, VLAN, INSTANCE_1, processed=True)
+        self.refcounts.add(SWITCH, PORT_1, VLAN, INSTANCE_1)
+        self.refcounts.add(SWITCH, PORT_2, VLAN, INSTANCE_2)
+        rebuilt = nos_binding_refcount.BindingRefCounts.from_counts(
+            [(SWITCH, PORT_1, str(VLAN), INSTANCE_1, 2, 1),
+             (SWITCH, PORT_2, VLAN, INSTANCE_2, 1, None)])
+        self.assertEqual(self.refcounts, rebuilt)
+        rebuilt.process(SWITCH, PORT_2, VLAN, INSTANCE_2)
+        self.assertNotEqual(self.refcounts, rebuilt)
@@ -0,0 +1,138 @@
+# Copyright (c) 2017, Lenovo.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+
+import mock
+from oslo_config import cfg
+from oslo_utils import timeutils
+
+import neutron.db.api as db
+from neutron.db import models_v2
+from neutron.tests.unit import testlib_api
+
+from networking_lenovo.ml2 import nos_binding_sweeper
+from networking_lenovo.ml2 import nos_db_v2
+
+SWITCH = '10.0.0.1'
+PORT = 'ethernet:1/10'
+VLAN = 267
+INSTANCE = 'instance-1'
+AGE = 600
+LEASE = 300
+
+
+class TestStaleBindingSweeper(testlib_api.SqlTestCase):
+
+    def setUp(self):
+        super(TestStaleBindingSweeper, self).setUp()
+        # The ids cached by an earlier test are not in this database.
+        nos_db_v2._evict_ids(SWITCH)
+        self.addCleanup(nos_db_v2._evict_ids, SWITCH)
+        cfg.CONF.set_override('stale_binding_age', AGE, 'ml2_lenovo')
+        cfg.CONF.set_override('stale_binding_lease', LEASE, 'ml2_lenovo')
+        cfg.CONF.set_override('stale_binding_max_attempts', 2,
+                              'ml2_lenovo')
+        self.retry = mock.Mock()
+        self.purge = mock.Mock(side_effect=self._remove)
+        self.sweeper = nos_binding_sweeper.StaleBindingSweeper(self.retry,
+                                                               self.purge)
+        self.now = timeutils.utcnow() + datetime.timedelta(seconds=AGE + 1)
+
+    def _remove(self, binding):
+        nos_db_v2.remove_nosport_bindings(vlan_id=binding.vlan_id,
+                                          switch_ip=binding.switch_ip,
+                                          instance_ids=[binding.instance_id])
+
+    def _add_port(self, instance_id):
+        session = db.get_session()
+        with session.begin():
+            session.add(models_v2.Network(id='net-1', name='net-1',
+                                          tenant_id='tenant'))
+            session.add(models_v2.Port(id='port-1', network_id='net-1',
+                                       tenant_id='tenant', name='port-1',
+                                       mac_address='fa:16:3e:00:00:01',
+                                       admin_state_up=True, status='ACTIVE',
+                                       device_id=instance_id,
+                                       device_owner='compute:nova'))
+
+    def test_orphaned_binding_purged(self):
+        nos_db_v2.add_nosport_binding(PORT, VLAN, SWITCH, INSTANCE,
+                                      processed=True)
+        self.assertEqual(1, self.sweeper.sweep(self.now)['orphaned'])
+        self.assertEqual(1, self.purge.call_count)
+        self.assertFalse(self.retry.called)
+
+    def test_young_binding_left_alone(self):
+        nos_db_v2.add_nosport_binding(PORT, VLAN, SWITCH, INSTANCE)
+        self.sweeper.sweep(timeutils.utcnow())
+        self.assertFalse(self.purge.called)
+        self.assertFalse(self.retry.called)
+
+    def _binding(self):
+        return nos_db_v2.get_nosport_binding(PORT, VLAN, SWITCH,
+                                             INSTANCE)[0]
+
+    def test_stale_binding_retried(self):
+        self._add_port(INSTANCE)
+        nos_db_v2.add_nosport_binding(PORT, VLAN, SWITCH, INSTANCE)
+        self.assertEqual(1, self.sweeper.sweep(self.now)['retried'])
+        self.assertEqual(1, self.retry.call_count)
+        self.assertEqual(1, self._binding().attempts)
+
+    def test_claimed_binding_not_swept_concurrently(self):
+        self._add_port(INSTANCE)
+        nos_db_v2.add_nosport_binding(PORT, VLAN, SWITCH, INSTANCE)
+        other = nos_binding_sweeper.StaleBindingSweeper(self.retry,
+                                                        self.purge)
+        self.retry.side_effect = lambda binding: self.assertFalse(
+            any(other.sweep(self.now).values()))
+        self.assertEqual(1, self.sweeper.sweep(self.now)['retried'])
+        self.assertEqual(1, self.retry.call_count)
+
+    def test_failed_retry_waits_for_the_lease(self):
+        self._add_port(INSTANCE)
+        nos_db_v2.add_nosport_binding(PORT, VLAN, SWITCH, INSTANCE)
+        self.retry.side_effect = IOError('switch down')
+        self.assertEqual(1, self.sweeper.sweep(self.now)['failed'])
+        self.assertFalse(any(self.sweeper.sweep(self.now).values()))
+        later = self.now + datetime.timedelta(seconds=LEASE)
+        self.assertEqual(1, self.sweeper.sweep(later)['failed'])
+        self.assertEqual(2, self.retry.call_count)
+
+    def test_purged_after_max_attempts(self):
+        self._add_port(INSTANCE)
+        nos_db_v2.add_nosport_binding(PORT, VLAN, SWITCH, INSTANCE)
+        self.retry.side_effect = IOError('switch down')
+        for attempt in range(2):
+            self.sweeper.sweep(self.now + datetime.timedelta(
+                seconds=attempt * LEASE))
+        counts = self.sweeper.sweep(self.now + datetime.timedelta(
+            seconds=2 * LEASE))
+        self.assertEqual(1, counts['purged'])
+        self.assertEqual(2, self.retry.call_count)
+        self.assertEqual(1, self.purge.call_count)
+
+    def test_claim_compares_attempts(self):
+        nos_db_v2.add_nosport_binding(PORT, VLAN, SWITCH, INSTANCE)
+        binding = self._binding()
+        self.assertTrue(nos_db_v2.claim_binding(binding, self.now, LEASE))
+        self.assertFalse(nos_db_v2.claim_binding(binding, self.now, LEASE))
+        # Once the claim expired, only a sweeper that read the binding
+        # since can claim it.
+        later = self.now + datetime.timedelta(seconds=LEASE)
+        self.assertFalse(nos_db_v2.claim_binding(binding, later, LEASE))
+        self.assertTrue(nos_db_v2.claim_binding(self._binding(), later,
+                                                LEASE))
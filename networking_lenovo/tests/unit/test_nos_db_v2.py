@@ -0,0 +1,206 @@
+# Copyright (c) 2017, Lenovo.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+
+import neutron.db.api as db
+from neutron.tests.unit import testlib_api
+
+from networking_lenovo.ml2 import nos_binding_cache
+from networking_lenovo.ml2 import nos_db_v2
+from networking_lenovo.ml2 import nos_models_v2
+
+SWITCH = '10.0.0.1'
+OTHER_SWITCH = '10.0.0.2'
+PORT = 'ethernet:1/10'
+OTHER_PORT = 'ethernet:1/11'
+INSTANCE = 'instance-1'
+
+
+class NOSDbTestCase(testlib_api.SqlTestCase):
+
+    def setUp(self):
+        super(NOSDbTestCase, self).setUp()
+        # The ids cached by an earlier test are not in this database.
+        nos_db_v2._evict_ids(SWITCH)
+        self.addCleanup(nos_db_v2._evict_ids, SWITCH)
+
+
+class TestIdCache(NOSDbTestCase):
+
+    def test_cached_once_committed(self):
+        session = db.get_session()
+        with session.begin():
+            switch_id, interface_id = nos_db_v2._binding_ids(session,
+                                                             SWITCH, PORT)
+            # Releasing the savepoint of the interface insert is not the
+            # commit of the switch row.
+            self.assertNotIn(SWITCH, nos_db_v2._switch_ids)
+        self.assertEqual(switch_id, nos_db_v2._switch_ids[SWITCH])
+        self.assertEqual(interface_id,
+                         nos_db_v2._interface_ids[(switch_id, PORT)])
+
+    def test_not_cached_on_rollback(self):
+        session = db.get_session()
+        try:
+            with session.begin():
+                nos_db_v2._get_switch_id(session, SWITCH, create=True)
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertNotIn(SWITCH, nos_db_v2._switch_ids)
+        self.assertIsNone(nos_db_v2._get_switch_id(db.get_session(),
+                                                   SWITCH))
+
+
+class TestGenerations(NOSDbTestCase):
+
+    def setUp(self):
+        super(TestGenerations, self).setUp()
+        mock.patch.object(nos_db_v2, '_read_cache',
+                          nos_binding_cache.BindingReadCache(10)).start()
+
+    def _generation(self, session=None):
+        switch = nos_models_v2.NOSSwitch
+        return (session or db.get_session()).query(
+            switch.generation).filter_by(switch_ip=SWITCH).scalar()
+
+    def test_bumped_without_transaction(self):
+        nos_db_v2.add_nosport_binding(PORT, 100, SWITCH, INSTANCE)
+        generation = self._generation()
+        nos_db_v2.remove_nosport_binding(PORT, 100, SWITCH, INSTANCE)
+        self.assertEqual(generation + 1, self._generation())
+
+    def test_bumped_after_commit(self):
+        nos_db_v2.add_nosport_binding(PORT, 100, SWITCH, INSTANCE)
+        generation = self._generation()
+        session = db.get_session()
+        with session.begin():
+            nos_db_v2.add_nosport_binding(PORT, 101, SWITCH, INSTANCE,
+                                          session=session)
+            # The savepoint of the next insert is released meanwhile.
+            nos_db_v2.add_nosport_binding(PORT, 102, SWITCH, INSTANCE,
+                                          session=session)
+            self.assertEqual(generation, self._generation(session))
+        self.assertEqual(generation + 1, self._generation())
+
+    def test_not_bumped_on_rollback(self):
+        nos_db_v2.add_nosport_binding(PORT, 100, SWITCH, INSTANCE)
+        generation = self._generation()
+        session = db.get_session()
+        try:
+            with session.begin():
+                nos_db_v2.add_nosport_binding(PORT, 101, SWITCH, INSTANCE,
+                                              session=session)
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(generation, self._generation())
+
+    def test_failed_bump_clears_the_cache(self):
+        nos_db_v2._read_cache.put('key', 0, [])
+        session = db.get_session()
+        update = mock.patch.object(nos_db_v2, '_update_generations',
+                                   side_effect=ValueError()).start()
+        with session.begin():
+            nos_db_v2.add_nosport_binding(PORT, 100, SWITCH, INSTANCE,
+                                          session=session)
+        self.assertTrue(update.called)
+        self.assertEqual(0, nos_db_v2._read_cache.stats()['entries'])
+
+
+class TestInterfacePruning(NOSDbTestCase):
+
+    def _interfaces(self, session=None):
+        interface = nos_models_v2.NOSSwitchInterface
+        return sorted(port_id for port_id, in (
+            session or db.get_session()).query(interface.port_id))
+
+    def test_pruned_with_last_binding(self):
+        nos_db_v2.add_nosport_binding(PORT, 100, SWITCH, INSTANCE)
+        nos_db_v2.add_nosport_binding(PORT, 101, SWITCH, INSTANCE)
+        nos_db_v2.remove_nosport_binding(PORT, 100, SWITCH, INSTANCE)
+        self.assertEqual([PORT], self._interfaces())
+        nos_db_v2.remove_nosport_bindings(vlan_id=101, switch_ip=SWITCH)
+        self.assertEqual([], self._interfaces())
+        self.assertEqual({}, nos_db_v2._interface_ids)
+        # The switch row stays.
+        self.assertIsNotNone(nos_db_v2._get_switch_id(db.get_session(),
+                                                      SWITCH))
+
+    def test_pruned_after_commit(self):
+        nos_db_v2.add_nosport_binding(PORT, 100, SWITCH, INSTANCE)
+        session = db.get_session()
+        with session.begin():
+            nos_db_v2.remove_nosport_binding(PORT, 100, SWITCH, INSTANCE,
+                                             session=session)
+            self.assertEqual([PORT], self._interfaces(session))
+        self.assertEqual([], self._interfaces())
+
+    def test_not_pruned_when_bound_again(self):
+        nos_db_v2.add_nosport_binding(PORT, 100, SWITCH, INSTANCE)
+        session = db.get_session()
+        with session.begin():
+            nos_db_v2.remove_nosport_binding(PORT, 100, SWITCH, INSTANCE,
+                                             session=session)
+            nos_db_v2.add_nosport_binding(PORT, 101, SWITCH, INSTANCE,
+                                          session=session)
+        self.assertEqual([PORT], self._interfaces())
+
+    def test_add_with_interface_pruned_by_another_server(self):
+        nos_db_v2.add_nosport_binding(PORT, 100, SWITCH, INSTANCE)
+        interface_ids = dict(nos_db_v2._interface_ids)
+        nos_db_v2.remove_nosport_binding(PORT, 100, SWITCH, INSTANCE)
+        # This process still has the id of the pruned row.
+        nos_db_v2._interface_ids.update(interface_ids)
+        nos_db_v2.add_nosport_binding(PORT, 101, SWITCH, INSTANCE)
+        self.assertEqual([PORT], self._interfaces())
+        self.assertEqual(1, len(nos_db_v2.get_port_switch_bindings(
+            PORT, SWITCH)))
+
+    def test_bulk_add_with_interface_pruned_by_another_server(self):
+        nos_db_v2.add_nosport_binding(PORT, 100, SWITCH, INSTANCE)
+        interface_ids = dict(nos_db_v2._interface_ids)
+        nos_db_v2.remove_nosport_binding(PORT, 100, SWITCH, INSTANCE)
+        nos_db_v2._interface_ids.update(interface_ids)
+        self.assertEqual(2, nos_db_v2.add_nosport_bindings(
+            [(PORT, 101, SWITCH, INSTANCE), (PORT, 102, SWITCH, INSTANCE)]))
+        self.assertEqual([PORT], self._interfaces())
+
+
+class TestVlanUsage(NOSDbTestCase):
+
+    def setUp(self):
+        super(TestVlanUsage, self).setUp()
+        nos_db_v2._evict_ids(OTHER_SWITCH)
+        self.addCleanup(nos_db_v2._evict_ids, OTHER_SWITCH)
+        nos_db_v2.add_nosport_binding(PORT, 100, SWITCH, INSTANCE,
+                                      processed=True)
+        nos_db_v2.add_nosport_binding(OTHER_PORT, 100, SWITCH, INSTANCE)
+        nos_db_v2.add_nosport_binding(PORT, 200, SWITCH, INSTANCE)
+        nos_db_v2.add_nosport_binding(PORT, 100, OTHER_SWITCH, INSTANCE)
+
+    def test_switch_vlan_usage(self):
+        self.assertEqual({SWITCH: {100: 2, 200: 1},
+                          OTHER_SWITCH: {100: 1}},
+                         nos_db_v2.get_switch_vlan_usage())
+        self.assertEqual({OTHER_SWITCH: {100: 1}},
+                         nos_db_v2.get_switch_vlan_usage(OTHER_SWITCH))
+
+    def test_interface_vlan_usage(self):
+        self.assertEqual({PORT: {100: (1, 1), 200: (1, 0)},
+                          OTHER_PORT: {100: (1, 0)}},
+                         nos_db_v2.get_interface_vlan_usage(SWITCH))
+        self.assertEqual({}, nos_db_v2.get_interface_vlan_usage('10.0.0.9'))
@@ -0,0 +1,66 @@
+# Copyright (c) 2017, Lenovo.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+from oslo_config import cfg
+
+from neutron.tests import base
+
+from networking_lenovo.ml2 import config  # noqa
+from networking_lenovo.ml2 import exceptions as cexc
+from networking_lenovo.ml2 import nos_deadline
+
+
+class TestDeadline(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestDeadline, self).setUp()
+        self.now = 1000.0
+        mock.patch.object(nos_deadline.time, 'time',
+                          side_effect=lambda: self.now).start()
+
+    def test_remaining(self):
+        deadline = nos_deadline.Deadline(10)
+        self.now += 4
+        self.assertEqual(6, deadline.remaining())
+        self.assertFalse(deadline.expired())
+
+    def test_expired(self):
+        deadline = nos_deadline.Deadline(10)
+        self.now += 11
+        self.assertEqual(0, deadline.remaining())
+        self.assertTrue(deadline.expired())
+        self.assertRaises(cexc.NOSDeadlineExceeded, deadline.check, 'GET')
+
+    def test_for_hook(self):
+        cfg.CONF.set_override('switch_io_deadline', 0, 'ml2_lenovo')
+        self.assertIsNone(nos_deadline.Deadline.for_hook())
+        cfg.CONF.set_override('switch_io_deadline', 20, 'ml2_lenovo')
+        self.assertEqual(20, nos_deadline.Deadline.for_hook().budget)
+
+    def test_bounded_timeout_without_deadline(self):
+        self.assertEqual(30, nos_deadline.bounded_timeout(None, 30, 'GET'))
+
+    def test_bounded_timeout_cut_to_remaining(self):
+        deadline = nos_deadline.Deadline(10)
+        self.assertEqual(5, nos_deadline.bounded_timeout(deadline, 5, 'GET'))
+        self.now += 8
+        self.assertEqual(2, nos_deadline.bounded_timeout(deadline, 5, 'GET'))
+
+    def test_bounded_timeout_cut_off(self):
+        deadline = nos_deadline.Deadline(10)
+        self.now += 10
+        self.assertRaises(cexc.NOSDeadlineExceeded,
+                          nos_deadline.bounded_timeout, deadline, 5, 'GET')
@@ -0,0 +1,111 @@
+# Copyright (c) 2017, Lenovo.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+
+from neutron.tests import base
+
+from networking_lenovo.ml2 import nos_health
+
+NOS_HOST = '10.0.0.1'
+
+
+class TestCircuitBreaker(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestCircuitBreaker, self).setUp()
+        self.now = 1000.0
+        mock.patch.object(nos_health.time, 'time',
+                          side_effect=lambda: self.now).start()
+        self.on_change = mock.Mock()
+        self.breaker = nos_health.CircuitBreaker(NOS_HOST, 3, 60,
+                                                 self.on_change)
+
+    def _fail(self, times):
+        for _i in range(times):
+            self.breaker.failure()
+
+    def test_closed_until_threshold(self):
+        self._fail(2)
+        self.assertEqual(nos_health.CLOSED, self.breaker.state)
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.on_change.called)
+
+    def test_opens_at_threshold(self):
+        self._fail(3)
+        self.assertEqual(nos_health.OPEN, self.breaker.state)
+        self.assertFalse(self.breaker.allow())
+        self.on_change.assert_called_once_with(NOS_HOST, nos_health.CLOSED,
+                                               nos_health.OPEN)
+
+    def test_success_resets_failures(self):
+        self._fail(2)
+        self.breaker.success()
+        self._fail(2)
+        self.assertEqual(nos_health.CLOSED, self.breaker.state)
+
+    def test_half_open_after_reset_timeout(self):
+        self._fail(3)
+        self.now += 59
+        self.assertFalse(self.breaker.allow())
+        self.now += 1
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(nos_health.HALF_OPEN, self.breaker.state)
+
+    def test_half_open_lets_one_trial_through(self):
+        self._fail(3)
+        self.now += 60
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(60, self.breaker.retry_after())
+        # A trial that never reports is replaced after reset_timeout.
+        self.now += 60
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+
+    def test_retry_after(self):
+        self.assertEqual(0, self.breaker.retry_after())
+        self._fail(3)
+        self.now += 20
+        self.assertEqual(40, self.breaker.retry_after())
+
+    def test_half_open_success_closes(self):
+        self._fail(3)
+        self.now += 60
+        self.breaker.allow()
+        self.breaker.success()
+        self.assertEqual(nos_health.CLOSED, self.breaker.state)
+        self.assertEqual(0, self.breaker.failures)
+        self.assertEqual(
+            [mock.call(NOS_HOST, nos_health.CLOSED, nos_health.OPEN),
+             mock.call(NOS_HOST, nos_health.OPEN, nos_health.HALF_OPEN),
+             mock.call(NOS_HOST, nos_health.HALF_OPEN, nos_health.CLOSED)],
+            self.on_change.call_args_list)
+
+    def test_half_open_failure_reopens(self):
+        self._fail(3)
+        self.now += 60
+        self.breaker.allow()
+        self.breaker.failure()
+        self.assertEqual(nos_health.OPEN, self.breaker.state)
+        self.assertEqual(self.now, self.breaker.opened_at)
+        self.now += 59
+        self.assertFalse(self.breaker.allow())
+
+    def test_probe_success_closes_open_breaker(self):
+        self._fail(3)
+        self.breaker.success()
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(nos_health.CLOSED, self.breaker.state)
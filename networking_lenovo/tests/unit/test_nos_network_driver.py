@@ -0,0 +1,193 @@
+# Copyright (c) 2017, Lenovo.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+from oslo_config import cfg
+import requests
+
+from neutron.tests import base
+
+from networking_lenovo.ml2 import exceptions as cexc
+from networking_lenovo.ml2 import nos_health
+from networking_lenovo.ml2 import nos_network_driver
+
+NOS_HOST = '10.0.0.1'
+THRESHOLD = 3
+
+
+class TestSwitchBreaker(base.BaseTestCase):
+    """Outcome of the backend operations fed to the switch breaker."""
+
+    def setUp(self):
+        super(TestSwitchBreaker, self).setUp()
+        cfg.CONF.set_override('switch_breaker_threshold', THRESHOLD,
+                              'ml2_lenovo')
+        cfg.CONF.set_override('switch_down_action', 'fail_fast',
+                              'ml2_lenovo')
+        self.backend = mock.Mock()
+        mock.patch.object(nos_network_driver.LenovoNOSDriver, '_get_driver',
+                          return_value=self.backend).start()
+        self.driver = nos_network_driver.LenovoNOSDriver()
+
+    def _fail(self, exc, times):
+        self.backend.delete_vlan.side_effect = exc
+        for _i in range(times):
+            self.assertRaises(type(exc), self.driver.delete_vlan,
+                              NOS_HOST, 10)
+
+    def _http_error(self, http_code):
+        return cexc.NOSRestHTTPError(http_code=http_code, http_reason='',
+                                     http_op='DELETE', url='vlan/10',
+                                     http_response='')
+
+    def test_breaker_opens_after_repeated_timeouts(self):
+        self._fail(cexc.NOSConfigFailed(
+            config='delete vlan 10', exc=requests.exceptions.Timeout()),
+            THRESHOLD)
+        self.assertEqual({NOS_HOST: nos_health.OPEN},
+                         self.driver.switch_states())
+        self.assertRaises(cexc.NOSSwitchUnavailable,
+                          self.driver.delete_vlan, NOS_HOST, 10)
+        self.assertEqual(THRESHOLD, self.backend.delete_vlan.call_count)
+
+    def test_breaker_opens_after_deadline_exceeded(self):
+        self._fail(cexc.NOSDeadlineExceeded(operation='delete vlan 10',
+                                            budget=1.0),
+                   THRESHOLD)
+        self.assertEqual(nos_health.OPEN,
+                         self.driver.switch_states()[NOS_HOST])
+
+    def test_server_errors_open_breaker(self):
+        self._fail(cexc.NOSConfigFailed(config='delete vlan 10',
+                                        exc=self._http_error(503)),
+                   THRESHOLD)
+        self.assertEqual(nos_health.OPEN,
+                         self.driver.switch_states()[NOS_HOST])
+
+    def test_rejected_requests_keep_breaker_closed(self):
+        self._fail(cexc.NOSConfigFailed(config='delete vlan 10',
+                                        exc=self._http_error(400)),
+                   THRESHOLD * 2)
+        self.assertEqual(nos_health.CLOSED,
+                         self.driver.switch_states()[NOS_HOST])
+
+    def test_answer_resets_failure_count(self):
+        self._fail(cexc.NOSConnectFailed(nos_host=NOS_HOST, exc='refused'),
+                   THRESHOLD - 1)
+        self._fail(cexc.NOSConfigFailed(config='delete vlan 10',
+                                        exc=self._http_error(404)), 1)
+        self._fail(cexc.NOSConnectFailed(nos_host=NOS_HOST, exc='refused'),
+                   THRESHOLD - 1)
+        self.assertEqual(nos_health.CLOSED,
+                         self.driver.switch_states()[NOS_HOST])
+
+    def test_local_errors_leave_breaker_alone(self):
+        self._fail(cexc.NOSConnectFailed(nos_host=NOS_HOST, exc='refused'),
+                   THRESHOLD - 1)
+        self._fail(cexc.NOSConfigFailed(config='delete vlan 10',
+                                        exc=ValueError('bad interface')),
+                   1)
+        self._fail(cexc.NOSConnectFailed(nos_host=NOS_HOST, exc='refused'),
+                   1)
+        self.assertEqual(nos_health.OPEN,
+                         self.driver.switch_states()[NOS_HOST])
+
+
+class TestDeferredReplay(base.BaseTestCase):
+    """Replay of the operations queued while a switch is down."""
+
+    def setUp(self):
+        super(TestDeferredReplay, self).setUp()
+        cfg.CONF.set_override('switch_breaker_threshold', THRESHOLD,
+                              'ml2_lenovo')
+        cfg.CONF.set_override('switch_breaker_reset_timeout', 60,
+                              'ml2_lenovo')
+        cfg.CONF.set_override('switch_down_action', 'defer', 'ml2_lenovo')
+        self.now = 1000.0
+        mock.patch.object(nos_health.time, 'time',
+                          side_effect=lambda: self.now).start()
+        mock.patch.object(nos_network_driver.eventlet, 'spawn_n',
+                          side_effect=lambda f, *args: f(*args)).start()
+        self.spawn_after = mock.patch.object(
+            nos_network_driver.eventlet, 'spawn_after').start()
+        self.sleep = mock.patch.object(nos_network_driver.eventlet,
+                                       'sleep').start()
+        self.backend = mock.Mock()
+        mock.patch.object(nos_network_driver.LenovoNOSDriver, '_get_driver',
+                          return_value=self.backend).start()
+        self.driver = nos_network_driver.LenovoNOSDriver()
+        self.down = cexc.NOSConnectFailed(nos_host=NOS_HOST, exc='refused')
+
+    def _switch_down(self):
+        self.backend.delete_vlan.side_effect = self.down
+        for _i in range(THRESHOLD):
+            self.assertRaises(cexc.NOSConnectFailed,
+                              self.driver.delete_vlan, NOS_HOST, 10)
+        self.backend.delete_vlan.reset_mock()
+
+    def _fire_timer(self):
+        delay, func, nos_host = self.spawn_after.call_args[0]
+        self.spawn_after.reset_mock()
+        self.now += delay
+        func(nos_host)
+
+    def test_replay_armed_while_down(self):
+        self._switch_down()
+        self.assertIs(nos_network_driver.DEFERRED,
+                      self.driver.delete_vlan(NOS_HOST, 11))
+        self.assertFalse(self.backend.delete_vlan.called)
+        self.assertEqual(60, self.spawn_after.call_args[0][0])
+
+        # Still down at the trial: armed again.
+        self._fire_timer()
+        self.assertEqual(1, self.backend.delete_vlan.call_count)
+        self.assertEqual(nos_health.OPEN,
+                         self.driver.switch_states()[NOS_HOST])
+        self.assertEqual(60, self.spawn_after.call_args[0][0])
+
+        # Back up: the queue is replayed without a probe or a new call.
+        self.backend.delete_vlan.side_effect = None
+        self._fire_timer()
+        self.backend.delete_vlan.assert_called_with(NOS_HOST, 11,
+                                                    deadline=None)
+        self.assertEqual(nos_health.CLOSED,
+                         self.driver.switch_states()[NOS_HOST])
+        self.assertFalse(self.spawn_after.called)
+        self.assertEqual(1, self.driver.health_stats['replayed'])
+
+    def test_replay_backs_off_on_transient_failure(self):
+        self._switch_down()
+        self.driver.delete_vlan(NOS_HOST, 11)
+        self.driver.delete_vlan(NOS_HOST, 12)
+        self.backend.delete_vlan.side_effect = [None, self.down, None]
+        self._fire_timer()
+        self.assertEqual(1, self.sleep.call_count)
+        self.assertLessEqual(0, self.sleep.call_args[0][0])
+        self.assertEqual(
+            [mock.call(NOS_HOST, 11, deadline=None),
+             mock.call(NOS_HOST, 12, deadline=None),
+             mock.call(NOS_HOST, 12, deadline=None)],
+            self.backend.delete_vlan.call_args_list)
+        self.assertEqual(2, self.driver.health_stats['replayed'])
+
+    def test_replay_without_breaker_is_armed(self):
+        self._switch_down()
+        self.driver.delete_vlan(NOS_HOST, 11)
+        cfg.CONF.set_override('switch_breaker_threshold', 0, 'ml2_lenovo')
+        self.backend.delete_vlan.side_effect = [self.down, None]
+        self._fire_timer()
+        self.assertTrue(self.spawn_after.called)
+        self._fire_timer()
+        self.assertEqual(1, self.driver.health_stats['replayed'])
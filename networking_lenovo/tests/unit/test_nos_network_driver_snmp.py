@@ -0,0 +1,70 @@
+# Copyright (c) 2017, Lenovo.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+
+from neutron.tests import base
+
+from networking_lenovo.ml2 import config as conf
+from networking_lenovo.ml2 import constants as const
+from networking_lenovo.ml2 import nos_db_v2
+from networking_lenovo.ml2 import nos_network_driver
+from networking_lenovo.ml2 import nos_network_driver_snmp as snmp_driver
+
+NOS_HOST = '10.0.0.1'
+MEMBER_PORTS = [17, 18]
+
+
+class TestSNMPApplyBatch(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestSNMPApplyBatch, self).setUp()
+        mock.patch.object(conf.ML2MechLenovoConfig, 'nos_dict', {}).start()
+        self.driver = snmp_driver.LenovoNOSDriverSNMP()
+        mock.patch.object(self.driver, '_get_oid_table',
+                          return_value=snmp_driver.pegasus_oid).start()
+        mock.patch.object(self.driver, '_get_port_nums',
+                          return_value=MEMBER_PORTS).start()
+        mock.patch.object(nos_db_v2, 'get_port_switch_bindings_count',
+                          return_value=2).start()
+        self.set = mock.patch.object(self.driver, '_set').start()
+        self.apply = mock.patch.object(self.driver, '_apply_config').start()
+
+    def _oid(self, name, vlan_id):
+        return (snmp_driver.oid_enterprise + snmp_driver.pegasus_oid[name] +
+                (vlan_id,))
+
+    def _port_sets(self):
+        return [(oid, int(value))
+                for (nos_host, var_binds), kwargs in self.set.call_args_list
+                for oid, value in var_binds]
+
+    def test_one_varbind_per_oid_and_set(self):
+        self.driver.apply_batch(NOS_HOST, [
+            nos_network_driver.SwitchOperation(
+                const.OP_ENABLE_VLAN, 10, intf_type='portchannel',
+                interface=5),
+            nos_network_driver.SwitchOperation(
+                const.OP_DISABLE_VLAN, 20, intf_type='portchannel',
+                interface=5)])
+        for (nos_host, var_binds), kwargs in self.set.call_args_list:
+            self.assertEqual(1, len(var_binds))
+        self.assertEqual(
+            [(self._oid('vlanNewCfgAddPort', 10), 17),
+             (self._oid('vlanNewCfgAddPort', 10), 18),
+             (self._oid('vlanNewCfgRemovePort', 20), 17),
+             (self._oid('vlanNewCfgRemovePort', 20), 18)],
+            self._port_sets())
+        self.apply.assert_called_once_with(NOS_HOST, deadline=None)
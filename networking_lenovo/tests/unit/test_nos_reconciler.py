@@ -0,0 +1,109 @@
+# Copyright (c) 2017, Lenovo.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+
+import mock
+from oslo_utils import timeutils
+
+from neutron.tests.unit import testlib_api
+
+from networking_lenovo.ml2 import nos_db_v2
+from networking_lenovo.ml2 import nos_reconciler
+
+SWITCH = '10.0.0.1'
+PORT = 'ethernet:1/10'
+INSTANCE = 'instance-1'
+LEASE = 60
+
+
+class TestReconcilerElection(testlib_api.SqlTestCase):
+
+    def _reconciler(self):
+        reconciler = nos_reconciler.LenovoNOSReconciler(mock.Mock())
+        # As started, without the timer.
+        reconciler._lease = LEASE
+        reconciler._timer = mock.Mock()
+        mock.patch.object(reconciler, 'reconcile').start()
+        return reconciler
+
+    def test_single_reconciler_elected(self):
+        first = self._reconciler()
+        second = self._reconciler()
+        first._run()
+        second._run()
+        first._run()
+        self.assertEqual(2, first.reconcile.call_count)
+        self.assertFalse(second.reconcile.called)
+
+    def test_stopped_reconciler_releases_the_lease(self):
+        first = self._reconciler()
+        second = self._reconciler()
+        first._run()
+        first.stop()
+        second._run()
+        self.assertTrue(second.reconcile.called)
+
+    def test_expired_lease_taken_over(self):
+        now = timeutils.utcnow()
+        self.assertTrue(nos_db_v2.acquire_lease('task', 'a', LEASE, now))
+        self.assertFalse(nos_db_v2.acquire_lease('task', 'b', LEASE, now))
+        later = now + datetime.timedelta(seconds=LEASE)
+        self.assertTrue(nos_db_v2.acquire_lease('task', 'b', LEASE, later))
+        self.assertFalse(nos_db_v2.acquire_lease('task', 'a', LEASE, later))
+
+
+class TestStatelessSwitch(testlib_api.SqlTestCase):
+
+    def setUp(self):
+        super(TestStatelessSwitch, self).setUp()
+        # The ids cached by an earlier test are not in this database.
+        nos_db_v2._evict_ids(SWITCH)
+        self.addCleanup(nos_db_v2._evict_ids, SWITCH)
+        self.driver = mock.Mock()
+        self.driver.get_vlan_state.return_value = None
+        self.reconciler = nos_reconciler.LenovoNOSReconciler(self.driver)
+        self.log = mock.patch.object(nos_reconciler, 'LOG').start()
+
+    def test_warned_once(self):
+        nos_db_v2.add_nosport_binding(PORT, 100, SWITCH, INSTANCE,
+                                      processed=True)
+        for run in range(2):
+            report = self.reconciler.reconcile(dry_run=True)
+            self.assertEqual(0, report[SWITCH]['operations'])
+        self.assertEqual(1, self.log.warning.call_count)
+        self.assertIn(SWITCH, self.log.warning.call_args[0])
+
+    def test_unprocessed_bindings_replayed(self):
+        nos_db_v2.add_nosport_binding(PORT, 100, SWITCH, INSTANCE)
+        report = self.reconciler.reconcile(dry_run=True)
+        # The VLAN is created and trunked.
+        self.assertEqual(2, report[SWITCH]['operations'])
+        self.assertEqual(1, report[SWITCH]['bindings_fixed'])
+
+    def test_dry_run_reports_usage(self):
+        nos_db_v2.add_nosport_binding(PORT, 100, SWITCH, INSTANCE,
+                                      processed=True)
+        nos_db_v2.add_nosport_binding(PORT, 200, SWITCH, INSTANCE)
+        report = self.reconciler.reconcile(dry_run=True)[SWITCH]
+        self.assertEqual({100: 1, 200: 1}, report['vlan_usage'])
+        self.assertEqual({PORT: {100: (1, 1), 200: (1, 0)}},
+                         report['interface_vlan_usage'])
+
+    def test_usage_not_reported_when_applied(self):
+        nos_db_v2.add_nosport_binding(PORT, 100, SWITCH, INSTANCE)
+        report = self.reconciler.reconcile(dry_run=False)[SWITCH]
+        self.assertNotIn('vlan_usage', report)
+        self.assertTrue(self.driver.apply_batch.called)
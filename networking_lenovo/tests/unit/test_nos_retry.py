@@ -0,0 +1,90 @@
+# Copyright (c) 2017, Lenovo.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+
+from neutron.tests import base
+
+from networking_lenovo.ml2 import exceptions as cexc
+from networking_lenovo.ml2 import nos_deadline
+from networking_lenovo.ml2 import nos_retry
+
+
+class TestRetryPolicy(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestRetryPolicy, self).setUp()
+        self.sleep = mock.patch.object(nos_retry.eventlet, 'sleep').start()
+        self.policy = nos_retry.RetryPolicy(max_attempts=3, base_delay=0.5,
+                                            max_delay=2.0, jitter=0.0)
+        self.func = mock.Mock()
+
+    def _run(self, **kwargs):
+        return self.policy.run(self.func, 'REST PUT', 'PUT vlan', **kwargs)
+
+    def test_success_is_not_retried(self):
+        self.func.return_value = 'ok'
+        self.assertEqual('ok', self._run())
+        self.assertEqual(1, self.func.call_count)
+        self.assertFalse(self.sleep.called)
+
+    def test_idempotent_request_retried(self):
+        self.func.side_effect = [IOError('timeout'), IOError('timeout'),
+                                 'ok']
+        self.assertEqual('ok', self._run())
+        self.assertEqual(3, self.func.call_count)
+        self.assertEqual([mock.call(0.5), mock.call(1.0)],
+                         self.sleep.call_args_list)
+        self.assertEqual(2, self.policy.stats['REST PUT'])
+
+    def test_gives_up_after_max_attempts(self):
+        self.func.side_effect = IOError('timeout')
+        self.assertRaises(IOError, self._run)
+        self.assertEqual(3, self.func.call_count)
+
+    def test_non_idempotent_request_not_retried(self):
+        self.func.side_effect = IOError('timeout')
+        self.assertRaises(IOError, self._run,
+                          idempotency=nos_retry.NON_IDEMPOTENT)
+        self.assertEqual(1, self.func.call_count)
+        self.assertFalse(self.sleep.called)
+        self.assertFalse(self.policy.stats)
+
+    def test_not_retryable_error_not_retried(self):
+        self.func.side_effect = ValueError('rejected')
+        self.assertRaises(ValueError, self._run,
+                          retryable=lambda e: isinstance(e, IOError))
+        self.assertEqual(1, self.func.call_count)
+
+    def test_deadline_exceeded_not_retried(self):
+        self.func.side_effect = cexc.NOSDeadlineExceeded(operation='PUT',
+                                                         budget=1.0)
+        self.assertRaises(cexc.NOSDeadlineExceeded, self._run)
+        self.assertEqual(1, self.func.call_count)
+
+    def test_no_retry_past_deadline(self):
+        deadline = mock.Mock(spec=nos_deadline.Deadline)
+        deadline.remaining.return_value = 0.4
+        self.func.side_effect = IOError('timeout')
+        self.assertRaises(IOError, self._run, deadline=deadline)
+        self.assertEqual(1, self.func.call_count)
+        self.assertFalse(self.sleep.called)
+
+    def test_delay_capped_and_jittered(self):
+        self.assertEqual(2.0, self.policy.delay(10))
+        policy = nos_retry.RetryPolicy(3, 1.0, 8.0, jitter=0.5)
+        with mock.patch.object(nos_retry.random, 'random',
+                               return_value=1.0):
+            self.assertEqual(1.0, policy.delay(3))
@@ -0,0 +1,155 @@
+# Copyright (c) 2017, Lenovo.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+
+import mock
+from oslo_utils import timeutils
+
+from neutron.tests.unit import testlib_api
+
+from networking_lenovo.ml2 import constants as const
+from networking_lenovo.ml2 import nos_db_v2
+from networking_lenovo.ml2 import nos_vlan_gc
+
+SWITCH = '10.0.0.1'
+PORT = 'ethernet:1/10'
+INSTANCE = 'instance-1'
+GRACE = 60
+LEASE = 300
+
+
+class TestDeferredVlanDeleter(testlib_api.SqlTestCase):
+
+    def setUp(self):
+        super(TestDeferredVlanDeleter, self).setUp()
+        # The ids cached by an earlier test are not in this database.
+        nos_db_v2._evict_ids(SWITCH)
+        self.addCleanup(nos_db_v2._evict_ids, SWITCH)
+        self.driver = mock.Mock()
+        self.deleter = nos_vlan_gc.DeferredVlanDeleter(self.driver, GRACE,
+                                                       batch_size=2,
+                                                       lease=LEASE)
+
+    def _expired(self):
+        return timeutils.utcnow() + datetime.timedelta(seconds=GRACE + 1)
+
+    def _deleted_vlans(self):
+        return [[operation.vlan_id for operation in operations]
+                for (switch_ip, operations), kwargs in
+                self.driver.apply_batch.call_args_list]
+
+    def test_cancel_before_sweep(self):
+        self.deleter.schedule(SWITCH, 100)
+        self.assertEqual([(SWITCH, 100)], self.deleter.pending())
+        self.assertTrue(self.deleter.cancel(SWITCH, 100))
+        self.assertEqual(0, self.deleter.sweep(self._expired()))
+        self.assertFalse(self.driver.apply_batch.called)
+        self.assertEqual([], self.deleter.pending())
+
+    def test_cancel_unknown(self):
+        self.assertFalse(self.deleter.cancel(SWITCH, 100))
+
+    def test_schedule_twice(self):
+        self.deleter.schedule(SWITCH, 100)
+        self.deleter.schedule(SWITCH, 100)
+        self.assertEqual([(SWITCH, 100)], self.deleter.pending(SWITCH))
+
+    def test_sweep_not_expired(self):
+        self.deleter.schedule(SWITCH, 100)
+        self.assertEqual(0, self.deleter.sweep())
+        self.assertFalse(self.driver.apply_batch.called)
+        self.assertEqual([(SWITCH, 100)], self.deleter.pending())
+
+    def test_sweep_expired(self):
+        self.deleter.schedule(SWITCH, 100)
+        self.assertEqual(1, self.deleter.sweep(self._expired()))
+        self.assertEqual([[100]], self._deleted_vlans())
+        operation = self.driver.apply_batch.call_args[0][1][0]
+        self.assertEqual(const.OP_DELETE_VLAN, operation.op)
+        self.assertEqual([], self.deleter.pending())
+        # Once swept, the VLAN is gone from the switch.
+        self.assertFalse(self.deleter.cancel(SWITCH, 100))
+
+    def test_sweep_in_batches(self):
+        for vlan_id in (100, 101, 102):
+            self.deleter.schedule(SWITCH, vlan_id)
+        self.assertEqual(3, self.deleter.sweep(self._expired()))
+        self.assertEqual([[100, 101], [102]], self._deleted_vlans())
+
+    def test_sweep_skips_vlan_bound_again(self):
+        self.deleter.schedule(SWITCH, 100)
+        self.deleter.schedule(SWITCH, 101)
+        nos_db_v2.add_nosport_binding(PORT, 100, SWITCH, INSTANCE)
+        self.assertEqual(1, self.deleter.sweep(self._expired()))
+        self.assertEqual([[101]], self._deleted_vlans())
+        self.assertEqual([], self.deleter.pending())
+
+    def test_failed_delete_is_retried(self):
+        self.deleter.schedule(SWITCH, 100)
+        self.driver.apply_batch.side_effect = IOError('switch down')
+        self.assertEqual(0, self.deleter.sweep(self._expired()))
+        self.assertEqual([(SWITCH, 100)], self.deleter.pending())
+        self.driver.apply_batch.side_effect = None
+        self.assertEqual(1, self.deleter.sweep(self._expired()))
+        self.assertEqual([], self.deleter.pending())
+
+    def test_switch_io_outside_of_transaction(self):
+        self.deleter.schedule(SWITCH, 100)
+        nos_db_v2.schedule_vlan_deletion(
+            SWITCH, 200, self._expired() + datetime.timedelta(days=1))
+
+        def apply_batch(switch_ip, operations):
+            # Other deletions of the switch can be cancelled meanwhile.
+            self.assertTrue(self.deleter.cancel(SWITCH, 200))
+
+        self.driver.apply_batch.side_effect = apply_batch
+        self.assertEqual(1, self.deleter.sweep(self._expired()))
+        self.assertEqual([], self.deleter.pending())
+
+    def test_cancel_waits_for_claimed_deletion(self):
+        self.deleter.schedule(SWITCH, 100)
+        claim_id, vlan_ids, claimed = nos_db_v2.claim_vlan_deletions(
+            SWITCH, self._expired(), 10, LEASE)
+        self.assertEqual([100], vlan_ids)
+        # Only nos_db_v2's own reference: the eventlet hub sleeps too.
+        sleep = mock.patch.object(nos_db_v2, 'time').start().sleep
+        sleep.side_effect = (
+            lambda delay: nos_db_v2.complete_vlan_deletions(claim_id))
+        # The sweep deleted the VLAN: it must be created again.
+        self.assertFalse(self.deleter.cancel(SWITCH, 100))
+        self.assertTrue(sleep.called)
+
+    def test_cancel_after_released_claim(self):
+        self.deleter.schedule(SWITCH, 100)
+        claim_id, vlan_ids, claimed = nos_db_v2.claim_vlan_deletions(
+            SWITCH, self._expired(), 10, LEASE)
+        sleep = mock.patch.object(nos_db_v2, 'time').start().sleep
+        sleep.side_effect = (
+            lambda delay: nos_db_v2.release_vlan_deletions(claim_id))
+        # A failed sweep may have deleted the VLAN or not.
+        self.assertFalse(self.deleter.cancel(SWITCH, 100))
+        self.assertTrue(sleep.called)
+        self.assertEqual([], self.deleter.pending())
+
+    def test_expired_claim_taken_over(self):
+        self.deleter.schedule(SWITCH, 100)
+        now = self._expired()
+        nos_db_v2.claim_vlan_deletions(SWITCH, now, 10, LEASE)
+        self.assertEqual(0, self.deleter.sweep(now))
+        self.assertFalse(self.driver.apply_batch.called)
+        later = now + datetime.timedelta(seconds=LEASE)
+        self.assertEqual(1, self.deleter.sweep(later))
+        self.assertEqual([[100]], self._deleted_vlans())
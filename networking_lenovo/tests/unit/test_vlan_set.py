@@ -0,0 +1,84 @@
+# Copyright (c) 2017, Lenovo.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from neutron.tests import base
+
+from networking_lenovo.ml2 import vlan_set
+
+
+class TestVlanSet(base.BaseTestCase):
+
+    def test_from_range(self):
+        vlans = vlan_set.VlanSet.from_range(10, 12)
+        self.assertEqual([10, 11, 12], list(vlans))
+        self.assertEqual(3, len(vlans))
+        self.assertEqual(10, vlans.first())
+
+    def test_from_ranges(self):
+        vlans = vlan_set.VlanSet.from_ranges("1, 10-20,30,")
+        self.assertEqual(13, len(vlans))
+        self.assertIn(15, vlans)
+        self.assertNotIn(21, vlans)
+        self.assertEqual("1,10-20,30", vlans.to_ranges())
+        self.assertEqual([(1, 1), (10, 20), (30, 30)], vlans.ranges())
+
+    def test_out_of_range(self):
+        self.assertRaises(ValueError, vlan_set.VlanSet, [4096])
+        self.assertRaises(ValueError, vlan_set.VlanSet.from_range, 1, 4096)
+        vlans = vlan_set.VlanSet([10])
+        self.assertNotIn(4096, vlans)
+        self.assertNotIn(-1, vlans)
+        self.assertNotIn('x', vlans)
+
+    def test_from_cnos_all(self):
+        vlans = vlan_set.VlanSet.from_cnos("all")
+        self.assertEqual(vlan_set.VlanSet.from_range(1, 4094), vlans)
+        self.assertNotIn(4095, vlans)
+        self.assertEqual("1-4094", vlans.to_ranges())
+
+    def test_from_cnos_none(self):
+        vlans = vlan_set.VlanSet.from_cnos("none")
+        self.assertFalse(vlans)
+        self.assertEqual(0, len(vlans))
+        self.assertIsNone(vlans.first())
+        self.assertEqual("", vlans.to_ranges())
+
+    def test_from_cnos_list(self):
+        self.assertEqual(vlan_set.VlanSet([1, 5]),
+                         vlan_set.VlanSet.from_cnos([5, 1]))
+        self.assertRaises(ValueError, vlan_set.VlanSet.from_cnos, "1-5")
+
+    def test_from_cnos_copies(self):
+        vlans = vlan_set.VlanSet([5])
+        copy = vlan_set.VlanSet.from_cnos(vlans)
+        copy.add(6)
+        self.assertEqual(vlan_set.VlanSet([5]), vlans)
+
+    def test_complement(self):
+        vlans = vlan_set.VlanSet.from_ranges("2-4094")
+        self.assertEqual([1], list(vlans.complement()))
+        self.assertFalse(vlan_set.VlanSet.cnos_all().complement())
+
+    def test_set_operations(self):
+        a = vlan_set.VlanSet([1, 2, 3])
+        b = vlan_set.VlanSet([3, 4])
+        self.assertEqual(vlan_set.VlanSet([1, 2, 3, 4]), a | b)
+        self.assertEqual(vlan_set.VlanSet([3]), a & [3, 4])
+        self.assertEqual(vlan_set.VlanSet([1, 2]), a - b)
+        a |= [10]
+        a -= b
+        self.assertEqual("1-2,10", a.to_ranges())
+        a.discard(1)
+        self.assertEqual([2, 10], list(a))
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# Copyright (c) 2017, Lenovo.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Latency of the mechanism driver binding lookups before and after the
+binding indexes of migrations 0003, 0004 and 0007, on an in-memory
+SQLite bindings table.
+
+    python tools/benchmark_binding_indexes.py [--rows 1000000]
+"""
+
+from __future__ import print_function
+
+import argparse
+import random
+import sqlite3
+import time
+
+TABLE = 'lenovo_ml2_nosport_bindings'
+
+# The lookups done by nos_db_v2 on the port hooks, once the switch_ip
+# and port_id of the filter are replaced by the switch and interface ids.
+QUERIES = [
+    ('get_nosvlan_binding',
+     'vlan_id = :vlan_id AND switch_id = :switch_id'),
+    ('get_port_switch_bindings',
+     'switch_id = :switch_id AND interface_id = :interface_id'),
+    ('get_port_vlan_switch_binding',
+     'switch_id = :switch_id AND interface_id = :interface_id '
+     'AND vlan_id = :vlan_id'),
+    ('get_nosport_binding',
+     'switch_id = :switch_id AND interface_id = :interface_id '
+     'AND vlan_id = :vlan_id AND instance_id = :instance_id'),
+    ('get_nosvm_bindings',
+     'instance_id = :instance_id AND vlan_id = :vlan_id'),
+]
+
+# The indexes of nos_models_v2.NOSPortBinding, except those of the
+# stale binding sweeper.
+INDEXES = [
+    'CREATE UNIQUE INDEX uniq_lenovo_nosport_bindings0binding ON %s '
+    '(switch_id, interface_id, vlan_id, instance_id)' % TABLE,
+    'CREATE INDEX ix_lenovo_nosport_bindings_switch_ip_port_id ON %s '
+    '(switch_ip, port_id)' % TABLE,
+    'CREATE INDEX ix_lenovo_nosport_bindings_instance_id_vlan_id ON %s '
+    '(instance_id, vlan_id)' % TABLE,
+    'CREATE INDEX ix_lenovo_nosport_bindings_switch_id_vlan_id ON %s '
+    '(switch_id, vlan_id)' % TABLE,
+    'CREATE INDEX ix_lenovo_nosport_bindings_interface_id_vlan_id ON %s '
+    '(interface_id, vlan_id)' % TABLE,
+]
+
+COLUMNS = ('port_id', 'vlan_id', 'switch_ip', 'instance_id', 'switch_id',
+           'interface_id')
+
+
+def populate(conn, rows, switches, ports):
+    conn.execute('CREATE TABLE %s ('
+                 'binding_id INTEGER PRIMARY KEY, '
+                 'port_id VARCHAR(255), '
+                 'vlan_id INTEGER NOT NULL, '
+                 'switch_ip VARCHAR(255), '
+                 'instance_id VARCHAR(255), '
+                 'processed BOOLEAN NOT NULL, '
+                 'switch_id INTEGER, '
+                 'interface_id INTEGER)' % TABLE)
+
+    def bindings():
+        for i in range(rows):
+            switch = i // ports % switches
+            port = i % ports
+            yield ('port:%d' % (port + 1),
+                   i // (switches * ports) % 4000 + 1,
+                   '10.0.%d.%d' % divmod(switch, 256),
+                   'instance-%08d' % (i // 2),
+                   True,
+                   switch + 1,
+                   switch * ports + port + 1)
+
+    conn.executemany('INSERT INTO %s (%s, processed, switch_id, '
+                     'interface_id) VALUES (?, ?, ?, ?, ?, ?, ?)' %
+                     (TABLE, ', '.join(COLUMNS[:4])), bindings())
+    conn.commit()
+
+
+def samples(conn, count):
+    rows = conn.execute('SELECT %s FROM %s' %
+                        (', '.join(COLUMNS), TABLE)).fetchall()
+    return [dict(zip(COLUMNS, row)) for row in random.sample(rows, count)]
+
+
+def measure(conn, params):
+    results = {}
+    for name, where in QUERIES:
+        sql = 'SELECT * FROM %s WHERE %s' % (TABLE, where)
+        start = time.time()
+        for param in params:
+            conn.execute(sql, param).fetchall()
+        results[name] = (time.time() - start) / len(params) * 1000.0
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--switches', type=int, default=64)
+    parser.add_argument('--ports', type=int, default=48)
+    parser.add_argument('--lookups', type=int, default=20)
+    args = parser.parse_args()
+
+    random.seed(0)
+    conn = sqlite3.connect(':memory:')
+    populate(conn, args.rows, args.switches, args.ports)
+    params = samples(conn, args.lookups)
+
+    before = measure(conn, params)
+    for sql in INDEXES:
+        conn.execute(sql)
+    after = measure(conn, params)
+
+    print('%d bindings, mean latency of %d lookups (ms)' %
+          (args.rows, args.lookups))
+    print('%-30s %12s %12s' % ('lookup', 'before', 'after'))
+    for name, where in QUERIES:
+        print('%-30s %12.3f %12.3f' % (name, before[name], after[name]))
+
+
+if __name__ == '__main__':
+    main()